@@ -0,0 +1,67 @@
+"""
+Benchmark the per-call overhead of a fresh OpenAI client against the pooled client from the registry.
+
+The benchmark starts a local stub of the chat completion endpoint, so that no API key or network access is needed.
+Both variants send the same number of requests to the stub server. The difference of the mean latencies is the
+connection setup that the pooled client saves on every call.
+
+Usage (from the tracex_project directory):
+python -m benchmarks.benchmark_llm_client [--calls 200]
+"""
+import argparse
+import os
+import statistics
+import time
+
+import httpx
+from openai import OpenAI
+
+from tracex.logic import llm_client
+from tracex.logic.llm_backend import StubServer
+
+MESSAGES = [{"role": "user", "content": "went to the doctor"}]
+
+
+def measure(make_client, calls: int) -> list[float]:
+    """Send a number of requests with clients returned by make_client and return the latencies in milliseconds."""
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        make_client().chat.completions.create(model="gpt-3.5-turbo", messages=MESSAGES)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return latencies
+
+
+def main():
+    """Run the benchmark and print the mean and median latency of both variants."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    server = StubServer(content="Doctor Visit").start()
+    base_url = server.base_url
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+    def fresh_client():
+        return OpenAI(api_key="benchmark", base_url=base_url, http_client=httpx.Client())
+
+    try:
+        results = {
+            "fresh client per call": measure(fresh_client, args.calls),
+            "pooled client": measure(llm_client.get_client, args.calls),
+        }
+    finally:
+        llm_client.reset_clients()
+        server.stop()
+
+    for name, latencies in results.items():
+        print(
+            f"{name:<24} mean {statistics.mean(latencies):7.3f} ms"
+            f"  median {statistics.median(latencies):7.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
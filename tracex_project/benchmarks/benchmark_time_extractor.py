@@ -0,0 +1,116 @@
+"""
+Benchmark the post-processing and duration calculation of the TimeExtractor on large DataFrames.
+
+The vectorized TimeExtractor.finalize is compared against the former row-wise implementation, which is kept below as
+a reference. Both run on the same randomly generated dates, including missing and unparsable ones, and the benchmark
+fails if their outputs are not identical. No API key or network access is needed.
+
+Usage (from the tracex_project directory):
+python -m benchmarks.benchmark_time_extractor [--rows 100000] [--seed 0]
+"""
+import argparse
+import os
+import time
+
+import django
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tracex.settings")
+django.setup()
+
+from extraction.logic.modules import TimeExtractor  # pylint: disable=wrong-import-position
+
+
+def make_dates(rows: int, seed: int) -> pd.DataFrame:
+    """Generate a DataFrame of activities with start and end dates as returned by the model."""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 3 * 365 * 24 * 60, rows), unit="min")
+    end = start + pd.to_timedelta(rng.integers(-2 * 24 * 60, 30 * 24 * 60, rows), unit="min")
+    df = pd.DataFrame(
+        {
+            "activity": [f"activity {index}" for index in range(rows)],
+            "sentence_id": rng.integers(0, 50, rows).astype(str),
+            "time:timestamp": start.strftime("%Y%m%dT%H%M"),
+            "time:end_timestamp": end.strftime("%Y%m%dT%H%M"),
+        }
+    )
+    for column, share in (("time:timestamp", 0.1), ("time:end_timestamp", 0.2)):
+        missing = rng.random(rows) < share
+        df.loc[missing, column] = rng.choice(["N/A", "not mentioned"], missing.sum())
+
+    return df
+
+
+def legacy_finalize(df: pd.DataFrame) -> pd.DataFrame:
+    """Row-wise post-processing and duration calculation of the TimeExtractor before vectorization."""
+
+    def convert_to_datetime(_df: pd.DataFrame, column: str) -> pd.DataFrame:
+        _df[column] = pd.to_datetime(_df[column], format="%Y%m%dT%H%M", errors="coerce")
+
+        return _df
+
+    def set_default_date_if_na(_df: pd.DataFrame, column: str) -> pd.DataFrame:
+        if _df[column].isna().all():
+            _df[column] = _df[column].fillna(pd.Timestamp("2020-01-01 00:00"))
+
+        return _df
+
+    def fill_missing_values(_df: pd.DataFrame, column: str) -> pd.DataFrame:
+        _df[column] = _df[column].ffill().bfill()
+
+        return _df
+
+    def fix_end_dates(row: pd.Series) -> pd.Series:
+        if row["time:end_timestamp"] is pd.NaT and row["time:timestamp"] is not pd.NaT:
+            row["time:end_timestamp"] = row["time:timestamp"]
+
+        return row
+
+    def calculate_duration(row: pd.Series) -> str:
+        duration = row["time:end_timestamp"] - row["time:timestamp"]
+        hours, remainder = divmod(duration.total_seconds(), 3600)
+        minutes, seconds = divmod(remainder, 60)
+
+        return f"{int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}"
+
+    df = convert_to_datetime(df, "time:timestamp")
+    df = convert_to_datetime(df, "time:end_timestamp")
+    df = set_default_date_if_na(df, "time:timestamp")
+    df = df.apply(fix_end_dates, axis=1)
+    df = set_default_date_if_na(df, "time:end_timestamp")
+    df = fill_missing_values(df, "time:timestamp")
+    df = fill_missing_values(df, "time:end_timestamp")
+    df["time:duration"] = df.apply(calculate_duration, axis=1)
+
+    return df
+
+
+def measure(finalize, df: pd.DataFrame) -> tuple[pd.DataFrame, float]:
+    """Run finalize on a copy of the DataFrame and return its result and the elapsed time in seconds."""
+    df = df.copy()
+    start = time.perf_counter()
+    result = finalize(df)
+
+    return result, time.perf_counter() - start
+
+
+def main():
+    """Run the benchmark, check that both implementations return identical output and print their run times."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    df = make_dates(args.rows, args.seed)
+    legacy_result, legacy_seconds = measure(legacy_finalize, df)
+    vectorized_result, vectorized_seconds = measure(TimeExtractor().finalize, df)
+    pd.testing.assert_frame_equal(vectorized_result, legacy_result)
+
+    print(f"{args.rows} rows, identical output")
+    print(f"{'row-wise':<12} {legacy_seconds:9.3f} s")
+    print(f"{'vectorized':<12} {vectorized_seconds:9.3f} s  ({legacy_seconds / vectorized_seconds:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ from typing import Union
 
 from django.contrib import admin
 
-from extraction.models import Event, PatientJourney, Prompt, Trace, Cohort, Metric
+from extraction.models import Event, PatientJourney, Prompt, Trace, Cohort, Metric, LocationMemo, ExtractionJob
 
 
 class CohortInline(admin.StackedInline):
@@ -101,3 +101,5 @@ class EventAdmin(admin.ModelAdmin):
 admin.site.register(Metric)
 admin.site.register(Prompt)
 admin.site.register(Cohort)
+admin.site.register(LocationMemo)
+admin.site.register(ExtractionJob)
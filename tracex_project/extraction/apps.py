@@ -16,3 +16,7 @@ class ExtractionConfig(AppConfig):
 
     default_auto_field = "django.db.models.BigAutoField"
     name = "extraction"
+
+    def ready(self):
+        """Connect the signal receivers that clear the prompt registry when a Prompt changes."""
+        from extraction.logic import prompt_registry  # pylint: disable=import-outside-toplevel, unused-import
@@ -0,0 +1,122 @@
+"""
+Provide the extraction of traces from many Patient Journeys at once, used by the management command extract_batch.
+
+Every Patient Journey is extracted by its own orchestrator, either in the current process or in a pool of processes,
+and its trace is saved with Orchestrator.save_results_to_db. Saved traces carry the fingerprint of the configuration
+they were extracted with, so that Patient Journeys already extracted with the same configuration can be skipped.
+
+Functions:
+get_batch_configuration -- Return the configuration used to extract Patient Journeys with the given modules.
+get_extracted_patient_journey_ids -- Return the ids of the Patient Journeys with a trace for a configuration.
+extract_patient_journey -- Extract and save the trace of a Patient Journey and return the outcome.
+run_batch -- Extract the traces of several Patient Journeys and yield the outcomes as they finish.
+"""
+import multiprocessing
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+import django
+from django.db import connections, transaction
+
+from extraction.logic.orchestrator import ExtractionConfiguration, Orchestrator
+from extraction.models import PatientJourney, Trace
+
+
+def get_batch_configuration(modules: List[str], patient_journey: Optional[str] = None) -> ExtractionConfiguration:
+    """
+    Return the configuration used to extract a Patient Journey with the given modules.
+
+    Positional Arguments:
+    modules -- Keys of the modules to run.
+
+    Keyword Arguments:
+    patient_journey -- Text of the Patient Journey. Default is None.
+    """
+    configuration = ExtractionConfiguration(patient_journey=patient_journey)
+    configuration.update(
+        modules={key: module for key, module in configuration.modules.items() if key in modules}
+    )
+
+    return configuration
+
+
+def get_extracted_patient_journey_ids(fingerprint: str) -> Set[int]:
+    """Return the ids of the Patient Journeys that have a trace extracted with the configuration fingerprint."""
+    return set(
+        Trace.manager.filter(config_fingerprint=fingerprint).values_list("patient_journey_id", flat=True)
+    )
+
+
+def extract_patient_journey(patient_journey_id: int, modules: List[str]) -> Dict[str, Any]:
+    """
+    Extract and save the trace of a Patient Journey and return the outcome.
+
+    The outcome contains the id of the saved trace, the used tokens and estimated cost of the run, the duration in
+    seconds and the traceback if the extraction failed. The trace is saved in one transaction, so that a failed run
+    leaves no partial trace that would be skipped on resume.
+
+    Positional Arguments:
+    patient_journey_id -- Id of the Patient Journey to extract.
+    modules -- Keys of the modules to run.
+    """
+    started = time.perf_counter()
+    outcome = {
+        "patient_journey": patient_journey_id,
+        "trace": None,
+        "used_tokens": 0,
+        "estimated_cost": 0.0,
+        "seconds": 0.0,
+        "error": None,
+    }
+    orchestrator = None
+    try:
+        patient_journey = PatientJourney.manager.get(pk=patient_journey_id)
+        orchestrator = Orchestrator(get_batch_configuration(modules, patient_journey.patient_journey))
+        orchestrator.set_db_objects_id("patient_journey", patient_journey.id)
+        orchestrator.run()
+        with transaction.atomic():
+            outcome["trace"] = orchestrator.save_results_to_db().id
+    except Exception:  # pylint: disable=broad-except
+        outcome["error"] = traceback.format_exc()
+
+    report = orchestrator.get_token_report() if orchestrator is not None else None
+    if report is not None:
+        outcome["used_tokens"] = report["used_tokens"]
+        outcome["estimated_cost"] = report["estimated_cost"]
+    outcome["seconds"] = time.perf_counter() - started
+
+    return outcome
+
+
+def run_batch(patient_journey_ids: Iterable[int], modules: List[str], processes: int = 1) -> Iterator[Dict[str, Any]]:
+    """
+    Extract the traces of several Patient Journeys and yield the outcomes as they finish.
+
+    With more than one process, the Patient Journeys are extracted in a pool of processes that set up Django on their
+    own and open their own database connections.
+
+    Positional Arguments:
+    patient_journey_ids -- Ids of the Patient Journeys to extract.
+    modules -- Keys of the modules to run.
+
+    Keyword Arguments:
+    processes -- Number of Patient Journeys extracted at the same time. Default is 1.
+    """
+    if processes <= 1:
+        for patient_journey_id in patient_journey_ids:
+            yield extract_patient_journey(patient_journey_id, modules)
+        return
+
+    # Connections must not be shared with the child processes.
+    connections.close_all()
+    with ProcessPoolExecutor(
+        max_workers=processes, mp_context=multiprocessing.get_context("spawn"), initializer=django.setup
+    ) as executor:
+        futures = [
+            executor.submit(extract_patient_journey, patient_journey_id, modules)
+            for patient_journey_id in patient_journey_ids
+        ]
+        for future in as_completed(futures):
+            yield future.result()
@@ -0,0 +1,106 @@
+"""
+Provide checkpoints of extraction runs, so that a failed or re-submitted run resumes after its last completed module.
+
+After every module, the orchestrator stores the module's output, i.e. the preprocessed Patient Journey, the cohort or
+the columns of the DataFrame the module writes, keyed by the run id and the module. The checkpoints are gzip-compressed
+pickles in one directory per run. Directories of runs whose checkpoints were not written for the retention period are
+removed by the garbage collection, which runs whenever an orchestrator starts a run.
+
+Classes:
+CheckpointStore -- Store of the checkpoints of extraction runs on the local disk.
+"""
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import pandas as pd
+from django.conf import settings
+
+from tracex.logic.constants import CHECKPOINT_DIRECTORY, CHECKPOINT_RETENTION
+
+
+class CheckpointStore:
+    """
+    Store of the checkpoints of extraction runs on the local disk.
+
+    Public Methods:
+    save -- Store the checkpoint of a module of a run.
+    load -- Return the checkpoint of a module of a run, or None if there is none.
+    remove -- Remove all checkpoints of a run.
+    collect_garbage -- Remove the checkpoints of runs that were not written for the retention period.
+    """
+
+    def __init__(self, directory: Optional[Path] = None, retention: float = CHECKPOINT_RETENTION):
+        self.directory = Path(directory or CHECKPOINT_DIRECTORY or settings.BASE_DIR / "checkpoints")
+        self.retention = retention
+
+    def save(self, run_id: str, module_key: str, checkpoint: Dict[str, Any]) -> bool:
+        """
+        Store the checkpoint of a module of a run and return whether it was written. The checkpoint is written to a
+        temporary file first, so that an interrupted write never leaves a truncated checkpoint.
+
+        Positional Arguments:
+        run_id -- Id of the run.
+        module_key -- Key of the module, as in the configuration of the orchestrator.
+        checkpoint -- Picklable checkpoint of the module.
+        """
+        path = self.__get_path(run_id, module_key)
+        temporary_path = path.with_name(f"{path.name}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            pd.to_pickle(checkpoint, temporary_path, compression="gzip")
+            os.replace(temporary_path, path)
+        except OSError:
+            # Checkpoints only save work on a later run, so failing to write one must not fail the current run.
+            return False
+
+        return True
+
+    def load(self, run_id: str, module_key: str) -> Optional[Dict[str, Any]]:
+        """Return the checkpoint of a module of a run, or None if there is none or it cannot be read."""
+        path = self.__get_path(run_id, module_key)
+        if not path.exists():
+            return None
+        try:
+            return pd.read_pickle(path, compression="gzip")
+        except Exception:  # pylint: disable=broad-except
+            return None
+
+    def remove(self, run_id: str) -> None:
+        """Remove all checkpoints of a run."""
+        shutil.rmtree(self.__get_run_directory(run_id), ignore_errors=True)
+
+    def collect_garbage(self) -> int:
+        """Remove the checkpoints of runs that were not written for the retention period and return their number."""
+        if not self.directory.is_dir():
+            return 0
+
+        expiry = time.time() - self.retention
+        removed_runs = 0
+        for run_directory in self.directory.iterdir():
+            try:
+                expired = run_directory.is_dir() and run_directory.stat().st_mtime < expiry
+            except OSError:
+                continue
+            if expired:
+                shutil.rmtree(run_directory, ignore_errors=True)
+                removed_runs += 1
+
+        return removed_runs
+
+    def __get_run_directory(self, run_id: str) -> Path:
+        """Return the directory of the checkpoints of a run, refusing run ids that are not a plain file name."""
+        if not re.fullmatch(r"[\w-]+", run_id):
+            raise ValueError(f"Invalid run id for checkpoints: {run_id!r}")
+
+        return self.directory / run_id
+
+    def __get_path(self, run_id: str, module_key: str) -> Path:
+        """Return the path of the checkpoint of a module of a run."""
+        return self.__get_run_directory(run_id) / f"{module_key}.pkl.gz"
+
+
+checkpoint_store = CheckpointStore()
@@ -0,0 +1,235 @@
+"""
+Provide a database-backed queue of extraction runs that are executed in the background by extraction workers.
+
+The web interface enqueues an ExtractionJob with the configuration of a run and returns immediately. Workers, started
+with the management command run_extraction_workers in one or several processes on one or several hosts, claim queued
+jobs, run the orchestrator and store the progress and the result in the job. A job is claimed by locking its row with
+SELECT ... FOR UPDATE SKIP LOCKED where the database supports it, followed by a conditional update of its status, so
+that every job is executed by exactly one worker. While a job runs, a thread of its worker refreshes the heartbeat of
+the job every EXTRACTION_JOB_HEARTBEAT_INTERVAL seconds, independently of the progress of the run, so that modules
+running for a long time without progress keep their job. Only running jobs without a heartbeat for
+EXTRACTION_JOB_STALE_AFTER seconds, i.e. whose worker was stopped, can be claimed again.
+
+Functions:
+enqueue_job -- Enqueue the run of an orchestrator as an extraction job.
+claim_job -- Claim the oldest claimable job for a worker.
+execute_job -- Run the orchestrator for a claimed job and store the result or the error in the job.
+build_job_orchestrator -- Build an orchestrator for the run of a job from the configuration of the job.
+apply_job_result -- Set the data and cohort of an orchestrator to the result of a job.
+run_worker -- Claim and execute jobs until stopped.
+"""
+import json
+import threading
+import time
+import traceback
+from datetime import timedelta
+from io import StringIO
+from typing import Optional
+
+import pandas as pd
+from django.db import DatabaseError, close_old_connections, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from extraction.logic.orchestrator import ExtractionConfiguration, Orchestrator
+from extraction.models import ExtractionJob
+from tracex.logic.constants import (
+    EXTRACTION_JOB_HEARTBEAT_INTERVAL,
+    EXTRACTION_JOB_STALE_AFTER,
+    EXTRACTION_WORKER_POLL_INTERVAL,
+)
+
+DATE_COLUMNS = ["time:timestamp", "time:end_timestamp"]
+
+
+def enqueue_job(orchestrator: Orchestrator, save_results: bool = False) -> ExtractionJob:
+    """
+    Enqueue the run of an orchestrator as an extraction job.
+
+    Positional Arguments:
+    orchestrator -- Orchestrator whose configuration and Patient Journey are run by the job.
+
+    Keyword Arguments:
+    save_results -- Whether the worker saves the extracted trace to the database. Default is False.
+    """
+    configuration = orchestrator.get_configuration()
+
+    return ExtractionJob.manager.create(
+        configuration={
+            "patient_journey": configuration.patient_journey,
+            "event_types": configuration.event_types,
+            "locations": configuration.locations,
+            "activity_key": configuration.activity_key,
+            "modules": list(configuration.modules),
+            "run_id": orchestrator.run_id,
+        },
+        patient_journey_id=orchestrator.db_objects_id.get("patient_journey"),
+        save_results=save_results,
+    )
+
+
+def claim_job(worker: str) -> Optional[ExtractionJob]:
+    """
+    Claim the oldest queued or stale job for a worker, or return None if there is none. A running job is stale if its
+    worker did not send a heartbeat for EXTRACTION_JOB_STALE_AFTER seconds.
+
+    Positional Arguments:
+    worker -- Name of the worker, stored in the job.
+    """
+    stale_before = timezone.now() - timedelta(seconds=EXTRACTION_JOB_STALE_AFTER)
+    claimable = Q(status=ExtractionJob.QUEUED) | Q(status=ExtractionJob.RUNNING, heartbeat__lt=stale_before)
+    with transaction.atomic():
+        job = (
+            ExtractionJob.manager.select_for_update(skip_locked=True)
+            .filter(claimable)
+            .order_by("created_at", "id")
+            .first()
+        )
+        if job is None:
+            return None
+        now = timezone.now()
+        # The conditional update keeps the claim exclusive on databases without row locks, like SQLite.
+        claimed = ExtractionJob.manager.filter(claimable, pk=job.pk).update(
+            status=ExtractionJob.RUNNING,
+            worker=worker,
+            progress=0,
+            status_message=None,
+            started_at=now,
+            heartbeat=now,
+            last_modified=now,
+        )
+    if not claimed:
+        return None
+    job.refresh_from_db()
+
+    return job
+
+
+def execute_job(job: ExtractionJob) -> None:
+    """
+    Run the orchestrator for a claimed job and store the result or the error in the job.
+
+    The progress of the run is written to the job whenever a module starts, and the heartbeat of the job is refreshed
+    in the background while the run is executing. The result contains the extracted data and the cohort, and if the job
+    saves its results, the job points to the saved trace. Updates are only written while the job is still claimed by
+    the worker that executes it.
+
+    Positional Arguments:
+    job -- Job claimed by the current worker.
+    """
+    claimed_job = ExtractionJob.manager.filter(pk=job.pk, worker=job.worker)
+    orchestrator = build_job_orchestrator(job)
+
+    def update_job_progress(percentage: int, module_name: str) -> None:
+        claimed_job.update(progress=percentage, status_message=module_name[:200], last_modified=timezone.now())
+
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(target=_send_heartbeats, args=(claimed_job, stop_heartbeat), daemon=True)
+    heartbeat.start()
+    try:
+        orchestrator.run(on_progress=update_job_progress)
+        trace = orchestrator.save_results_to_db() if job.save_results else None
+    except Exception:  # pylint: disable=broad-except
+        claimed_job.update(
+            status=ExtractionJob.FAILED,
+            error=traceback.format_exc(),
+            finished_at=timezone.now(),
+            last_modified=timezone.now(),
+        )
+        return
+    finally:
+        stop_heartbeat.set()
+        heartbeat.join()
+
+    data = orchestrator.get_data()
+    claimed_job.update(
+        status=ExtractionJob.SUCCEEDED,
+        progress=100,
+        status_message=None,
+        result={
+            "data": None if data is None else json.loads(data.to_json(orient="split", date_format="iso")),
+            "cohort": orchestrator.get_cohort(),
+        },
+        trace=trace,
+        finished_at=timezone.now(),
+        last_modified=timezone.now(),
+    )
+
+
+def build_job_orchestrator(job: ExtractionJob) -> Orchestrator:
+    """
+    Build an orchestrator for the run of a job from the configuration of the job. The orchestrator has the run id of
+    the job, which lets a job resume from the checkpoints of an earlier, failed job of the same run.
+    """
+    configuration = ExtractionConfiguration(
+        patient_journey=job.configuration["patient_journey"],
+        event_types=job.configuration["event_types"],
+        locations=job.configuration["locations"],
+        activity_key=job.configuration["activity_key"],
+    )
+    orchestrator = Orchestrator(configuration, run_id=job.configuration.get("run_id"))
+    orchestrator.reduce_modules_to(job.configuration["modules"])
+    if job.patient_journey_id is not None:
+        orchestrator.set_db_objects_id("patient_journey", job.patient_journey_id)
+
+    return orchestrator
+
+
+def _send_heartbeats(claimed_job, stop_event: threading.Event) -> None:
+    """Refresh the heartbeat of a claimed job every EXTRACTION_JOB_HEARTBEAT_INTERVAL seconds until the event is set."""
+    try:
+        while not stop_event.wait(EXTRACTION_JOB_HEARTBEAT_INTERVAL):
+            try:
+                claimed_job.update(heartbeat=timezone.now())
+            except DatabaseError:
+                # A locked database only delays the heartbeat, the next one is sent after the interval.
+                continue
+    finally:
+        connections.close_all()
+
+
+def apply_job_result(orchestrator: Orchestrator, job: ExtractionJob) -> None:
+    """Set the data and cohort of an orchestrator to the result of a succeeded job."""
+    data = job.result["data"]
+    if data is not None:
+        data = pd.read_json(StringIO(json.dumps(data)), orient="split", dtype=False, convert_dates=False)
+        for column in DATE_COLUMNS:
+            if column in data.columns:
+                data[column] = pd.to_datetime(data[column])
+    orchestrator.set_data(data)
+    orchestrator.set_cohort(job.result["cohort"])
+
+
+def run_worker(
+    worker: str,
+    poll_interval: float = EXTRACTION_WORKER_POLL_INTERVAL,
+    once: bool = False,
+    stop_event: Optional[threading.Event] = None,
+) -> int:
+    """
+    Claim and execute jobs until the stop event is set, and return the number of executed jobs.
+
+    Positional Arguments:
+    worker -- Name of the worker, stored in the claimed jobs.
+
+    Keyword Arguments:
+    poll_interval -- Seconds to wait before looking for new jobs in an empty queue. Default is specified as a constant.
+    once -- Whether to stop as soon as the queue is empty. Default is False.
+    stop_event -- Event that stops the worker after the current job. Default is None.
+    """
+    executed_jobs = 0
+    while stop_event is None or not stop_event.is_set():
+        close_old_connections()
+        job = claim_job(worker)
+        if job is None:
+            if once:
+                break
+            if stop_event is not None:
+                stop_event.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+        execute_job(job)
+        executed_jobs += 1
+
+    return executed_jobs
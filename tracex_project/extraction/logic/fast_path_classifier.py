@@ -0,0 +1,335 @@
+"""
+Provide a local classifier that predicts event types and locations of activity labels without the OpenAI API.
+
+The classifier is trained from the events stored by earlier extraction runs with the management command
+build_fast_path_classifier. Activity labels are represented as TF-IDF vectors of their words and word pairs, and a
+softmax regression per target is trained with numpy, so neither a GPU nor network access is needed. The Event Type
+Classifier and the Location Extractor ask the classifier first and only send the activities to the model for which the
+classifier is not confident enough.
+
+The trained classifier is saved as a single .npz artifact. Its metadata contains the artifact format, a version derived
+from the training data and the training parameters, and the precision and the saved requests on a held-out split.
+Artifacts of another format are ignored.
+
+Functions:
+get_fast_path_classifier -- Return the classifier saved at the configured path, or None if there is none.
+get_model_path -- Return the path of the classifier artifact.
+predict_confident -- Predict the values of a target for activity labels if the classifier is confident enough.
+split_rows -- Split training rows into a training and a held-out part by activity label.
+
+Classes:
+FastPathClassifier -- TF-IDF and softmax regression classifier for event types and locations.
+"""
+import hashlib
+import json
+import re
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from tracex.logic.constants import FAST_PATH_CONFIDENCE, FAST_PATH_ENABLED, FAST_PATH_MODEL_PATH
+
+ARTIFACT_FORMAT = 1
+SparseMatrix = Tuple[np.ndarray, np.ndarray, np.ndarray, int]
+TARGETS = ("event_type", "location")
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+_classifier_lock = threading.Lock()
+_loaded_classifier: Tuple[Optional[Tuple[Path, float]], Optional["FastPathClassifier"]] = (None, None)
+
+
+def _get_terms(label: str) -> List[str]:
+    """Return the words and the pairs of neighboring words of an activity label."""
+    words = WORD_PATTERN.findall(label.lower())
+
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+class FastPathClassifier:
+    """
+    TF-IDF and softmax regression classifier for event types and locations.
+
+    Public Methods:
+    fit -- Train the classifier on activity labels and their event types and locations.
+    predict -- Predict the values of a target for activity labels together with the confidence.
+    evaluate -- Compute the precision and the share of saved requests of a target on labeled rows.
+    save -- Save the classifier as a versioned artifact.
+    load -- Load a classifier from an artifact.
+    """
+
+    def __init__(
+        self,
+        vocabulary: Dict[str, int],
+        idf: np.ndarray,
+        weights: Dict[str, Tuple[np.ndarray, np.ndarray, List[str]]],
+        metadata: Optional[Dict[str, Any]] = None,
+    ):
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.weights = weights
+        self.metadata = metadata or {}
+
+    @property
+    def version(self) -> Optional[str]:
+        """Return the version of the classifier, which changes with the training data and parameters."""
+        return self.metadata.get("version")
+
+    @classmethod
+    def fit(
+        cls,
+        rows: Sequence[Tuple[str, str, str]],
+        epochs: int = 200,
+        learning_rate: float = 1.0,
+        regularization: float = 1e-4,
+        seed: int = 0,
+    ) -> "FastPathClassifier":
+        """
+        Train the classifier on activity labels and their event types and locations.
+
+        Positional Arguments:
+        rows -- Tuples of activity label, event type and location.
+
+        Keyword Arguments:
+        epochs -- Number of passes of full-batch gradient descent over the rows.
+        learning_rate -- Step size of the gradient descent.
+        regularization -- Strength of the L2 regularization of the weights.
+        seed -- Seed of the random initialization of the weights.
+
+        Raises a ValueError if the rows contain fewer than two values of a target, since the classifier would then
+        predict that value with full confidence for every activity label.
+        """
+        for target_index, target in enumerate(TARGETS, start=1):
+            values = {row[target_index] for row in rows}
+            if len(values) < 2:
+                raise ValueError(
+                    f"The training rows contain {len(values)} {target} values, but at least two are needed."
+                )
+        labels = [row[0] for row in rows]
+        documents = [set(_get_terms(label)) for label in labels]
+        terms = sorted(set().union(*documents))
+        vocabulary = {term: index for index, term in enumerate(terms)}
+        document_frequency = np.zeros(len(terms))
+        for document in documents:
+            document_frequency[[vocabulary[term] for term in document]] += 1
+        idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1
+
+        classifier = cls(vocabulary, idf, {})
+        features = classifier.__vectorize(labels)
+        rng = np.random.default_rng(seed)
+        for target_index, target in enumerate(TARGETS, start=1):
+            classes = sorted({row[target_index] for row in rows})
+            targets = np.array([classes.index(row[target_index]) for row in rows])
+            one_hot = np.eye(len(classes))[targets]
+            weight = rng.normal(scale=0.01, size=(len(terms), len(classes)))
+            bias = np.zeros(len(classes))
+            for _ in range(epochs):
+                error = (_softmax(_sparse_dot(features, weight) + bias) - one_hot) / len(rows)
+                weight -= learning_rate * (_sparse_transpose_dot(features, error, len(terms)) + regularization * weight)
+                bias -= learning_rate * error.sum(axis=0)
+            classifier.weights[target] = (weight, bias, classes)
+
+        training_data = json.dumps([list(row) for row in rows], sort_keys=True)
+        parameters = json.dumps([epochs, learning_rate, regularization, seed])
+        fingerprint = hashlib.sha256((training_data + parameters).encode()).hexdigest()
+        classifier.metadata = {
+            "format": ARTIFACT_FORMAT,
+            "version": f"{ARTIFACT_FORMAT}-{fingerprint[:12]}",
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "training_rows": len(rows),
+        }
+
+        return classifier
+
+    def predict(self, labels: Sequence[str], target: str) -> List[Tuple[str, float]]:
+        """
+        Predict the values of a target ("event_type" or "location") for activity labels with their confidence.
+
+        A label without any word of the vocabulary is only scored by the bias, i.e. the prior of the classes, so its
+        confidence is 0 instead of the share of the most frequent class.
+        """
+        if not labels:
+            return []
+
+        weight, bias, classes = self.weights[target]
+        features = self.__vectorize(labels)
+        has_known_terms = np.bincount(features[0], minlength=len(labels)) > 0
+        probabilities = _softmax(_sparse_dot(features, weight) + bias)
+        predictions = probabilities.argmax(axis=1)
+
+        return [
+            (classes[prediction], float(probabilities[index, prediction]) if has_known_terms[index] else 0.0)
+            for index, prediction in enumerate(predictions)
+        ]
+
+    def evaluate(
+        self, rows: Sequence[Tuple[str, str, str]], target: str, threshold: float = FAST_PATH_CONFIDENCE
+    ) -> Dict[str, Any]:
+        """
+        Compute the precision and the share of saved requests of a target on labeled rows.
+
+        The precision only counts the predictions with a confidence of at least the threshold, since only these replace
+        a request to the model. Their share of all rows is the share of saved requests.
+        """
+        target_index = TARGETS.index(target) + 1
+        predictions = self.predict([row[0] for row in rows], target)
+        confident = [
+            prediction == row[target_index]
+            for row, (prediction, confidence) in zip(rows, predictions)
+            if confidence >= threshold
+        ]
+
+        return {
+            "rows": len(rows),
+            "threshold": threshold,
+            "saved_requests": len(confident),
+            "saved_share": round(len(confident) / len(rows), 4) if rows else 0.0,
+            "precision": round(sum(confident) / len(confident), 4) if confident else None,
+        }
+
+    def save(self, path: Path) -> None:
+        """Save the classifier as an artifact at the path."""
+        arrays = {"idf": self.idf}
+        for target, (weight, bias, _) in self.weights.items():
+            arrays[f"{target}_weight"] = weight
+            arrays[f"{target}_bias"] = bias
+        metadata = {
+            **self.metadata,
+            "vocabulary": self.vocabulary,
+            "classes": {target: classes for target, (_, _, classes) in self.weights.items()},
+        }
+        with open(path, "wb") as file:
+            np.savez_compressed(file, metadata=np.array(json.dumps(metadata)), **arrays)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["FastPathClassifier"]:
+        """Load a classifier from an artifact, or return None if the artifact has another format."""
+        with np.load(path) as artifact:
+            metadata = json.loads(str(artifact["metadata"]))
+            if metadata.get("format") != ARTIFACT_FORMAT:
+                return None
+            vocabulary = metadata.pop("vocabulary")
+            classes = metadata.pop("classes")
+            weights = {
+                target: (artifact[f"{target}_weight"], artifact[f"{target}_bias"], classes[target])
+                for target in TARGETS
+            }
+
+            return cls(vocabulary, artifact["idf"], weights, metadata)
+
+    def __vectorize(self, labels: Sequence[str]) -> SparseMatrix:
+        """
+        Return the L2-normalized TF-IDF vectors of activity labels as a sparse matrix, i.e. the row indices, column
+        indices and values of its non-zero entries and its number of rows.
+        """
+        entries = {}
+        for row, label in enumerate(labels):
+            for term in _get_terms(label):
+                column = self.vocabulary.get(term)
+                if column is not None:
+                    entries[row, column] = entries.get((row, column), 0) + 1
+        rows = np.array([row for row, _ in entries], dtype=np.int64)
+        columns = np.array([column for _, column in entries], dtype=np.int64)
+        values = np.array(list(entries.values()), dtype=float) * self.idf[columns]
+        norms = np.zeros(len(labels))
+        np.add.at(norms, rows, values**2)
+        values /= np.sqrt(norms[rows])
+
+        return rows, columns, values, len(labels)
+
+
+def _sparse_dot(matrix: SparseMatrix, dense: np.ndarray) -> np.ndarray:
+    """Multiply a sparse matrix with a dense matrix."""
+    rows, columns, values, number_of_rows = matrix
+    product = np.zeros((number_of_rows, dense.shape[1]))
+    np.add.at(product, rows, values[:, None] * dense[columns])
+
+    return product
+
+
+def _sparse_transpose_dot(matrix: SparseMatrix, dense: np.ndarray, number_of_columns: int) -> np.ndarray:
+    """Multiply the transpose of a sparse matrix with a dense matrix."""
+    rows, columns, values, _ = matrix
+    product = np.zeros((number_of_columns, dense.shape[1]))
+    np.add.at(product, columns, values[:, None] * dense[rows])
+
+    return product
+
+
+def _softmax(scores: np.ndarray) -> np.ndarray:
+    """Return the row-wise softmax of a matrix of scores."""
+    scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+
+    return scores / scores.sum(axis=1, keepdims=True)
+
+
+def split_rows(
+    rows: Sequence[Tuple[str, str, str]], held_out_share: float, seed: int = 0
+) -> Tuple[List[Tuple[str, str, str]], List[Tuple[str, str, str]]]:
+    """
+    Split rows randomly into a training part and a held-out part with about the given share of the rows. Rows with the
+    same activity label are kept in the same part, since the stored events repeat labels across traces, and predicting
+    labels that were seen in training would overstate the precision on new labels.
+    """
+    label_counts = Counter(row[0].strip().lower() for row in rows)
+    labels = sorted(label_counts)
+    held_out_labels = set()
+    held_out_rows = 0
+    for index in np.random.default_rng(seed).permutation(len(labels)):
+        if held_out_rows >= round(len(rows) * held_out_share):
+            break
+        held_out_labels.add(labels[index])
+        held_out_rows += label_counts[labels[index]]
+
+    return (
+        [row for row in rows if row[0].strip().lower() not in held_out_labels],
+        [row for row in rows if row[0].strip().lower() in held_out_labels],
+    )
+
+
+def get_model_path() -> Path:
+    """Return the path of the classifier artifact."""
+    return Path(FAST_PATH_MODEL_PATH or settings.BASE_DIR / "fast_path_classifier.npz")
+
+
+def get_fast_path_classifier() -> Optional[FastPathClassifier]:
+    """
+    Return the classifier saved at the configured path, or None if the fast path is disabled or no artifact exists.
+
+    The artifact is loaded once and loaded again when it is replaced by a newer one.
+    """
+    global _loaded_classifier  # pylint: disable=global-statement
+
+    path = get_model_path()
+    if not FAST_PATH_ENABLED or not path.exists():
+        return None
+
+    key = (path, path.stat().st_mtime)
+    with _classifier_lock:
+        if _loaded_classifier[0] != key:
+            _loaded_classifier = (key, FastPathClassifier.load(path))
+
+        return _loaded_classifier[1]
+
+
+def predict_confident(
+    labels: Sequence[str], target: str, threshold: float = FAST_PATH_CONFIDENCE
+) -> List[Optional[str]]:
+    """
+    Predict the values of a target ("event_type" or "location") for activity labels with the local classifier.
+
+    Returns one value per label, which is None if the classifier is not confident enough or not available, so that the
+    label has to be sent to the model. Labels without any known word are always sent to the model.
+    """
+    classifier = get_fast_path_classifier()
+    if classifier is None:
+        return [None] * len(labels)
+
+    return [
+        prediction if confidence > 0 and confidence >= threshold else None
+        for prediction, confidence in classifier.predict(labels, target)
+    ]
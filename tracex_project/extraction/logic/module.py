@@ -1,6 +1,6 @@
 """Module providing the abstract base class for all modules."""
 from abc import ABC
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import pandas as pd
 
@@ -8,8 +8,22 @@ import pandas as pd
 class Module(ABC):
     """
     This abstract base class defines a common interface for all concrete modules.
+
+    Modules that work on the DataFrame of activities declare the columns they read and the columns they write. The
+    orchestrator runs modules that do not depend on each other's columns at the same time, each on a copy of the
+    columns it reads. Modules that declare no written columns are run on their own with the whole DataFrame.
+
+    Modules that work on each activity independently set extracts_rows and implement extract_row(row), which returns
+    a coroutine extracting the values of the module for a single activity as a dictionary of columns. The orchestrator
+    then passes the activities to them as soon as they are labeled. The coroutine must not query the database, since
+    it runs on the background event loop, so any database access, like loading prompts, has to happen before the
+    coroutine is returned.
     """
 
+    reads: Tuple[str, ...] = ()
+    writes: Tuple[str, ...] = ()
+    extracts_rows: bool = False
+
     def __init__(self):
         """
         Initializes a module with the following parameters.
@@ -40,11 +54,42 @@ class Module(ABC):
         patient_journey -- The Patient Journey as text.
         patient_journey_sentences -- The same Patient Journey as a list of sentences.
         """
+        self.prepare(
+            patient_journey=patient_journey,
+            patient_journey_sentences=patient_journey_sentences,
+            cohort=cohort,
+        )
+
+        return pd.DataFrame()
+
+    def prepare(
+        self,
+        *,
+        patient_journey: Optional[str] = None,
+        patient_journey_sentences: Optional[List[str]] = None,
+        cohort: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """
+        Sets the inputs of the module. Called by execute, and before single activities are passed to extract_row.
+
+        Keyword arguments:
+        patient_journey -- The Patient Journey as text.
+        patient_journey_sentences -- The same Patient Journey as a list of sentences.
+        cohort -- The cohort of the Patient Journey.
+        """
         self.patient_journey = patient_journey
         self.patient_journey_sentences = patient_journey_sentences
         self.cohort = cohort
 
-        return pd.DataFrame()
+    def finalize(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Post-processes the DataFrame after the values of all activities were extracted with extract_row. Override
+        this if the module needs all activities for its result.
+
+        Keyword arguments:
+        df -- The activities with the values of extract_row as columns.
+        """
+        return df
 
     def execute_and_save(
         self,
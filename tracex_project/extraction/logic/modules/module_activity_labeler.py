@@ -1,24 +1,41 @@
 """This is the module that extracts the activity labels from the Patient Journey."""
+from difflib import SequenceMatcher
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import pandas as pd
 from django.conf import settings
 
 from extraction.logic.module import Module
-from extraction.models import Prompt
+from extraction.logic.prompt_registry import get_prompt
+from tracex.logic.constants import ACTIVITY_WINDOW_OVERLAP, ACTIVITY_WINDOW_SENTENCES
 from tracex.logic.logger import log_execution_time
 from tracex.logic import utils as u
 
+# Minimum similarity of two labels of the same sentence from different windows to count as the same activity.
+DUPLICATE_LABEL_SIMILARITY = 0.8
+
 
 class ActivityLabeler(Module):
     """
     This is the module that starts the pipeline with structuring the Patient Journey in activities.
+
+    Patient Journeys with more than window_size sentences are labeled in overlapping windows of sentences, which are
+    sent in parallel. Activities of the same sentence with similar labels that were found in two windows are merged.
     """
 
-    def __init__(self):
+    reads = ()
+    writes = ("activity", "sentence_id")
+
+    def __init__(
+        self,
+        window_size: int = ACTIVITY_WINDOW_SENTENCES,
+        window_overlap: int = ACTIVITY_WINDOW_OVERLAP,
+    ):
         super().__init__()
         self.name = "Activity Labeler"
         self.description = "Extracts the activity labels from a Patient Journey."
+        self.window_size = window_size
+        self.window_overlap = window_overlap
 
     @log_execution_time(Path(settings.BASE_DIR / "tracex/logs/execution_time.log"))
     def execute(
@@ -42,6 +59,9 @@ class ActivityLabeler(Module):
 
         condition = getattr(cohort, "condition", None)
 
+        if 0 < self.window_size < len(patient_journey_sentences):
+            return self.__extract_activities_in_windows(patient_journey_sentences, condition)
+
         patient_journey_numbered: str = self.__number_patient_journey_sentences(
             patient_journey_sentences
         )
@@ -53,21 +73,151 @@ class ActivityLabeler(Module):
 
         return activity_labels
 
+    def stream(
+        self,
+        patient_journey: str = None,
+        patient_journey_sentences: List[str] = None,
+        cohort=None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Extracts the activity labels like execute, but streams the response and yields every activity as soon as its
+        line is complete. This allows the following modules to process the first activities while the remaining ones
+        are still being labeled. Every activity is a dictionary with the activity label and its sentence id.
+        """
+        self.prepare(
+            patient_journey=patient_journey,
+            patient_journey_sentences=patient_journey_sentences,
+            cohort=cohort,
+        )
+
+        condition = getattr(cohort, "condition", None)
+        messages = self.__build_messages(
+            self.__number_patient_journey_sentences(patient_journey_sentences), condition
+        )
+        sentence_id = "0"
+        pending_line = ""
+        for fragment in u.stream_gpt(messages):
+            *lines, pending_line = (pending_line + fragment).split("\n")
+            for line in lines:
+                activity = self.__parse_activity_line(line, sentence_id)
+                if activity is not None:
+                    sentence_id = activity["sentence_id"]
+                    yield activity
+        activity = self.__parse_activity_line(pending_line, sentence_id)
+        if activity is not None:
+            yield activity
+
     @staticmethod
-    def __number_patient_journey_sentences(patient_journey_sentences: List[str]) -> str:
+    def __parse_activity_line(line: str, previous_sentence_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Parse a line in the format 'activity label #sentence id'. Lines without a sentence id get the sentence id of
+        the previous activity. Returns None for empty lines.
+        """
+        if not line.strip():
+            return None
+        activity, separator, sentence_id = line.partition(" #")
+
+        return {
+            "activity": activity,
+            "sentence_id": sentence_id.strip() if separator else previous_sentence_id,
+        }
+
+    def __extract_activities_in_windows(
+        self, patient_journey_sentences: List[str], condition: Optional[str]
+    ) -> pd.DataFrame:
+        """
+        Extracts the activity labels from overlapping windows of the Patient Journey in parallel. The sentences keep
+        their numbers in the whole Patient Journey, so the sentence ids of all windows refer to the same sentences.
+        """
+        windows = self.__get_windows(len(patient_journey_sentences))
+        responses = u.gather_gpt(
+            [
+                self.__build_messages(
+                    self.__number_patient_journey_sentences(patient_journey_sentences[lower:upper], offset=lower),
+                    condition,
+                )
+                for lower, upper in windows
+            ]
+        )
+        window_activities = []
+        for (lower, _), response in zip(windows, responses):
+            activities = []
+            sentence_id = str(lower)
+            for line in response.split("\n"):
+                activity = self.__parse_activity_line(line, sentence_id)
+                if activity is not None:
+                    sentence_id = activity["sentence_id"]
+                    activities.append(activity)
+            window_activities.append(activities)
+
+        return pd.DataFrame(self.__merge_windows(window_activities), columns=["activity", "sentence_id"])
+
+    def __get_windows(self, number_of_sentences: int) -> List[Tuple[int, int]]:
+        """Returns the bounds of overlapping windows of window_size sentences that cover all sentences."""
+        overlap = min(max(0, self.window_overlap), self.window_size - 1)
+        stride = self.window_size - overlap
+
+        return [
+            (lower, min(number_of_sentences, lower + self.window_size))
+            for lower in range(0, number_of_sentences, stride)
+            if lower == 0 or lower + overlap < number_of_sentences
+        ]
+
+    @staticmethod
+    def __merge_windows(window_activities: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Merges the activities of all windows ordered by sentence id. An activity is dropped if an earlier window already
+        has an activity of the same sentence with a similar label. Activities of the same window are all kept.
+        """
+        merged_activities = []
+        activities_by_sentence: Dict[str, List[Tuple[int, str]]] = {}
+        for window_index, activities in enumerate(window_activities):
+            for activity in activities:
+                label = " ".join(activity["activity"].lower().split())
+                known_activities = activities_by_sentence.setdefault(activity["sentence_id"], [])
+                if any(
+                    known_window_index != window_index
+                    and SequenceMatcher(None, label, known_label).ratio() >= DUPLICATE_LABEL_SIMILARITY
+                    for known_window_index, known_label in known_activities
+                ):
+                    continue
+                known_activities.append((window_index, label))
+                merged_activities.append(activity)
+
+        def sentence_order(activity: Dict[str, Any]) -> float:
+            sentence_id = activity["sentence_id"]
+            return int(sentence_id) if sentence_id.isdigit() else float("inf")
+
+        return sorted(merged_activities, key=sentence_order)
+
+    @staticmethod
+    def __number_patient_journey_sentences(patient_journey_sentences: List[str], offset: int = 0) -> str:
         """
         Number the Patient Journey sentences as one String in the format:
             1: ...
             2: ...
-        And so on.
+        And so on, starting with the offset.
         """
         patient_journey_numbered = patient_journey_sentences[:]
-        for count, value in enumerate(patient_journey_numbered):
-            patient_journey_numbered[count] = f"{count}: {value}"
+        for count, value in enumerate(patient_journey_numbered, start=offset):
+            patient_journey_numbered[count - offset] = f"{count}: {value}"
         patient_journey_numbered = "\n".join(patient_journey_numbered)
 
         return patient_journey_numbered
 
+    @staticmethod
+    def __build_messages(patient_journey_numbered: str, condition: Optional[str]) -> List[Dict[str, str]]:
+        """Build the messages to extract the activity labels from a numbered Patient Journey."""
+        messages = get_prompt("TEXT_TO_ACTIVITY_MESSAGES")
+
+        user_message: str = patient_journey_numbered
+        if condition is not None:
+            user_message = f"Focus on those events that are related to the course of the disease of {condition}.\n\n\
+            {user_message}"
+        messages.append({"role": "user", "content": user_message})
+
+        return messages
+
     @staticmethod
     def __extract_activities(
         patient_journey_numbered: str,
@@ -79,13 +229,7 @@ class ActivityLabeler(Module):
         extracting the activity labels from the Patient Journey.
         """
         column_name = "activity"
-        messages = Prompt.objects.get(name="TEXT_TO_ACTIVITY_MESSAGES").text
-
-        user_message: str = patient_journey_numbered
-        if condition is not None:
-            user_message = f"Focus on those events that are related to the course of the disease of {condition}.\n\n\
-            {user_message}"
-        messages.append({"role": "user", "content": user_message})
+        messages = ActivityLabeler.__build_messages(patient_journey_numbered, condition)
         activity_labels = u.query_gpt(messages).split("\n")
         df = pd.DataFrame(activity_labels, columns=[column_name])
         try:
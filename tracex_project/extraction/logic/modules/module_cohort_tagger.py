@@ -1,24 +1,33 @@
 """This is the module that cohort tags from the Patient Journey."""
+import json
+import re
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 from django.conf import settings
 
-from extraction.models import Prompt
+from extraction.logic.prompt_registry import get_prompt
 from extraction.logic.module import Module
+from tracex.logic.constants import STRUCTURED_COHORT_TAGS
 from tracex.logic.logger import log_execution_time
 from tracex.logic import utils as u
 
+AGE_PATTERN = re.compile(r"\d{1,3}|N/A")
+
 
 class CohortTagger(Module):
     """
     This is the module that extracts the cohort information from the Patient Journey.
     The cohort tags are condition, age, biological sex, origin and preexisting condition.
+
+    In structured mode, all tags are extracted with a single request that returns a JSON object. Tags that are missing
+    or malformed in the answer, or all tags if structured mode is off, are extracted with one concurrent request each.
     """
 
-    def __init__(self):
+    def __init__(self, structured: bool = STRUCTURED_COHORT_TAGS):
         super().__init__()
         self.name = "Cohort Tagger"
         self.description = "Extracts the cohort tags from a Patient Journey."
+        self.structured = structured
 
     @log_execution_time(Path(settings.BASE_DIR / "tracex/logs/execution_time.log"))
     def execute_and_save(
@@ -40,20 +49,80 @@ class CohortTagger(Module):
 
         return cohort_dict
 
-    @staticmethod
-    def __extract_cohort_tags(patient_journey) -> Dict[str, str]:
+    def __extract_cohort_tags(self, patient_journey) -> Dict[str, str]:
         """Extracts information about condition, sex, age, origin and preexisting condition."""
+        tag_messages = {
+            message_list[0]: message_list[1:]
+            for message_list in get_prompt("COHORT_TAG_MESSAGES")
+        }
         cohort_data = {}
-        for message_list in Prompt.objects.get(name="COHORT_TAG_MESSAGES").text:
-            messages = message_list[1:]
-            messages.append(
-                {"role": "user", "content": patient_journey},
+        if self.structured:
+            cohort_data = self.__parse_cohort_tags(
+                u.query_gpt(self.__build_structured_messages(tag_messages, patient_journey)), list(tag_messages)
             )
-            tag = u.query_gpt(messages)
-            cohort_data[message_list[0]] = tag
+
+        missing_tags = [tag for tag in tag_messages if tag not in cohort_data]
+        responses = u.gather_gpt(
+            [tag_messages[tag] + [{"role": "user", "content": patient_journey}] for tag in missing_tags]
+        )
+        cohort_data.update(zip(missing_tags, responses))
+
+        return {tag: cohort_data[tag] for tag in tag_messages}
+
+    @staticmethod
+    def __build_structured_messages(
+        tag_messages: Dict[str, List[Dict[str, str]]], patient_journey: str
+    ) -> List[Dict[str, str]]:
+        """Builds the messages to extract all cohort tags with one request from the instructions of every tag."""
+        instructions = "\n".join(
+            f'- "{tag}": {messages[0]["content"]}' for tag, messages in tag_messages.items()
+        )
+
+        return [
+            {
+                "role": "system",
+                "content": "You are an expert in text understanding and your job is to take a given text about an "
+                "illness and to extract several tags about its author. Answer with a JSON object that has exactly the "
+                "following keys and nothing else. Each key is followed by the instructions for its value:\n"
+                + instructions,
+            },
+            {"role": "user", "content": patient_journey},
+        ]
+
+    @staticmethod
+    def __parse_cohort_tags(response: str, tags: List[str]) -> Dict[str, str]:
+        """
+        Parses the tags from the answer of a structured request. Tags that are missing or malformed are left out, so
+        that they can be extracted with a request of their own.
+        """
+        try:
+            values = json.loads(response.strip().removeprefix("```json").strip("`"))
+        except (AttributeError, ValueError):
+            return {}
+        if not isinstance(values, dict):
+            return {}
+
+        cohort_data = {}
+        for tag in tags:
+            value = CohortTagger.__parse_cohort_tag(tag, values.get(tag, ""))
+            if value is not None:
+                cohort_data[tag] = value
 
         return cohort_data
 
+    @staticmethod
+    def __parse_cohort_tag(tag: str, value: Any) -> Optional[str]:
+        """Returns the value of a tag as the single-tag requests would, or None if the value is malformed."""
+        if value is None:
+            return "N/A"
+        if isinstance(value, bool) or not isinstance(value, (str, int)):
+            return None
+        value = str(value).strip()
+        if not value or (tag == "age" and not AGE_PATTERN.fullmatch(value)):
+            return None
+
+        return value
+
     @staticmethod
     def __remove_placeholder(cohort_data) -> Optional[Dict[str, str]]:
         """Prepares the cohort tags dictionary for saving into database."""
@@ -1,13 +1,22 @@
 """This module classifies the event types of the activities."""
+import json
 from pathlib import Path
+from typing import Any, Awaitable, Dict, List, Optional
 from django.conf import settings
 import pandas as pd
 
+from extraction.logic.fast_path_classifier import predict_confident
 from extraction.logic.module import Module
-from extraction.models import Prompt
+from extraction.logic.prompt_registry import get_prompt
+from tracex.logic.constants import EVENT_TYPE_BATCH_SIZE, EVENT_TYPES, FAST_PATH_CONFIDENCE
 from tracex.logic.logger import log_execution_time
 from tracex.logic import utils as u
 
+BATCH_INSTRUCTION = (
+    " You will be given a JSON list of activity labels instead of a single activity label. Answer with a JSON list"
+    " that contains exactly one event type for every activity label, in the same order, and nothing else."
+)
+
 
 class EventTypeClassifier(Module):
     """
@@ -15,12 +24,27 @@ class EventTypeClassifier(Module):
     'Symptom Offset', 'Diagnosis', 'Doctor visit', 'Treatment', 'Hospital admission', 'Hospital discharge',
     'Medication', 'Lifestyle Change' and 'Feelings'. This is done so that we can extract a standardized set of event
     types from the Patient Journey. This is necessary for the application of process mining algorithms.
+
+    Activities are classified in batches of batch_size activity labels per request. Every event type of a batch is
+    validated on its own, and activities without a valid event type are classified again in a request of their own.
+    If the local fast-path classifier was built, activities it classifies with a confidence of at least
+    fast_path_confidence are not sent to the model at all.
     """
 
-    def __init__(self):
+    reads = ("activity",)
+    writes = ("event_type",)
+    extracts_rows = True
+
+    def __init__(
+        self,
+        batch_size: int = EVENT_TYPE_BATCH_SIZE,
+        fast_path_confidence: float = FAST_PATH_CONFIDENCE,
+    ):
         super().__init__()
         self.name = "Event Type Classifier"
         self.description = "Classifies the event types for the corresponding activity labels from a Patient Journey."
+        self.batch_size = batch_size
+        self.fast_path_confidence = fast_path_confidence
 
     @log_execution_time(Path(settings.BASE_DIR / "tracex/logs/execution_time.log"))
     def execute(
@@ -38,15 +62,125 @@ class EventTypeClassifier(Module):
             cohort=cohort,
         )
 
-        df["event_type"] = df["activity"].apply(self.__classify_event_type)
+        df["event_type"] = self.__classify_event_types(list(df["activity"]))
 
         return df
 
+    def extract_row(self, row: pd.Series) -> Awaitable[Dict[str, Any]]:
+        """Returns a coroutine that classifies the event type of a single activity."""
+        (event_type,) = predict_confident([row["activity"]], "event_type", self.fast_path_confidence)
+        messages = self.__build_messages(row["activity"]) if event_type is None else None
+
+        async def classify_event_type():
+            if messages is None:
+                return {"event_type": event_type}
+
+            return {"event_type": EventTypeClassifier.__spell_event_type(await u.aquery_gpt(messages))}
+
+        return classify_event_type()
+
+    def __classify_event_types(self, activity_labels: List[str]) -> List[str]:
+        """Classify the event types of all activity labels, with the fast-path classifier first and then the model."""
+        event_types = predict_confident(activity_labels, "event_type", self.fast_path_confidence)
+        remaining_indices = [index for index, event_type in enumerate(event_types) if event_type is None]
+        remaining_event_types = self.__query_event_types([activity_labels[index] for index in remaining_indices])
+        for index, event_type in zip(remaining_indices, remaining_event_types):
+            event_types[index] = event_type
+
+        return event_types
+
+    def __query_event_types(self, activity_labels: List[str]) -> List[str]:
+        """Classify the event types of activity labels with the model, in batches if the batch size is above 1."""
+        if self.batch_size <= 1:
+            outputs = u.gather_gpt([self.__build_messages(activity_label) for activity_label in activity_labels])
+
+            return [self.__spell_event_type(output) for output in outputs]
+
+        batches = [
+            activity_labels[index : index + self.batch_size]
+            for index in range(0, len(activity_labels), self.batch_size)
+        ]
+        outputs = u.gather_gpt([self.__build_batch_messages(batch) for batch in batches])
+        event_types = []
+        for batch, output in zip(batches, outputs):
+            event_types.extend(self.__parse_batch_output(output, len(batch)))
+
+        failed_indices = [index for index, event_type in enumerate(event_types) if event_type is None]
+        fallback_event_types = u.gather_gpt(
+            [self.__build_messages(activity_labels[index]) for index in failed_indices]
+        )
+        for index, event_type in zip(failed_indices, fallback_event_types):
+            event_types[index] = self.__spell_event_type(event_type)
+
+        return event_types
+
+    @staticmethod
+    def __parse_batch_output(output: str, batch_length: int) -> List[Optional[str]]:
+        """
+        Parse the JSON list of event types of a batch. Event types that are not valid are returned as None, and so are
+        all event types of a batch whose answer is not a list with one item per activity label.
+        """
+        try:
+            items = json.loads(output.strip().removeprefix("```json").strip("`"))
+        except (AttributeError, ValueError):
+            return [None] * batch_length
+        if not isinstance(items, list) or len(items) != batch_length:
+            return [None] * batch_length
+
+        return [EventTypeClassifier.__validate_event_type(item) for item in items]
+
+    @staticmethod
+    def __validate_event_type(event_type: Any) -> Optional[str]:
+        """
+        Return the event type as spelled in EVENT_TYPES, or None if it is not one of them. Case and plural forms are
+        ignored, so that e.g. 'Doctors Visit' and 'Feeling' are returned as 'Doctor Visit' and 'Feelings'.
+        """
+        if not isinstance(event_type, str):
+            return None
+        valid_event_types = {EventTypeClassifier.__normalize(key): key for key, _ in EVENT_TYPES}
+
+        return valid_event_types.get(EventTypeClassifier.__normalize(event_type))
+
+    @staticmethod
+    def __spell_event_type(output: str) -> str:
+        """
+        Return the answer of a single-item request spelled as in EVENT_TYPES, like the event types of a batch. Answers
+        that are no valid event type are returned unchanged.
+        """
+        return EventTypeClassifier.__validate_event_type(output) or output
+
+    @staticmethod
+    def __normalize(event_type: str) -> str:
+        """Normalize an event type to lower case words without a plural s."""
+        return " ".join(word.removesuffix("s") for word in event_type.lower().split())
+
+    @staticmethod
+    def __build_batch_messages(activity_labels: List[str]) -> List[Dict[str, str]]:
+        """
+        Build the messages to classify the event types for a batch of activities. The examples of the single-item
+        prompt are combined into one batch example, with their answers spelled as in EVENT_TYPES. Examples whose answer
+        is no event type at all are left out.
+        """
+        system_message, *examples = get_prompt("EVENT_TYPE_MESSAGES")
+        example_labels = []
+        example_event_types = []
+        for question, answer in zip(examples[::2], examples[1::2]):
+            event_type = EventTypeClassifier.__validate_event_type(answer["content"])
+            if event_type is not None:
+                example_labels.append(question["content"])
+                example_event_types.append(event_type)
+
+        return [
+            {"role": "system", "content": system_message["content"] + BATCH_INSTRUCTION},
+            {"role": "user", "content": json.dumps(example_labels)},
+            {"role": "assistant", "content": json.dumps(example_event_types)},
+            {"role": "user", "content": json.dumps(activity_labels)},
+        ]
+
     @staticmethod
-    def __classify_event_type(activity_label):
-        """Classify the event type for a given activity."""
-        messages = Prompt.objects.get(name="EVENT_TYPE_MESSAGES").text
+    def __build_messages(activity_label):
+        """Build the messages to classify the event type for a given activity."""
+        messages = get_prompt("EVENT_TYPE_MESSAGES")
         messages.append({"role": "user", "content": activity_label})
-        event_type = u.query_gpt(messages)
 
-        return event_type
+        return messages
@@ -1,10 +1,14 @@
 """This module that extracts the location information for each activity."""
 from pathlib import Path
+from typing import Any, Awaitable, Dict, List
 from django.conf import settings
 import pandas as pd
 
+from extraction.logic.fast_path_classifier import predict_confident
 from extraction.logic.module import Module
-from extraction.models import Prompt
+from extraction.logic.prompt_registry import get_prompt, get_prompt_version
+from extraction.models import LocationMemo
+from tracex.logic.constants import FAST_PATH_CONFIDENCE, LOCATION_MEMO_ENABLED, LOCATIONS
 from tracex.logic.logger import log_execution_time
 from tracex.logic import utils as u
 
@@ -13,12 +17,30 @@ class LocationExtractor(Module):
     """
     This is the module that extracts the location information from the Patient Journey to each activity.
     This means all activities are classified to the given locations "Home", "Hospital", "Doctors".
+
+    Activity labels that only differ in case and whitespace share their location, so only unique labels are sent to
+    the model. The locations are memoized for the run, and if use_database_memo is set, also in the LocationMemo table
+    for later runs with the same version of the prompt. If the local fast-path classifier was built, labels it
+    classifies with a confidence of at least fast_path_confidence are not sent to the model either.
     """
 
-    def __init__(self):
+    reads = ("activity",)
+    writes = ("attribute_location",)
+    extracts_rows = True
+
+    def __init__(
+        self,
+        use_database_memo: bool = LOCATION_MEMO_ENABLED,
+        fast_path_confidence: float = FAST_PATH_CONFIDENCE,
+    ):
         super().__init__()
         self.name = "Location Extractor"
         self.description = "Extracts the locations for the corresponding activity labels from a Patient Journey."
+        self.use_database_memo = use_database_memo
+        self.fast_path_confidence = fast_path_confidence
+        self.memo: Dict[str, str] = {}
+        self.predicted_labels = set()
+        self.prompt_version = None
 
     @log_execution_time(Path(settings.BASE_DIR / "tracex/logs/execution_time.log"))
     def execute(
@@ -36,15 +58,101 @@ class LocationExtractor(Module):
             cohort=cohort,
         )
 
-        df["attribute_location"] = df["activity"].apply(self.__classify_location)
+        labels = df["activity"].map(self.__normalize_label)
+        self.__load_database_memo(labels)
+        activity_labels = df["activity"].groupby(labels).first()
+        self.__predict_locations([label for label in labels.unique() if label not in self.memo], activity_labels)
+        unknown_labels = [label for label in labels.unique() if label not in self.memo]
+        locations = u.gather_gpt(
+            [self.__build_messages(activity_labels[label]) for label in unknown_labels]
+        )
+        self.memo.update(zip(unknown_labels, locations))
+        df["attribute_location"] = labels.map(self.memo)
+
+        return self.finalize(df)
+
+    def prepare(self, **kwargs) -> None:
+        """Sets the inputs of the module and starts with an empty memo for the run."""
+        super().prepare(**kwargs)
+        self.memo = {}
+        self.predicted_labels = set()
+        self.prompt_version = None
+
+    def extract_row(self, row: pd.Series) -> Awaitable[Dict[str, Any]]:
+        """Returns a coroutine that extracts the location of a single activity, or reuses a memoized location."""
+        label = self.__normalize_label(row["activity"])
+        self.__load_database_memo([label])
+        if label not in self.memo:
+            self.__predict_locations([label], {label: row["activity"]})
+        messages = None if label in self.memo else self.__build_messages(row["activity"])
+
+        async def extract_location():
+            if label not in self.memo:
+                self.memo[label] = await u.aquery_gpt(messages)
+
+            return {"attribute_location": self.memo[label]}
+
+        return extract_location()
+
+    def finalize(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Saves the locations of the run to the LocationMemo table if the database memo is used. Locations predicted by
+        the fast-path classifier are not saved, since they do not depend on the prompt.
+        """
+        if not self.use_database_memo:
+            return df
+
+        valid_locations = {key for key, _ in LOCATIONS}
+        prompt_version = self.__get_prompt_version()
+        LocationMemo.manager.bulk_create(
+            [
+                LocationMemo(activity=label, location=location, prompt_version=prompt_version)
+                for label, location in self.memo.items()
+                if location in valid_locations and label not in self.predicted_labels
+            ],
+            ignore_conflicts=True,
+        )
 
         return df
 
+    def __predict_locations(self, labels: List[str], activity_labels) -> None:
+        """Adds the locations the fast-path classifier is confident about to the memo of the run."""
+        locations = predict_confident(
+            [activity_labels[label] for label in labels], "location", self.fast_path_confidence
+        )
+        for label, location in zip(labels, locations):
+            if location is not None:
+                self.memo[label] = location
+                self.predicted_labels.add(label)
+
+    def __load_database_memo(self, labels) -> None:
+        """Adds the memoized locations of earlier runs for the labels to the memo of the run."""
+        labels = [label for label in set(labels) if label not in self.memo]
+        if not self.use_database_memo or not labels:
+            return
+
+        self.memo.update(
+            LocationMemo.manager.filter(
+                activity__in=labels, prompt_version=self.__get_prompt_version()
+            ).values_list("activity", "location")
+        )
+
+    def __get_prompt_version(self) -> str:
+        """Returns a hash of the location prompt, so that memoized locations are discarded when the prompt changes."""
+        if self.prompt_version is None:
+            self.prompt_version = get_prompt_version("LOCATION_MESSAGES")
+
+        return self.prompt_version
+
+    @staticmethod
+    def __normalize_label(activity_label: str) -> str:
+        """Normalize an activity label, so that labels only differing in case and whitespace share their location."""
+        return " ".join(str(activity_label).lower().split())
+
     @staticmethod
-    def __classify_location(activity_label: str) -> str:
-        """Classify the location for a given activity."""
-        messages = Prompt.objects.get(name="LOCATION_MESSAGES").text
+    def __build_messages(activity_label: str) -> List[Dict[str, str]]:
+        """Build the messages to classify the location for a given activity."""
+        messages = get_prompt("LOCATION_MESSAGES")
         messages.append({"role": "user", "content": activity_label})
-        location = u.query_gpt(messages)
 
-        return location
+        return messages
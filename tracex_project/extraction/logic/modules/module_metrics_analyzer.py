@@ -1,11 +1,13 @@
 """This module measures the outpupt of the pipeline based on specified metrics."""
+import asyncio
 from pathlib import Path
-from typing import Tuple
+from typing import Dict, List
 import pandas as pd
 from django.conf import settings
 
 from extraction.logic.module import Module
-from extraction.models import Prompt
+from extraction.logic.prompt_registry import get_prompt
+from tracex.logic.constants import LLM_CONCURRENCY, METRICS_TIMESTAMP_CONTEXT
 from tracex.logic.logger import log_execution_time
 from tracex.logic import utils as u
 
@@ -16,14 +18,29 @@ class MetricsAnalyzer(Module):
     The specified metrics currently used are:
     - relevance of event information
     - correctness of timestamps
+
+    The timestamps of an activity are rated either against the snippet of sentences around the sentence of the
+    activity, the same window the Time Extractor uses, or against the full Patient Journey. The snippet keeps the
+    prompt size independent of the length of the Patient Journey, while the full context allows comparing the
+    results with earlier runs.
     """
 
-    def __init__(self):
+    reads = ("activity", "sentence_id", "time:timestamp", "time:end_timestamp")
+    writes = ("activity_relevance", "timestamp_correctness", "correctness_confidence")
+
+    TIMESTAMP_CONTEXTS = ("snippet", "full")
+
+    def __init__(self, timestamp_context: str = METRICS_TIMESTAMP_CONTEXT):
         super().__init__()
+        if timestamp_context not in self.TIMESTAMP_CONTEXTS:
+            raise ValueError(
+                f"Unknown timestamp context '{timestamp_context}', expected one of {self.TIMESTAMP_CONTEXTS}."
+            )
         self.name = "Metrics Analyzer"
         self.description = (
             "Measures the output of the pipeline based on specified metrics."
         )
+        self.timestamp_context = timestamp_context
 
     @log_execution_time(Path(settings.BASE_DIR / "tracex/logs/execution_time.log"))
     def execute(
@@ -44,32 +61,40 @@ class MetricsAnalyzer(Module):
 
         condition = cohort["condition"] if cohort is not None else None
         metrics_df = df.copy()
-        metrics_df["activity_relevance"] = metrics_df["activity"].apply(
-            lambda activity: self.__rate_activity_relevance(activity, condition)
-        )
-        metrics_df[
-            ["timestamp_correctness", "correctness_confidence"]
-        ] = metrics_df.apply(
-            lambda row: pd.Series(
-                self.__rate_timestamps_correctness(
-                    row["activity"], row["time:timestamp"], row["time:end_timestamp"]
-                )
-            ),
-            axis=1,
-        )
+        relevance_messages_list = [
+            self.__build_activity_relevance_messages(activity, condition)
+            for activity in metrics_df["activity"]
+        ]
+        timestamp_messages_list = [
+            self.__build_timestamps_correctness_messages(
+                row["activity"], row["time:timestamp"], row["time:end_timestamp"], self.__get_context(row)
+            )
+            for _, row in metrics_df.iterrows()
+        ]
+
+        # Both metrics are independent, so all their requests are in flight at the same time, bounded per execution.
+        semaphore = asyncio.Semaphore(max(1, LLM_CONCURRENCY))
+        relevance_futures = [
+            u.submit_gpt(u.aquery_gpt(messages), semaphore=semaphore) for messages in relevance_messages_list
+        ]
+        timestamp_futures = [
+            u.submit_gpt(u.aquery_gpt(messages, return_linear_probability=True, top_logprobs=1), semaphore=semaphore)
+            for messages in timestamp_messages_list
+        ]
+        results = u.get_results(relevance_futures + timestamp_futures)
+        metrics_df["activity_relevance"] = [
+            self.__get_relevance_category(response) for response in results[: len(relevance_futures)]
+        ]
+        timestamp_ratings = results[len(relevance_futures) :]
+        metrics_df["timestamp_correctness"] = [rating[0] for rating in timestamp_ratings]
+        metrics_df["correctness_confidence"] = [rating[1] for rating in timestamp_ratings]
 
         return metrics_df
 
     @staticmethod
-    def __rate_activity_relevance(activity: str, condition: str | None) -> str:
-        category_mapping = {
-            "No Relevance": 0,
-            "Low Relevance": 1,
-            "Moderate Relevance": 2,
-            "High Relevance": 3,
-        }
-
-        messages = Prompt.objects.get(name="METRIC_ACTIVITY_MESSAGES").text
+    def __build_activity_relevance_messages(activity: str, condition: str | None) -> List[Dict[str, str]]:
+        """Build the messages to rate the relevance of an activity."""
+        messages = get_prompt("METRIC_ACTIVITY_MESSAGES")
         if condition is not None:
             messages.append(
                 {
@@ -82,7 +107,18 @@ class MetricsAnalyzer(Module):
         else:
             messages.append({"role": "user", "content": activity})
 
-        response = u.query_gpt(messages)
+        return messages
+
+    @staticmethod
+    def __get_relevance_category(response: str) -> str:
+        """Map the response of a relevance rating to a relevance category."""
+        category_mapping = {
+            "No Relevance": 0,
+            "Low Relevance": 1,
+            "Moderate Relevance": 2,
+            "High Relevance": 3,
+        }
+
         category = "No Relevance"  # By default, an activity is not relevant.
         for key in category_mapping:
             if key in response:
@@ -91,22 +127,34 @@ class MetricsAnalyzer(Module):
 
         return category
 
-    def __rate_timestamps_correctness(
-        self, activity: str, start, end
-    ) -> Tuple[str, float]:
-        messages = Prompt.objects.get(name="METRIC_TIMESTAMP_MESSAGES").text
+    def __get_context(self, row: pd.Series) -> str:
+        """
+        Return the text to rate the timestamps of an activity against. The full Patient Journey is used if the
+        activity has no sentence id to center a snippet on.
+        """
+        if (
+            self.timestamp_context == "full"
+            or not self.patient_journey_sentences
+            or pd.isna(row.get("sentence_id"))
+        ):
+            return self.patient_journey
+
+        return u.get_snippet(self.patient_journey_sentences, row["sentence_id"])
+
+    @staticmethod
+    def __build_timestamps_correctness_messages(
+        activity: str, start, end, context: str
+    ) -> List[Dict[str, str]]:
+        """Build the messages to rate the correctness of the timestamps of an activity."""
+        messages = get_prompt("METRIC_TIMESTAMP_MESSAGES")
         messages.append(
             {
                 "role": "user",
                 "content": (
-                    f"Text: {self.patient_journey}\nActivity: {activity}\n\
+                    f"Text: {context}\nActivity: {activity}\n\
                 Start date: {start}\nEnd date: {end}\n"
                 ),
             }
         )
 
-        timestamp_correctness, linear_probability = u.query_gpt(
-            messages, return_linear_probability=True, top_logprobs=1
-        )
-
-        return timestamp_correctness, linear_probability
+        return messages
@@ -1,23 +1,54 @@
 """Module providing classes for preprocessing patient input."""
+import re
 from pathlib import Path
+from typing import Dict, List, Optional
 from django.conf import settings
 
 from extraction.logic.module import Module
-from extraction.models import Prompt
+from extraction.logic.prompt_registry import get_prompt
+from tracex.logic.constants import PREPROCESSING_CHUNK_OVERLAP, PREPROCESSING_CHUNK_TOKENS
 from tracex.logic.logger import log_execution_time
+from tracex.logic.tokenizer import count_tokens
 from tracex.logic import utils as u
 
+PREPROCESSING_STEPS = [
+    "SPELLCHECK",
+    "PUNCTUATION",
+    "TIME_IDENTIFICATION",
+    "TIME_HOLIDAYS",
+    "TIME_GENERAL",
+    "TIME_IDENTIFICATION",
+    "TIME_RELATIVE",
+    "TIME_PROPAGATE",
+]
+# Steps that resolve dates relative to earlier dates, so they need the preprocessed text before a chunk as context.
+CONTEXT_STEPS = {"TIME_RELATIVE", "TIME_PROPAGATE"}
+DATE_PATTERN = re.compile(r"\d{4}/\d{2}/\d{2}")
+
 
 class Preprocessor(Module):
     """
     This class provides functions for preprocessing the patient input
     to enhance data quality and interpretability.
+
+    Long Patient Journeys are split into chunks of whole sentences with up to chunk_tokens tokens. Every preprocessing
+    step is applied to all chunks in parallel, and the preprocessed chunks are joined afterwards. The steps that
+    resolve relative dates are the exception: they process the chunks one after another, and each chunk gets the last
+    overlap sentences of the chunks before it and the latest date mentioned in them as context, both taken from the
+    output of the same step. A relative date that refers to a date resolved in the previous chunk, which itself was
+    relative, is therefore resolved as well.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        chunk_tokens: int = PREPROCESSING_CHUNK_TOKENS,
+        overlap: int = PREPROCESSING_CHUNK_OVERLAP,
+    ):
         super().__init__()
         self.name = "Preprocessor"
         self.description = "Preprocesses patient input for better data quality."
+        self.chunk_tokens = chunk_tokens
+        self.overlap = overlap
 
     @log_execution_time(Path(settings.BASE_DIR / "tracex/logs/execution_time.log"))
     def execute(
@@ -29,39 +60,86 @@ class Preprocessor(Module):
             patient_journey=patient_journey,
             patient_journey_sentences=patient_journey_sentences,
         )
-        preprocessed_text = self.__apply_preprocessing_step(
-            patient_journey, "SPELLCHECK"
-        )
-        preprocessed_text = self.__apply_preprocessing_step(
-            preprocessed_text, "PUNCTUATION"
-        )
-        preprocessed_text = self.__apply_preprocessing_step(
-            preprocessed_text, "TIME_IDENTIFICATION"
-        )
-        preprocessed_text = self.__apply_preprocessing_step(
-            preprocessed_text, "TIME_HOLIDAYS"
-        )
-        preprocessed_text = self.__apply_preprocessing_step(
-            preprocessed_text, "TIME_GENERAL"
-        )
-        preprocessed_text = self.__apply_preprocessing_step(
-            preprocessed_text, "TIME_IDENTIFICATION"
-        )
-        preprocessed_text = self.__apply_preprocessing_step(
-            preprocessed_text, "TIME_RELATIVE"
-        )
-        preprocessed_text = self.__apply_preprocessing_step(
-            preprocessed_text, "TIME_PROPAGATE"
-        )
+        chunks = self.__split_into_chunks(patient_journey)
+        if len(chunks) == 1:
+            preprocessed_text = patient_journey
+            for step in PREPROCESSING_STEPS:
+                preprocessed_text = self.__apply_preprocessing_step(preprocessed_text, step)
 
-        return preprocessed_text
+            return preprocessed_text
+
+        for step in PREPROCESSING_STEPS:
+            if step in CONTEXT_STEPS:
+                preprocessed_chunks = []
+                for chunk in chunks:
+                    context = self.__build_context(preprocessed_chunks)
+                    preprocessed_chunks.append(u.query_gpt(self.__build_messages(chunk, step, context)))
+                chunks = preprocessed_chunks
+            else:
+                chunks = u.gather_gpt([self.__build_messages(chunk, step, None) for chunk in chunks])
+
+        return " ".join(chunk.strip() for chunk in chunks)
 
     @staticmethod
     def __apply_preprocessing_step(text: str, prompt_name: str) -> str:
         """Applies a preprocessing step based on the step name."""
-        messages = Prompt.objects.get(name=f"PREPROCESSING_{prompt_name}").text
+        messages = get_prompt(f"PREPROCESSING_{prompt_name}")
         new_user_message = {"role": "user", "content": text}
         messages.append(new_user_message)
         preprocessed_text = u.query_gpt(messages)
 
         return preprocessed_text
+
+    @staticmethod
+    def __build_messages(text: str, prompt_name: str, context: Optional[str]) -> List[Dict[str, str]]:
+        """Builds the messages of a preprocessing step for a chunk, with the text before the chunk as context."""
+        messages = get_prompt(f"PREPROCESSING_{prompt_name}")
+        if context is not None:
+            messages.append(
+                {
+                    "role": "system",
+                    "content": "The following text continues an earlier text. Use the earlier text only as context "
+                    "for dates and do not return it. Earlier text: " + context,
+                }
+            )
+        messages.append({"role": "user", "content": text})
+
+        return messages
+
+    def __build_context(self, previous_chunks: List[str]) -> Optional[str]:
+        """
+        Builds the context of a chunk from the chunks before it, as preprocessed by the current step. The context
+        consists of the last sentences before the chunk and, if these sentences mention no date, the latest date
+        mentioned before.
+        """
+        if not previous_chunks:
+            return None
+
+        previous_sentences = u.Conversion.text_to_sentence_list(" ".join(previous_chunks))
+        context = " ".join(previous_sentences[-self.overlap:]) if self.overlap > 0 else ""
+        if DATE_PATTERN.search(context) is None:
+            dates = DATE_PATTERN.findall(" ".join(previous_chunks))
+            if dates:
+                context = f"(Latest date mentioned so far: {dates[-1]}) {context}"
+
+        return context.strip() or None
+
+    def __split_into_chunks(self, text: str) -> List[str]:
+        """Splits a text into chunks of whole sentences with up to chunk_tokens tokens each."""
+        if self.chunk_tokens <= 0 or count_tokens(text) <= self.chunk_tokens:
+            return [text]
+
+        chunks = []
+        chunk_sentences = []
+        chunk_tokens = 0
+        for sentence in u.Conversion.text_to_sentence_list(text):
+            sentence_tokens = count_tokens(sentence)
+            if chunk_sentences and chunk_tokens + sentence_tokens > self.chunk_tokens:
+                chunks.append(" ".join(chunk_sentences))
+                chunk_sentences = []
+                chunk_tokens = 0
+            chunk_sentences.append(sentence)
+            chunk_tokens += sentence_tokens
+        chunks.append(" ".join(chunk_sentences))
+
+        return chunks
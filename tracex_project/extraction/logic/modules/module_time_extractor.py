@@ -1,25 +1,44 @@
 """This module extracts the time information from the Patient Journey."""
+import json
+import re
 from pathlib import Path
-from typing import List
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
 from django.conf import settings
+import numpy as np
 import pandas as pd
 
 from extraction.logic.module import Module
-from extraction.models import Prompt
+from extraction.logic.prompt_registry import get_prompt
+from tracex.logic.constants import FUSED_TIME_EXTRACTION
 from tracex.logic.logger import log_execution_time
 from tracex.logic import utils as u
 
+DATE_PATTERN = re.compile(r"\d{8}T\d{4}|N/A")
+FUSED_INSTRUCTION = (
+    " Extract both the start date and the end date of the activity. If there is no information about the end date"
+    " at all, state the start date also as the end date. Answer with a JSON object with the keys"
+    ' "start" and "end" and nothing else, e.g. {"start": "20200401T0000", "end": "20200405T0000"}.'
+)
+
 
 class TimeExtractor(Module):
     """
     This is the module that extracts the time information from the Patient Journey. This includes start dates,
     end dates and durations.
+
+    In fused mode, the start date and the end date of an activity are extracted with a single request. Activities
+    whose answer cannot be parsed are extracted again with one request for the start date and one for the end date.
     """
 
-    def __init__(self):
+    reads = ("activity", "sentence_id")
+    writes = ("time:timestamp", "time:end_timestamp", "time:duration")
+    extracts_rows = True
+
+    def __init__(self, fused: bool = FUSED_TIME_EXTRACTION):
         super().__init__()
         self.name = "Time Extractor"
         self.description = "Extracts the timestamps for the corresponding activity labels from a Patient Journey."
+        self.fused = fused
 
     @log_execution_time(Path(settings.BASE_DIR / "tracex/logs/execution_time.log"))
     def execute(
@@ -38,63 +57,156 @@ class TimeExtractor(Module):
             cohort=cohort,
         )
 
-        df["time:timestamp"] = df.apply(self.__extract_start_date, axis=1)
-        df["time:end_timestamp"] = df.apply(self.__extract_end_date, axis=1)
+        unextracted = pd.Series(True, index=df.index)
+        if self.fused:
+            dates = [
+                self.__parse_dates(output)
+                for output in u.gather_gpt([self.__build_dates_messages(row) for _, row in df.iterrows()])
+            ]
+            df["time:timestamp"] = [start_date for start_date, _ in dates]
+            df["time:end_timestamp"] = [end_date for _, end_date in dates]
+            unextracted = df["time:timestamp"].isna()
+
+        remaining_df = df[unextracted].copy()
+        remaining_df["time:timestamp"] = u.gather_gpt(
+            [self.__build_start_date_messages(row) for _, row in remaining_df.iterrows()]
+        )
+        df.loc[unextracted, "time:timestamp"] = remaining_df["time:timestamp"]
+        df.loc[unextracted, "time:end_timestamp"] = u.gather_gpt(
+            [self.__build_end_date_messages(row) for _, row in remaining_df.iterrows()]
+        )
+
+        return self.finalize(df)
+
+    def extract_row(self, row: pd.Series) -> Awaitable[Dict[str, Any]]:
+        """
+        Returns a coroutine that extracts the start date and the end date of a single activity, either with a single
+        request in fused mode, or with a request for the start date and then one for the end date.
+        """
+        dates_messages = self.__build_dates_messages(row) if self.fused else None
+        start_date_messages = self.__build_start_date_messages(row)
+        end_date_messages = get_prompt("END_DATE_MESSAGES")
+
+        async def extract_dates():
+            if dates_messages is not None:
+                start_date, end_date = self.__parse_dates(await u.aquery_gpt(dates_messages))
+                if start_date is not None:
+                    return {"time:timestamp": start_date, "time:end_timestamp": end_date}
+
+            start_date = await u.aquery_gpt(start_date_messages)
+            end_date = await u.aquery_gpt(
+                end_date_messages + [self.__build_end_date_user_message(row, start_date)]
+            )
+
+            return {"time:timestamp": start_date, "time:end_timestamp": end_date}
+
+        return extract_dates()
+
+    def finalize(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Converts the extracted dates, fills missing dates and calculates the durations."""
         df = self.__post_processing(df)
-        df["time:duration"] = df.apply(self.__calculate_duration, axis=1)
+        df["time:duration"] = self.__calculate_durations(df)
 
         return df
 
-    def __extract_start_date(self, row: pd.Series) -> str:
-        """Extract the start date for a given activity."""
-        lower, upper = u.get_snippet_bounds(
-            index=(int(row["sentence_id"])), length=len(self.patient_journey_sentences)
-        )
-        patient_journey_snippet = ". ".join(self.patient_journey_sentences[lower:upper])
-        messages = Prompt.objects.get(name="START_DATE_MESSAGES").text
+    def __build_start_date_messages(self, row: pd.Series) -> List[Dict[str, str]]:
+        """Build the messages to extract the start date for a given activity."""
+        messages = get_prompt("START_DATE_MESSAGES")
         messages.append(
             {
                 "role": "user",
                 "content": "Text: "
-                + patient_journey_snippet
+                + self.__get_snippet(row)
                 + "\nActivity label: "
                 + row["activity"],
             }
         )
-        start = u.query_gpt(messages)
-
-        return start
 
-    def __extract_end_date(self, row: pd.Series) -> str:
-        """Extract the end date for a given activity."""
-        lower, upper = u.get_snippet_bounds(
-            index=(int(row["sentence_id"])), length=len(self.patient_journey_sentences)
-        )
-        patient_journey_snippet = ". ".join(self.patient_journey_sentences[lower:upper])
-        messages = Prompt.objects.get(name="END_DATE_MESSAGES").text
+        return messages
+
+    def __build_dates_messages(self, row: pd.Series) -> List[Dict[str, str]]:
+        """
+        Build the messages to extract the start date and the end date for a given activity with a single request.
+        The examples of the start date prompt and the end date prompt for the same activity are combined into one
+        example with both dates.
+        """
+        start_system_message, *start_examples = get_prompt("START_DATE_MESSAGES")
+        _, *end_examples = get_prompt("END_DATE_MESSAGES")
+        messages = [{"role": "system", "content": start_system_message["content"] + FUSED_INSTRUCTION}]
+        for start_question, start_answer, end_question, end_answer in zip(
+            start_examples[::2], start_examples[1::2], end_examples[::2], end_examples[1::2]
+        ):
+            if not end_question["content"].strip().startswith(start_question["content"].strip()):
+                continue
+            messages.append({"role": "user", "content": start_question["content"]})
+            messages.append(
+                {
+                    "role": "assistant",
+                    "content": json.dumps({"start": start_answer["content"], "end": end_answer["content"]}),
+                }
+            )
         messages.append(
             {
                 "role": "user",
-                "content": "\nText: "
-                + patient_journey_snippet
+                "content": "Text: "
+                + self.__get_snippet(row)
                 + "\nActivity label: "
-                + row["activity"]
-                + "\nStart date: "
-                + row["time:timestamp"],
-            },
+                + row["activity"],
+            }
         )
-        end = u.query_gpt(messages)
 
-        return end
+        return messages
+
+    def __build_end_date_messages(self, row: pd.Series) -> List[Dict[str, str]]:
+        """Build the messages to extract the end date for a given activity."""
+        messages = get_prompt("END_DATE_MESSAGES")
+        messages.append(self.__build_end_date_user_message(row, row["time:timestamp"]))
+
+        return messages
+
+    def __build_end_date_user_message(self, row: pd.Series, start_date: str) -> Dict[str, str]:
+        """Build the user message to extract the end date for a given activity and its start date."""
+        return {
+            "role": "user",
+            "content": "\nText: "
+            + self.__get_snippet(row)
+            + "\nActivity label: "
+            + row["activity"]
+            + "\nStart date: "
+            + start_date,
+        }
+
+    def __get_snippet(self, row: pd.Series) -> str:
+        """Return the sentences of the Patient Journey around the sentence of a given activity."""
+        return u.get_snippet(self.patient_journey_sentences, row["sentence_id"])
+
+    @staticmethod
+    def __parse_dates(output: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Parse the start date and the end date from the answer of a fused request. Returns None for both dates if the
+        answer is not a JSON object with a valid start date and end date.
+        """
+        try:
+            dates = json.loads(output.strip().removeprefix("```json").strip("`"))
+            start_date, end_date = str(dates["start"]).strip(), str(dates["end"]).strip()
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None, None
+        if not DATE_PATTERN.fullmatch(start_date) or not DATE_PATTERN.fullmatch(end_date):
+            return None, None
+
+        return start_date, end_date
 
     @staticmethod
-    def __calculate_duration(row: pd.Series) -> str:
-        """Calculate the duration of an activity."""
-        duration = row["time:end_timestamp"] - row["time:timestamp"]
-        hours, remainder = divmod(duration.total_seconds(), 3600)
-        minutes, seconds = divmod(remainder, 60)
+    def __calculate_durations(df: pd.DataFrame) -> pd.Series:
+        """Calculate the durations of all activities, formatted as hours, minutes and seconds."""
+        total_seconds = (df["time:end_timestamp"] - df["time:timestamp"]).dt.total_seconds()
+        hours, remainder = np.divmod(total_seconds, 3600)
+        minutes, seconds = np.divmod(remainder, 60)
+
+        def format_part(part: pd.Series) -> pd.Series:
+            return part.astype("int64").astype(str).str.zfill(2)
 
-        return f"{int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}"
+        return format_part(hours) + ":" + format_part(minutes) + ":" + format_part(seconds)
 
     @staticmethod
     def __post_processing(df: pd.DataFrame) -> pd.DataFrame:
@@ -118,21 +230,18 @@ class TimeExtractor(Module):
 
             return _df
 
-        def fix_end_dates(row: pd.Series) -> pd.Series:
-            if (
-                row["time:end_timestamp"] is pd.NaT
-                and row["time:timestamp"] is not pd.NaT
-            ):
-                row["time:end_timestamp"] = row["time:timestamp"]
+        def fix_end_dates(_df: pd.DataFrame) -> pd.DataFrame:
+            missing_end_dates = _df["time:end_timestamp"].isna() & _df["time:timestamp"].notna()
+            _df.loc[missing_end_dates, "time:end_timestamp"] = _df.loc[missing_end_dates, "time:timestamp"]
 
-            return row
+            return _df
 
         df = convert_to_datetime(df, "time:timestamp")
         df = convert_to_datetime(df, "time:end_timestamp")
 
         df = set_default_date_if_na(df, "time:timestamp")
 
-        df = df.apply(fix_end_dates, axis=1)
+        df = fix_end_dates(df)
 
         df = set_default_date_if_na(df, "time:end_timestamp")
 
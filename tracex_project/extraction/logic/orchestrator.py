@@ -1,12 +1,21 @@
 """
 Module providing the orchestrator and corresponding configuration, that manages the modules.
 
+Functions:
+get_module_dependencies -- Return the modules each module depends on, derived from the columns they read and write.
+get_extraction_settings -- Return the settings that change the extracted trace, including the classifier version.
+
 Classes:
 ExtractionConfiguration -- Dataclass for the configuration of the orchestrator.
-Orchestrator -- Singleton class for managing the modules.
+Orchestrator -- Class for managing the modules of an extraction run.
 """
+import asyncio
+import hashlib
+import json
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from dataclasses import dataclass
-from typing import Any, List, Optional, Dict
+from typing import Any, Callable, List, Optional, Dict, Set
+from django.db import connections
 from django.utils.dateparse import parse_duration
 from django.core.exceptions import ObjectDoesNotExist
 import pandas as pd
@@ -20,8 +29,81 @@ from extraction.logic.modules import (
     LocationExtractor,
     MetricsAnalyzer,
 )
+from extraction.logic.checkpoints import checkpoint_store
+from extraction.logic.fast_path_classifier import get_fast_path_classifier
+from extraction.logic.module import Module
+from extraction.logic.prompt_registry import get_prompt_version
 from extraction.models import Trace, PatientJourney, Event, Cohort, Metric
-from tracex.logic.utils import DataFrameUtilities, Conversion
+from tracex.logic import utils as u
+from tracex.logic.constants import (
+    ACTIVITY_WINDOW_OVERLAP,
+    ACTIVITY_WINDOW_SENTENCES,
+    CHECKPOINTS_ENABLED,
+    EVENT_TYPE_BATCH_SIZE,
+    FAST_PATH_CONFIDENCE,
+    FAST_PATH_ENABLED,
+    FUSED_TIME_EXTRACTION,
+    LLM_CONCURRENCY,
+    LLM_PROMPT_OVERFLOW,
+    METRICS_TIMESTAMP_CONTEXT,
+    MODEL,
+    MODULE_CONCURRENCY,
+    PREPROCESSING_CHUNK_OVERLAP,
+    PREPROCESSING_CHUNK_TOKENS,
+    STREAM_ACTIVITY_LABELS,
+    STRUCTURED_COHORT_TAGS,
+)
+from tracex.logic.logger import log_token_report
+from tracex.logic.token_budget import StageTokenBudget, TokenBudget, use_token_budget
+from tracex.logic.utils import DataFrameUtilities, Conversion, TOKENS_USED_LOG_PATH
+
+
+def get_extraction_settings() -> Dict[str, Any]:
+    """
+    Return the settings that change the trace extracted from a Patient Journey, together with the version of the
+    local classifier of the fast path, which is None if the fast path is disabled or no classifier was built.
+    """
+    classifier = get_fast_path_classifier()
+
+    return {
+        "activity_window_overlap": ACTIVITY_WINDOW_OVERLAP,
+        "activity_window_sentences": ACTIVITY_WINDOW_SENTENCES,
+        "event_type_batch_size": EVENT_TYPE_BATCH_SIZE,
+        "fast_path_classifier": None if classifier is None else classifier.version,
+        "fast_path_confidence": FAST_PATH_CONFIDENCE,
+        "fast_path_enabled": FAST_PATH_ENABLED,
+        "fused_time_extraction": FUSED_TIME_EXTRACTION,
+        "llm_prompt_overflow": LLM_PROMPT_OVERFLOW,
+        "metrics_timestamp_context": METRICS_TIMESTAMP_CONTEXT,
+        "preprocessing_chunk_overlap": PREPROCESSING_CHUNK_OVERLAP,
+        "preprocessing_chunk_tokens": PREPROCESSING_CHUNK_TOKENS,
+        "structured_cohort_tags": STRUCTURED_COHORT_TAGS,
+    }
+
+
+def get_module_dependencies(modules: Dict[str, Module]) -> Dict[str, Set[str]]:
+    """
+    Return the keys of the modules each module depends on, derived from the columns they read and write.
+
+    A module depends on an earlier module if it reads or writes a column the earlier module writes, or writes a column
+    the earlier module reads. A module that declares no written columns depends on all earlier modules, and all later
+    modules depend on it, so that it runs on its own.
+
+    Positional Arguments:
+    modules -- Modules by key, in the order they are configured.
+    """
+    dependencies = {}
+    for index, (key, module) in enumerate(modules.items()):
+        dependencies[key] = {
+            earlier_key
+            for earlier_key, earlier_module in list(modules.items())[:index]
+            if not module.writes
+            or not earlier_module.writes
+            or set(earlier_module.writes) & set(module.reads + module.writes)
+            or set(earlier_module.reads) & set(module.writes)
+        }
+
+    return dependencies
 
 
 @dataclass
@@ -29,10 +111,13 @@ class ExtractionConfiguration:
     """
     Dataclass for the configuration of the orchestrator. This specifies all modules that can be executed, what event
     types are used to classify the activity labels, what locations are used to classify the activity labels and what the
-    Patient Journey is, on which the pipeline is executed.
+    Patient Journey is, on which the pipeline is executed. If stream_activities is set, the activities are passed to
+    the per-activity modules while the Activity Labeler is still producing the remaining ones. Up to
+    module_concurrency modules that do not depend on each other's columns run at the same time.
 
     Public Methods:
     update -- Update the configuration with a dictionary mapping its attributes to new values.
+    get_fingerprint -- Return a hash of everything in the configuration that affects the extracted trace.
     """
 
     def __init__(
@@ -41,11 +126,16 @@ class ExtractionConfiguration:
         event_types: Optional[List[str]] = None,
         locations: Optional[List[str]] = None,
         activity_key: Optional[str] = "event_type",
+        *,
+        stream_activities: bool = STREAM_ACTIVITY_LABELS,
+        module_concurrency: int = MODULE_CONCURRENCY,
     ):
         self.patient_journey = patient_journey
         self.event_types = event_types
         self.locations = locations
         self.activity_key = activity_key
+        self.stream_activities = stream_activities
+        self.module_concurrency = module_concurrency
         self.modules = {
             "preprocessing": Preprocessor,
             "cohort_tagging": CohortTagger,
@@ -63,14 +153,32 @@ class ExtractionConfiguration:
             if key in valid_keys:
                 setattr(self, key, value)
 
+    def get_fingerprint(self) -> str:
+        """
+        Return a hash of the modules, the model, the prompts and the extraction settings, which determine the trace
+        extracted from a Patient Journey. The event types, locations and activity key only filter the results, and are
+        therefore not part of it.
+        """
+        fingerprint = {
+            "modules": sorted(self.modules),
+            "model": MODEL,
+            "prompts": get_prompt_version(),
+            "settings": get_extraction_settings(),
+        }
+
+        return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
 
 class Orchestrator:
     """
-    Singleton class for managing the modules.
+    Class for managing the modules of an extraction run.
+
+    Every run has its own orchestrator, so that concurrent runs do not share their configuration, data and cohort.
+    The orchestrators of the runs of the web interface are kept in the run registry, see
+    extraction.logic.run_registry. If the orchestrator has a run id, the output of every module is checkpointed, and
+    running again resumes after the last module whose checkpoint is still valid, see extraction.logic.checkpoints.
 
     Public Methods:
-    get_instance -- Return the singleton instance of the orchestrator.
-    reset_instance -- Reset the singleton instance of the orchestrator.
     set_configuration -- Set the configuration for the orchestrator instance.
     get_configuration -- Return the configuration for the orchestrator instance.
     set_data -- Set the data for the orchestrator instance.
@@ -82,35 +190,22 @@ class Orchestrator:
     reduce_modules -- Update the modules of the orchestrator instance.
     initialize_modules -- Bring the modules into the right order and initialize them.
     run -- Run the modules and set default values for modules not executed.
+    get_token_report -- Return the token usage and estimated and worst-case cost of the last run.
     save_results_to_db -- Save the trace to the database.
     set_default_values -- Set default values if a specific module was deselected.
     update_progress -- Update the progress of the extraction.
     """
 
-    _instance = None
-
-    def __new__(cls, configuration: ExtractionConfiguration = None):
-        if not cls._instance:
-            cls._instance = super().__new__(cls)
-
-        return cls._instance
-
-    def __init__(self, configuration: Optional[ExtractionConfiguration] = None):
-        if configuration is not None:
-            self.configuration = configuration
+    def __init__(self, configuration: Optional[ExtractionConfiguration] = None, run_id: Optional[str] = None):
+        self.configuration = configuration
+        self.run_id = run_id
+        self.checkpoint_key: Optional[str] = None
         self.data = None
         self.cohort = None
         self.db_objects_id: Dict[str, int] = {}
-
-    @classmethod
-    def get_instance(cls):
-        """Return the singleton instance of the orchestrator."""
-        return cls._instance
-
-    @classmethod
-    def reset_instance(cls):
-        """Reset the singleton instance of the orchestrator."""
-        cls._instance = None
+        self.token_budget: Optional[TokenBudget] = None
+        self.is_running = False
+        self.on_progress: Optional[Callable[[int, str], None]] = None
 
     def set_configuration(self, configuration: ExtractionConfiguration):
         """Set the configuration for the orchestrator instance."""
@@ -162,46 +257,110 @@ class Orchestrator:
         }
         return modules
 
-    def run(self, view=None) -> None:
-        """Run the modules and set default values for modules not executed."""
+    def run(self, view=None, on_progress: Optional[Callable[[int, str], None]] = None) -> None:
+        """
+        Run the modules and set default values for modules not executed.
+
+        All requests of the run count against a new token budget. The budget is checked before each module, and the
+        token usage and the estimated and worst-case cost of the sent requests are logged afterwards. Modules with a
+        valid checkpoint of an earlier run with the same run id are not run again.
+
+        Keyword Arguments:
+        view -- View whose session receives the progress of the run. Default is None.
+        on_progress -- Function called with the percentage and the running modules whenever a module starts, used by
+                       background jobs. Default is None.
+        """
+        self.token_budget = TokenBudget()
+        self.on_progress = on_progress
+        self.is_running = True
+        if self.__is_checkpointing():
+            checkpoint_store.collect_garbage()
+        try:
+            with use_token_budget(self.token_budget):
+                self.__run_modules(view)
+        finally:
+            self.is_running = False
+            log_token_report(TOKENS_USED_LOG_PATH, self.get_token_report())
+
+    def get_token_report(self) -> Optional[Dict[str, Any]]:
+        """Return the token usage and estimated and worst-case cost of the last run, or None if nothing was run yet."""
+        if self.token_budget is None:
+            return None
+
+        return self.token_budget.get_report()
+
+    def __run_modules(self, view) -> None:
+        """
+        Run the modules, checking the token budget before each module. The modules working on the DataFrame of
+        activities run as soon as the modules they depend on are done, see __run_module_graph.
+        """
         modules = self.initialize_modules()
         execution_step: int = 1
+        self.checkpoint_key = self.__get_checkpoint_key(modules)
 
         patient_journey = self.get_configuration().patient_journey
         if "preprocessing" in modules:
-            self.update_progress(view, execution_step, "Preprocessing")
-            patient_journey = modules["preprocessing"].execute(
-                patient_journey=self.get_configuration().patient_journey
-            )
+            checkpoint = self.__load_checkpoint("preprocessing")
+            if checkpoint is not None:
+                patient_journey = checkpoint["output"]
+            else:
+                self.token_budget.start_stage(modules["preprocessing"].name)
+                self.update_progress(view, execution_step, "Preprocessing")
+                patient_journey = modules["preprocessing"].execute(
+                    patient_journey=self.get_configuration().patient_journey
+                )
+                self.__save_checkpoint("preprocessing", patient_journey)
             execution_step += 1
         patient_journey_sentences: List[str] = Conversion.text_to_sentence_list(
             patient_journey
         )
 
-        self.update_progress(view, execution_step, "Cohort Tagger")
-        self.set_cohort(
-            modules["cohort_tagging"].execute_and_save(
-                self.get_data(),
-                patient_journey=patient_journey,
-                patient_journey_sentences=patient_journey_sentences,
+        checkpoint = self.__load_checkpoint("cohort_tagging")
+        if checkpoint is not None:
+            self.set_cohort(checkpoint["output"])
+        else:
+            self.token_budget.start_stage(modules["cohort_tagging"].name)
+            self.update_progress(view, execution_step, "Cohort Tagger")
+            self.set_cohort(
+                modules["cohort_tagging"].execute_and_save(
+                    self.get_data(),
+                    patient_journey=patient_journey,
+                    patient_journey_sentences=patient_journey_sentences,
+                )
             )
-        )
+            self.__save_checkpoint("cohort_tagging", self.get_cohort())
         execution_step += 1
 
-        for remaining_module_key in [
-            key for key in modules if key not in ("cohort_tagging", "preprocessing")
-        ]:
-            module = modules[remaining_module_key]
-            self.update_progress(view, execution_step, module.name)
+        restored_module_keys = self.__restore_module_checkpoints(
+            {key: module for key, module in modules.items() if key not in ("cohort_tagging", "preprocessing")}
+        )
+        execution_step += len(restored_module_keys)
+        executed_module_keys = ["cohort_tagging", "preprocessing"] + restored_module_keys
+        if (
+            self.get_configuration().stream_activities
+            and "activity_labeling" in modules
+            and "activity_labeling" not in executed_module_keys
+        ):
+            row_module_keys = [key for key, module in modules.items() if module.extracts_rows]
+            self.token_budget.start_stage(modules["activity_labeling"].name)
+            self.update_progress(view, execution_step, modules["activity_labeling"].name)
             self.set_data(
-                module.execute(
-                    self.get_data(),
-                    patient_journey=patient_journey,
-                    patient_journey_sentences=patient_journey_sentences,
-                    cohort=self.get_cohort(),
+                self.__stream_activities(
+                    modules, row_module_keys, patient_journey, patient_journey_sentences
                 )
             )
-            execution_step += 1
+            for key in ["activity_labeling"] + row_module_keys:
+                self.__save_module_checkpoint(key, modules[key], self.get_data(), streamed_modules=row_module_keys)
+            execution_step += 1 + len(row_module_keys)
+            executed_module_keys += ["activity_labeling"] + row_module_keys
+
+        self.__run_module_graph(
+            {key: module for key, module in modules.items() if key not in executed_module_keys},
+            view,
+            execution_step,
+            patient_journey,
+            patient_journey_sentences,
+        )
 
         if self.get_data() is not None:
             try:
@@ -212,12 +371,232 @@ class Orchestrator:
             self.get_data().insert(0, "case:concept:name", latest_id + 1)
             self.set_default_values()
 
-    def save_results_to_db(self) -> None:
-        """Save the trace to the database."""
+    def __run_module_graph(
+        self,
+        modules: Dict[str, Module],
+        view,
+        execution_step: int,
+        patient_journey: str,
+        patient_journey_sentences: List[str],
+    ) -> None:
+        """
+        Run the modules on a thread pool, each as soon as the modules it depends on are done.
+
+        Every module receives a copy of the columns it reads, and the columns it writes are merged into the data once
+        it is done. Modules writing the activity column create the rows, so their result replaces the data. The
+        progress shows the modules that are currently running, and the requests of every module are reported in its
+        own stage of the token budget.
+        """
+        dependencies = get_module_dependencies(modules)
+        concurrency = max(1, self.get_configuration().module_concurrency)
+        initial_columns = [] if self.get_data() is None else list(self.get_data().columns)
+        pending_keys = list(modules)
+        running: Dict[Future, str] = {}
+        done_keys = set()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while pending_keys or running:
+                ready_keys = [key for key in pending_keys if dependencies[key] <= done_keys]
+                for key in ready_keys[: concurrency - len(running)]:
+                    module = modules[key]
+                    self.token_budget.start_stage(module.name)
+                    pending_keys.remove(key)
+                    running[
+                        executor.submit(
+                            self.__execute_module,
+                            module,
+                            self.token_budget.for_stage(module.name),
+                            self.__get_module_input(module),
+                            patient_journey,
+                            patient_journey_sentences,
+                        )
+                    ] = key
+                    self.update_progress(
+                        view, execution_step, ", ".join(modules[running_key].name for running_key in running.values())
+                    )
+                    execution_step += 1
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in sorted(finished, key=lambda future: list(modules).index(running[future])):
+                    key = running.pop(future)
+                    self.__merge_module_output(modules[key], future.result())
+                    self.__save_module_checkpoint(key, modules[key], future.result())
+                    done_keys.add(key)
+
+        # The columns are ordered as if the modules had run one after another, regardless of which one finished first.
+        data = self.get_data()
+        if data is not None:
+            written_columns = [column for module in modules.values() for column in module.writes]
+            columns = dict.fromkeys(initial_columns + written_columns + list(data.columns))
+            self.set_data(data.reindex(columns=[column for column in columns if column in data.columns]))
+
+    def __execute_module(
+        self,
+        module: Module,
+        token_budget: StageTokenBudget,
+        df: Optional[pd.DataFrame],
+        patient_journey: str,
+        patient_journey_sentences: List[str],
+    ) -> pd.DataFrame:
+        """Execute a module on a thread of the pool, within the stage of the module in the token budget."""
+        try:
+            with use_token_budget(token_budget):
+                return module.execute(
+                    df,
+                    patient_journey=patient_journey,
+                    patient_journey_sentences=patient_journey_sentences,
+                    cohort=self.get_cohort(),
+                )
+        finally:
+            # The thread opened its own database connections, if any, which are not closed by Django.
+            connections.close_all()
+
+    def __get_module_input(self, module: Module) -> Optional[pd.DataFrame]:
+        """Return a copy of the columns a module reads, or the whole data if the module declares no written columns."""
+        data = self.get_data()
+        if data is None or not module.writes:
+            return data
+
+        return data[[column for column in module.reads if column in data.columns]].copy()
+
+    def __merge_module_output(self, module: Module, output: pd.DataFrame) -> None:
+        """Merge the columns a module writes into the data, or replace the data if the module creates the rows."""
+        if self.get_data() is None or not module.writes or "activity" in module.writes:
+            self.set_data(output)
+            return
+
+        data = self.get_data()
+        for column in module.writes:
+            if column in output.columns:
+                data[column] = output[column]
+
+    def __is_checkpointing(self) -> bool:
+        """Return whether the output of the modules is checkpointed, which needs a run id."""
+        return CHECKPOINTS_ENABLED and self.run_id is not None
+
+    def __get_checkpoint_key(self, modules: Dict[str, Module]) -> Optional[str]:
+        """
+        Return a hash of the input of the run, i.e. the Patient Journey, whether it is preprocessed, the model, the
+        prompts and the extraction settings. Checkpoints of a run with another input are outdated and not restored.
+        """
+        if not self.__is_checkpointing():
+            return None
+        run_input = [
+            self.get_configuration().patient_journey,
+            "preprocessing" in modules,
+            MODEL,
+            get_prompt_version(),
+            get_extraction_settings(),
+        ]
+
+        return hashlib.sha256(json.dumps(run_input, sort_keys=True).encode()).hexdigest()
+
+    def __save_checkpoint(self, module_key: str, output: Any) -> None:
+        """Checkpoint the output of a module, together with the input of the run."""
+        if self.__is_checkpointing():
+            checkpoint_store.save(self.run_id, module_key, {"key": self.checkpoint_key, "output": output})
+
+    def __load_checkpoint(self, module_key: str) -> Optional[Dict[str, Any]]:
+        """Return the checkpoint of a module, or None if there is none or it was stored for another input."""
+        if not self.__is_checkpointing():
+            return None
+        checkpoint = checkpoint_store.load(self.run_id, module_key)
+        if checkpoint is None or checkpoint.get("key") != self.checkpoint_key:
+            return None
+
+        return checkpoint
+
+    def __save_module_checkpoint(
+        self, module_key: str, module: Module, output: pd.DataFrame, streamed_modules: Optional[List[str]] = None
+    ) -> None:
+        """
+        Checkpoint the columns a module writes. Modules creating the rows keep all columns except those written by
+        the modules streamed with them, which are checkpointed on their own.
+        """
+        if not self.__is_checkpointing() or output is None:
+            return
+        if module.writes and "activity" not in module.writes:
+            output = output[[column for column in module.writes if column in output.columns]]
+        elif streamed_modules:
+            streamed_columns = {
+                column for key in streamed_modules for column in self.get_configuration().modules[key].writes
+            }
+            output = output[[column for column in output.columns if column not in streamed_columns]]
+        self.__save_checkpoint(module_key, output)
+
+    def __restore_module_checkpoints(self, modules: Dict[str, Module]) -> List[str]:
+        """
+        Merge the checkpointed output of the modules into the data and return the keys of the restored modules. A
+        module is only restored if all modules it depends on were restored, so that its output matches their output.
+        """
+        dependencies = get_module_dependencies(modules)
+        restored_keys = []
+        for key, module in modules.items():
+            if not dependencies[key] <= set(restored_keys):
+                continue
+            checkpoint = self.__load_checkpoint(key)
+            if checkpoint is not None:
+                self.__merge_module_output(module, checkpoint["output"])
+                restored_keys.append(key)
+
+        return restored_keys
+
+    def __stream_activities(
+        self,
+        modules: Dict[str, Any],
+        row_module_keys: List[str],
+        patient_journey: str,
+        patient_journey_sentences: List[str],
+    ) -> pd.DataFrame:
+        """
+        Stream the activity labels and pass every activity to the per-activity modules as soon as it is labeled, so
+        that their requests overlap with the labeling. The results are collected in the order of the activities and
+        post-processed by each module once all activities are done.
+        """
+        row_modules = [modules[key] for key in row_module_keys]
+        for module in row_modules:
+            module.prepare(
+                patient_journey=patient_journey,
+                patient_journey_sentences=patient_journey_sentences,
+                cohort=self.get_cohort(),
+            )
+
+        activities = []
+        futures = [[] for _ in row_modules]
+        semaphore = asyncio.Semaphore(max(1, LLM_CONCURRENCY))
+        try:
+            for activity in modules["activity_labeling"].stream(
+                patient_journey=patient_journey,
+                patient_journey_sentences=patient_journey_sentences,
+                cohort=self.get_cohort(),
+            ):
+                activities.append(activity)
+                for module, module_futures in zip(row_modules, futures):
+                    module_futures.append(u.submit_gpt(module.extract_row(pd.Series(activity)), semaphore=semaphore))
+            module_results = [u.get_results(module_futures) for module_futures in futures]
+        except BaseException:
+            # The rows are discarded if the labeling or a row fails, so the other rows must not keep using tokens.
+            for module_futures in futures:
+                for future in module_futures:
+                    future.cancel()
+            raise
+
+        df = pd.DataFrame(activities, columns=["activity", "sentence_id"])
+        for module, results in zip(row_modules, module_results):
+            for column in results[0] if results else []:
+                df[column] = [result[column] for result in results]
+            df = module.finalize(df)
+
+        return df
+
+    def save_results_to_db(self) -> Trace:
+        """Save the trace to the database and return it."""
         patient_journey: PatientJourney = PatientJourney.manager.get(
             pk=self.get_db_objects_id("patient_journey")
         )
-        trace: Trace = Trace.manager.create(patient_journey=patient_journey)
+        trace: Trace = Trace.manager.create(
+            patient_journey=patient_journey, config_fingerprint=self.get_configuration().get_fingerprint()
+        )
         events_with_metric_list = []
         metric_list = []
         for _, row in self.get_data().iterrows():
@@ -251,6 +630,8 @@ class Orchestrator:
         patient_journey.trace.add(trace)
         patient_journey.save()
 
+        return trace
+
     def set_default_values(self) -> None:
         """Set default values for all modules not executed."""
         config_modules = self.get_configuration().modules
@@ -268,11 +649,16 @@ class Orchestrator:
             data["correctness_confidence"] = None
 
     def update_progress(self, view, execution_step: int, module_name: str) -> None:
-        """Update the progress of the extraction."""
+        """Update the progress of the extraction in the session of the view and report it to on_progress."""
+        if view is None and self.on_progress is None:
+            return
+
+        percentage = round(
+            (execution_step / (len(self.get_configuration().modules) + 1)) * 100
+        )
         if view is not None:
-            percentage = round(
-                (execution_step / (len(self.get_configuration().modules) + 1)) * 100
-            )
             view.request.session["progress"] = percentage
             view.request.session["status"] = module_name
             view.request.session.save()
+        if self.on_progress is not None:
+            self.on_progress(percentage, module_name)
@@ -0,0 +1,151 @@
+"""
+Provide an in-process registry of the prompts stored in the database.
+
+All Prompt rows are loaded with a single query on first use and kept in memory, so that building the messages of an
+API call neither queries the database nor decodes the JSON text of the prompt. Callers receive a copy of the messages,
+since they append their own messages to them. The registry is cleared whenever a Prompt is saved or deleted in this
+process. Prompts changed by other processes, like extraction workers or the web server, send no signal here, so the
+prompts are also loaded again once they were kept for PROMPT_REGISTRY_TTL seconds.
+
+Every prompt has a version hash of its text, which other caches can store with their entries to discard them when the
+prompt changes.
+
+Functions:
+get_prompt -- Return a copy of the messages of a prompt.
+get_prompt_version -- Return a hash that changes when the text of the given prompts changes.
+clear_prompt_registry -- Clear the registry, so that the prompts are loaded again on the next use.
+
+Classes:
+PromptRegistry -- Thread-safe registry of the texts and version hashes of the prompts.
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from extraction.models import Prompt
+from tracex.logic.constants import PROMPT_REGISTRY_TTL
+
+
+def _copy(value: Any) -> Any:
+    """Copy the lists and dictionaries of a decoded JSON value, which is cheaper than copy.deepcopy."""
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+
+    return value
+
+
+def _get_entry(name: str, entries: Dict[str, Any], duplicates: Set[str]) -> Any:
+    """Return the entry of a prompt and raise the same errors as Prompt.objects.get for unknown or ambiguous names."""
+    if name not in entries:
+        raise Prompt.DoesNotExist(f"Prompt matching query does not exist: {name}")
+    if name in duplicates:
+        raise Prompt.MultipleObjectsReturned(f"get() returned more than one Prompt: {name}")
+
+    return entries[name]
+
+
+class PromptRegistry:
+    """
+    Thread-safe registry of the texts and version hashes of the prompts, loaded again after the time to live.
+
+    Public Methods:
+    get_prompt -- Return a copy of the messages of a prompt.
+    get_prompt_version -- Return a hash that changes when the text of the given prompts changes.
+    clear -- Clear the registry, so that the prompts are loaded again on the next use.
+    """
+
+    def __init__(self, ttl: float = PROMPT_REGISTRY_TTL):
+        self.ttl = ttl
+        self._entries: Optional[Tuple[Dict[str, Any], Dict[str, str], Set[str]]] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def get_prompt(self, name: str) -> Any:
+        """
+        Return a copy of the messages of a prompt, which the caller may modify.
+
+        Positional Arguments:
+        name -- Name of the prompt.
+        """
+        texts, _, duplicates = self.__load()
+
+        return _copy(_get_entry(name, texts, duplicates))
+
+    def get_prompt_version(self, *names: str) -> str:
+        """
+        Return a hash that changes when the text of one of the given prompts changes.
+
+        The version of a single prompt is the SHA-256 hash of its JSON text with sorted keys. The version of several
+        prompts, or of all prompts if no name is given, is the hash of their names and versions.
+
+        Positional Arguments:
+        names -- Names of the prompts.
+        """
+        _, versions, duplicates = self.__load()
+        if len(names) == 1:
+            return _get_entry(names[0], versions, duplicates)
+
+        names = sorted(set(names)) if names else sorted(versions)
+        combined = "\n".join(f"{name}:{_get_entry(name, versions, duplicates)}" for name in names)
+
+        return hashlib.sha256(combined.encode()).hexdigest()
+
+    def clear(self) -> None:
+        """Clear the registry, so that the prompts are loaded again on the next use."""
+        with self._lock:
+            self._entries = None
+
+    def __load(self) -> Tuple[Dict[str, Any], Dict[str, str], Set[str]]:
+        """Return the texts and version hashes of all prompts by name and the names shared by several prompts."""
+        with self._lock:
+            if self._entries is None or time.monotonic() - self._loaded_at >= self.ttl:
+                texts, duplicates = {}, set()
+                for name, text in Prompt.objects.values_list("name", "text"):
+                    if name in texts:
+                        duplicates.add(name)
+                    texts[name] = text
+                versions = {
+                    name: hashlib.sha256(json.dumps(text, sort_keys=True).encode()).hexdigest()
+                    for name, text in texts.items()
+                }
+                self._entries = (texts, versions, duplicates)
+                self._loaded_at = time.monotonic()
+
+            return self._entries
+
+
+prompt_registry = PromptRegistry()
+
+
+def get_prompt(name: str) -> Any:
+    """
+    Return a copy of the messages of a prompt, which the caller may modify.
+
+    Positional Arguments:
+    name -- Name of the prompt.
+    """
+    return prompt_registry.get_prompt(name)
+
+
+def get_prompt_version(*names: str) -> str:
+    """
+    Return a hash that changes when the text of one of the given prompts changes, see
+    PromptRegistry.get_prompt_version.
+
+    Positional Arguments:
+    names -- Names of the prompts.
+    """
+    return prompt_registry.get_prompt_version(*names)
+
+
+@receiver([post_save, post_delete], sender=Prompt)
+def clear_prompt_registry(**_kwargs) -> None:
+    """Clear the registry, so that the prompts are loaded again on the next use."""
+    prompt_registry.clear()
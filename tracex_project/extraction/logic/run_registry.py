@@ -0,0 +1,159 @@
+"""
+Provide a registry of the orchestrators of extraction runs, so that several users can extract at the same time.
+
+Every extraction run has its own orchestrator with its own configuration, data and cohort. The registry maps the run
+id to the orchestrator, and the run id of a user is stored in the session. Runs that are not executing are evicted
+once they were not accessed for the time to live, and the least recently used ones are evicted when there are more
+runs than the maximum. Executing runs are never evicted, and neither is the run being created or accessed for
+exceeding the maximum, so there are more runs than the maximum while all other runs are executing.
+
+Functions:
+start_run -- Create a run with a new orchestrator and store its run id in the session.
+get_run_or_404 -- Return the orchestrator of the run whose id is stored in the session, or raise Http404.
+restore_run -- Add the orchestrator of an evicted run to the registry again and store its run id in the session.
+end_run -- Remove the run whose id is stored in the session from the registry and remove its checkpoints.
+
+Classes:
+RunRegistry -- Thread-safe registry of the orchestrators of extraction runs, keyed by run id.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from django.http import Http404
+
+from extraction.logic.checkpoints import checkpoint_store
+from extraction.logic.orchestrator import ExtractionConfiguration, Orchestrator
+from tracex.logic.constants import RUN_REGISTRY_MAX_RUNS, RUN_REGISTRY_TTL
+
+RUN_ID_SESSION_KEY = "run_id"
+
+
+class RunRegistry:
+    """
+    Thread-safe registry of the orchestrators of extraction runs, keyed by run id.
+
+    Public Methods:
+    create -- Create an orchestrator for a new run and return the run id together with the orchestrator.
+    add -- Add the orchestrator of a run, e.g. one rebuilt after the run was evicted.
+    get -- Return the orchestrator of a run, or None if the run does not exist or was evicted.
+    remove -- Remove a run from the registry.
+    evict -- Remove runs that expired and the least recently used runs beyond the maximum number of runs.
+    """
+
+    def __init__(self, ttl: float = RUN_REGISTRY_TTL, max_runs: int = RUN_REGISTRY_MAX_RUNS):
+        self.ttl = ttl
+        self.max_runs = max_runs
+        self.runs: "OrderedDict[str, Tuple[Orchestrator, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.runs)
+
+    def create(self, configuration: Optional[ExtractionConfiguration] = None) -> Tuple[str, Orchestrator]:
+        """Create an orchestrator with the configuration for a new run and return the run id and the orchestrator."""
+        run_id = uuid.uuid4().hex
+        orchestrator = Orchestrator(configuration, run_id=run_id)
+        self.add(run_id, orchestrator)
+
+        return run_id, orchestrator
+
+    def add(self, run_id: str, orchestrator: Orchestrator) -> None:
+        """Add the orchestrator of a run, e.g. one rebuilt after the run was evicted, and mark the run as used."""
+        with self._lock:
+            self.runs.pop(run_id, None)
+            self.runs[run_id] = (orchestrator, time.monotonic())
+            self.__evict(keep_run_id=run_id)
+
+    def get(self, run_id: Optional[str]) -> Optional[Orchestrator]:
+        """Return the orchestrator of a run and mark the run as used, or None if it does not exist or was evicted."""
+        with self._lock:
+            self.__evict(keep_run_id=run_id)
+            if run_id not in self.runs:
+                return None
+            orchestrator, _ = self.runs.pop(run_id)
+            self.runs[run_id] = (orchestrator, time.monotonic())
+
+            return orchestrator
+
+    def remove(self, run_id: Optional[str]) -> None:
+        """Remove a run from the registry, if it exists."""
+        with self._lock:
+            self.runs.pop(run_id, None)
+
+    def evict(self) -> None:
+        """Remove runs that expired and the least recently used runs beyond the maximum number of runs."""
+        with self._lock:
+            self.__evict()
+
+    def __evict(self, keep_run_id: Optional[str] = None) -> None:
+        """
+        Evict runs that are not executing, starting with the least recently used. Must hold the lock.
+
+        Keyword Arguments:
+        keep_run_id -- Id of a run that is not evicted beyond the maximum number of runs, only once it expired.
+                       Default is None.
+        """
+        expiry = time.monotonic() - self.ttl
+        idle_run_ids = [run_id for run_id, (orchestrator, _) in self.runs.items() if not orchestrator.is_running]
+        surplus = len(self.runs) - self.max_runs
+        for run_id in idle_run_ids:
+            if self.runs[run_id][1] < expiry or (surplus > 0 and run_id != keep_run_id):
+                del self.runs[run_id]
+                surplus -= 1
+
+
+run_registry = RunRegistry()
+
+
+def start_run(session, configuration: ExtractionConfiguration) -> Orchestrator:
+    """
+    Create a run with a new orchestrator for the configuration and store its run id in the session. The previous run
+    of the session is removed from the registry.
+
+    Positional Arguments:
+    session -- Session of the user starting the run.
+    configuration -- Configuration of the new run.
+    """
+    end_run(session)
+    run_id, orchestrator = run_registry.create(configuration)
+    session[RUN_ID_SESSION_KEY] = run_id
+
+    return orchestrator
+
+
+def get_run_or_404(session) -> Orchestrator:
+    """Return the orchestrator of the run whose id is stored in the session, or raise Http404 if there is none."""
+    orchestrator = run_registry.get(session.get(RUN_ID_SESSION_KEY))
+    if orchestrator is None:
+        raise Http404("The extraction run does not exist or has expired. Please start the extraction again.")
+
+    return orchestrator
+
+
+def restore_run(session, orchestrator: Orchestrator) -> Orchestrator:
+    """
+    Add the orchestrator of an evicted run to the registry again and store its run id in the session.
+
+    Runs whose extraction job executes in a worker are not executing in the web process, so they can be evicted while
+    their job is running. Their orchestrator is rebuilt from the job, see
+    extraction.logic.extraction_jobs.build_job_orchestrator, and restored with this function.
+
+    Positional Arguments:
+    session -- Session of the user whose run is restored.
+    orchestrator -- Orchestrator of the run, with the run id of the evicted run.
+    """
+    run_registry.add(orchestrator.run_id, orchestrator)
+    session[RUN_ID_SESSION_KEY] = orchestrator.run_id
+
+    return orchestrator
+
+
+def end_run(session) -> None:
+    """Remove the run whose id is stored in the session from the registry and remove its checkpoints."""
+    run_id = session.pop(RUN_ID_SESSION_KEY, None)
+    run_registry.remove(run_id)
+    if run_id is not None:
+        checkpoint_store.remove(run_id)
@@ -0,0 +1,75 @@
+"""
+Management command to build the local fast-path classifier from the events stored in the database.
+
+Usage (from the tracex_project directory):
+python manage.py build_fast_path_classifier [--held-out 0.2] [--threshold 0.9] [--output path]
+"""
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from extraction.logic.fast_path_classifier import TARGETS, FastPathClassifier, get_model_path, split_rows
+from extraction.models import Event
+from tracex.logic.constants import EVENT_TYPES, FAST_PATH_CONFIDENCE, LOCATIONS
+
+
+class Command(BaseCommand):
+    """
+    Train the fast-path classifier for event types and locations from the stored events.
+
+    The classifier is first trained on a part of the events and evaluated on the held-out rest, whose activity labels
+    do not occur in the training part, which reports the precision of the confident predictions and the share of
+    requests to the model they save. The saved classifier is then trained on all events, and the report is stored in
+    its metadata. Events with only one event type or location cannot train a classifier and are rejected.
+    """
+
+    help = "Build the local classifier that predicts event types and locations before asking the model."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--held-out", type=float, default=0.2, help="Share of the events used for evaluation.")
+        parser.add_argument(
+            "--threshold", type=float, default=FAST_PATH_CONFIDENCE, help="Confidence threshold to evaluate."
+        )
+        parser.add_argument("--epochs", type=int, default=200, help="Number of training epochs.")
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the split and the initialization.")
+        parser.add_argument("--output", type=Path, default=None, help="Path of the classifier artifact.")
+
+    def handle(self, *args, **options):
+        valid_event_types = {key for key, _ in EVENT_TYPES} - {"N/A"}
+        valid_locations = {key for key, _ in LOCATIONS} - {"N/A"}
+        rows = [
+            (activity, event_type, location)
+            for activity, event_type, location in Event.manager.order_by("id").values_list(
+                "activity", "event_type", "location"
+            )
+            if event_type in valid_event_types and location in valid_locations
+        ]
+        if len(rows) < 2:
+            raise CommandError("At least two events with a valid event type and location are needed.")
+
+        training_rows, held_out_rows = split_rows(rows, options["held_out"], seed=options["seed"])
+        evaluation = {}
+        try:
+            if held_out_rows:
+                classifier = FastPathClassifier.fit(training_rows, epochs=options["epochs"], seed=options["seed"])
+                evaluation = {
+                    target: classifier.evaluate(held_out_rows, target, options["threshold"]) for target in TARGETS
+                }
+
+            classifier = FastPathClassifier.fit(rows, epochs=options["epochs"], seed=options["seed"])
+        except ValueError as error:
+            raise CommandError(f"The classifier cannot be trained: {error}") from error
+        classifier.metadata["evaluation"] = evaluation
+        output = options["output"] or get_model_path()
+        classifier.save(output)
+
+        self.stdout.write(f"Trained on {len(rows)} events, version {classifier.version}, saved to {output}")
+        for target, report in evaluation.items():
+            precision = "n/a" if report["precision"] is None else f"{report['precision']:.2%}"
+            self.stdout.write(
+                f"{target}: {report['saved_requests']} of {report['rows']} held-out requests saved "
+                f"({report['saved_share']:.2%}) with a precision of {precision} at confidence {report['threshold']}"
+            )
+        if options["verbosity"] > 1:
+            self.stdout.write(json.dumps(classifier.metadata, indent=2))
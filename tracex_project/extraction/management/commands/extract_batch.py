@@ -0,0 +1,119 @@
+"""
+Management command to extract the traces of many Patient Journeys, e.g. to build evaluation corpora.
+
+Usage (from the tracex_project directory):
+python manage.py extract_batch (--all | --names <name> ... | --ids <id> ...) [--modules <module> ...] [--processes 1]
+                               [--force]
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from extraction.logic.batch_extraction import (
+    get_batch_configuration,
+    get_extracted_patient_journey_ids,
+    run_batch,
+)
+from extraction.models import PatientJourney
+from tracex.logic.constants import MODULES_OPTIONAL, MODULES_REQUIRED
+
+
+class Command(BaseCommand):
+    """
+    Extract and save the traces of the selected Patient Journeys.
+
+    The required modules always run, the optional modules can be selected and default to all. Patient Journeys that
+    already have a trace extracted with the same modules, model and prompts are skipped, so that an interrupted batch
+    continues where it stopped. A summary of the throughput, the used tokens and the failures is printed at the end.
+    """
+
+    help = "Extract and save the traces of many Patient Journeys."
+
+    def add_arguments(self, parser):
+        selection = parser.add_mutually_exclusive_group(required=True)
+        selection.add_argument("--all", action="store_true", help="Extract all Patient Journeys.")
+        selection.add_argument("--names", nargs="+", help="Names of the Patient Journeys to extract.")
+        selection.add_argument("--ids", nargs="+", type=int, help="Ids of the Patient Journeys to extract.")
+        parser.add_argument(
+            "--modules",
+            nargs="*",
+            choices=[key for key, _ in MODULES_OPTIONAL],
+            default=[key for key, _ in MODULES_OPTIONAL],
+            help="Optional modules to run in addition to the required ones. Default is all.",
+        )
+        parser.add_argument(
+            "--processes", type=int, default=1, help="Number of Patient Journeys extracted at the same time."
+        )
+        parser.add_argument(
+            "--force", action="store_true", help="Also extract Patient Journeys already extracted with this setup."
+        )
+
+    def handle(self, *args, **options):
+        modules = [key for key, _ in MODULES_REQUIRED] + options["modules"]
+        if "metrics_analyzer" in modules and "time_extraction" not in modules:
+            raise CommandError("Metrics Analyzer depends on Time Extractor. Please select both or neither.")
+
+        patient_journeys = self.__select_patient_journeys(options)
+        fingerprint = get_batch_configuration(modules).get_fingerprint()
+        extracted_ids = set() if options["force"] else get_extracted_patient_journey_ids(fingerprint)
+        pending = {pk: name for pk, name in patient_journeys if pk not in extracted_ids}
+        self.stdout.write(
+            f"Extracting {len(pending)} of {len(patient_journeys)} Patient Journeys with {', '.join(modules)} "
+            f"({len(patient_journeys) - len(pending)} already extracted, fingerprint {fingerprint[:12]})."
+        )
+
+        started = time.perf_counter()
+        outcomes = []
+        for outcome in run_batch(list(pending), modules, processes=options["processes"]):
+            outcomes.append(outcome)
+            name = pending[outcome["patient_journey"]]
+            prefix = f"[{len(outcomes)}/{len(pending)}] {name}"
+            if outcome["error"] is None:
+                self.stdout.write(
+                    f"{prefix}: trace {outcome['trace']}, {outcome['used_tokens']} tokens, {outcome['seconds']:.1f}s"
+                )
+            else:
+                self.stderr.write(f"{prefix}: failed with {outcome['error'].strip().splitlines()[-1]}")
+                if options["verbosity"] > 1:
+                    self.stderr.write(outcome["error"])
+
+        self.__write_summary(outcomes, pending, time.perf_counter() - started)
+
+    @staticmethod
+    def __select_patient_journeys(options):
+        """Return the ids and names of the selected Patient Journeys, or raise an error for unknown ones."""
+        queryset = PatientJourney.manager.order_by("id")
+        if options["names"]:
+            queryset = queryset.filter(name__in=options["names"])
+            missing = set(options["names"]) - set(queryset.values_list("name", flat=True))
+        elif options["ids"]:
+            queryset = queryset.filter(pk__in=options["ids"])
+            missing = set(options["ids"]) - set(queryset.values_list("pk", flat=True))
+        else:
+            missing = set()
+        if missing:
+            raise CommandError(f"Unknown Patient Journeys: {', '.join(sorted(map(str, missing)))}")
+
+        return list(queryset.values_list("pk", "name"))
+
+    def __write_summary(self, outcomes, pending, seconds) -> None:
+        """Write the throughput, the used tokens and the failures of the batch."""
+        failures = [outcome for outcome in outcomes if outcome["error"] is not None]
+        used_tokens = sum(outcome["used_tokens"] for outcome in outcomes)
+        estimated_cost = sum(outcome["estimated_cost"] for outcome in outcomes)
+        throughput = len(outcomes) / seconds * 60 if seconds > 0 else 0.0
+
+        self.stdout.write(
+            f"Extracted {len(outcomes) - len(failures)} of {len(outcomes)} Patient Journeys in {seconds:.1f}s "
+            f"({throughput:.1f} per minute)."
+        )
+        self.stdout.write(
+            f"Used {used_tokens} tokens ({used_tokens / len(outcomes) if outcomes else 0:.0f} per Patient Journey), "
+            f"estimated cost ${estimated_cost:.4f}."
+        )
+        if failures:
+            self.stderr.write(
+                f"{len(failures)} failed: "
+                + ", ".join(f"{pending[outcome['patient_journey']]} (id {outcome['patient_journey']})"
+                            for outcome in failures)
+            )
@@ -0,0 +1,70 @@
+"""
+Management command to run extraction workers that execute the queued extraction jobs in the background.
+
+Several instances of the command can run at the same time, on the same host or on several hosts sharing the database.
+
+Usage (from the tracex_project directory):
+python manage.py run_extraction_workers [--concurrency 1] [--poll-interval 2] [--once]
+"""
+import os
+import socket
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from extraction.logic.extraction_jobs import run_worker
+from tracex.logic.constants import EXTRACTION_WORKER_POLL_INTERVAL
+
+
+class Command(BaseCommand):
+    """
+    Run extraction workers in threads of this process until the command is interrupted.
+
+    Every worker claims one job at a time, so the concurrency is the number of extraction runs this process executes
+    at the same time. With --once, the workers stop as soon as the queue is empty.
+    """
+
+    help = "Run workers that execute the extraction jobs enqueued by the web interface."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=1, help="Number of jobs executed at the same time.")
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=EXTRACTION_WORKER_POLL_INTERVAL,
+            help="Seconds to wait before looking for new jobs in an empty queue.",
+        )
+        parser.add_argument("--once", action="store_true", help="Stop as soon as the queue is empty.")
+
+    def handle(self, *args, **options):
+        stop_event = threading.Event()
+        executed_jobs = []
+
+        def work(index: int) -> None:
+            worker = f"{socket.gethostname()}:{os.getpid()}:{index}"
+            try:
+                executed_jobs.append(
+                    run_worker(worker, options["poll_interval"], once=options["once"], stop_event=stop_event)
+                )
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=work, args=(index,), daemon=True)
+            for index in range(max(1, options["concurrency"]))
+        ]
+        self.stdout.write(f"Starting {len(threads)} extraction worker(s).")
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping the extraction workers after their current jobs.")
+            stop_event.set()
+            for thread in threads:
+                thread.join()
+
+        self.stdout.write(f"Executed {sum(executed_jobs)} extraction job(s).")
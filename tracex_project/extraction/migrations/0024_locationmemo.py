@@ -0,0 +1,30 @@
+# Generated by Django 4.2.13 on 2026-10-18 10:12
+
+from django.db import migrations, models
+import django.db.models.manager
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('extraction', '0023_remove_cohort_gender_cohort_sex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationMemo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('activity', models.TextField()),
+                ('location', models.CharField(choices=[('Home', 'Home'), ('Hospital', 'Hospital'), ('Doctors', 'Doctors'), ('N/A', 'N/A')], max_length=25)),
+                ('prompt_version', models.CharField(max_length=64)),
+                ('last_modified', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('activity', 'prompt_version'), name='unique_location_memo')],
+            },
+            managers=[
+                ('manager', django.db.models.manager.Manager()),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.13 on 2026-10-18 22:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('extraction', '0025_extractionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trace',
+            name='config_fingerprint',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
@@ -25,6 +25,7 @@ class Trace(models.Model):
     patient_journey = models.ForeignKey(
         PatientJourney, on_delete=models.CASCADE, related_name="trace"
     )
+    config_fingerprint = models.CharField(max_length=64, null=True, blank=True, db_index=True)
     last_modified = models.DateTimeField(auto_now=True)
     manager = models.Manager()
 
@@ -98,3 +99,67 @@ class Metric(models.Model):
 
     def __str__(self):
         return f"Metric of {self.event.__str__().split('(')[0]} (id: {self.id})"  # pylint: disable=no-member
+
+
+class LocationMemo(models.Model):
+    """Django model representing the location extracted for an activity label, reused across extraction runs."""
+
+    activity = models.TextField()
+    location = models.CharField(max_length=25, choices=LOCATIONS)
+    prompt_version = models.CharField(max_length=64)
+    last_modified = models.DateTimeField(auto_now=True)
+    manager = models.Manager()
+
+    class Meta:
+        """Metadata of the location memo, which stores one location per activity label and prompt version."""
+
+        constraints = [
+            models.UniqueConstraint(fields=["activity", "prompt_version"], name="unique_location_memo")
+        ]
+
+    def __str__(self):
+        return f"{self.activity}: {self.location} (id: {self.id})"  # pylint: disable=no-member
+
+
+class ExtractionJob(models.Model):
+    """Django model representing an extraction run that is executed in the background by an extraction worker."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUSES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    configuration = models.JSONField()
+    patient_journey = models.ForeignKey(
+        PatientJourney, on_delete=models.CASCADE, related_name="extraction_jobs", null=True, blank=True
+    )
+    save_results = models.BooleanField(default=False)
+    progress = models.IntegerField(default=0)
+    status_message = models.CharField(max_length=200, null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    trace = models.ForeignKey(
+        Trace, on_delete=models.SET_NULL, related_name="extraction_jobs", null=True, blank=True
+    )
+    error = models.TextField(null=True, blank=True)
+    worker = models.CharField(max_length=200, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat = models.DateTimeField(null=True, blank=True)
+    last_modified = models.DateTimeField(auto_now=True)
+    manager = models.Manager()
+
+    class Meta:
+        """Metadata of the extraction job, indexed for claiming the oldest queued job."""
+
+        indexes = [models.Index(fields=["status", "created_at"], name="extraction_job_queue")]
+
+    def __str__(self):
+        return f"Extraction job {self.status} (id: {self.id})"  # pylint: disable=no-member
@@ -0,0 +1,98 @@
+"""Test cases for the batch extraction of Patient Journeys."""
+from io import StringIO
+from unittest import mock
+
+import pandas as pd
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from extraction.logic.batch_extraction import get_batch_configuration
+from extraction.logic.orchestrator import Orchestrator
+from extraction.models import PatientJourney, Trace
+
+
+def fake_run(orchestrator, view=None, on_progress=None):  # pylint: disable=unused-argument
+    """Stand in for Orchestrator.run by setting a complete result, or fail for a Patient Journey without text."""
+    if not orchestrator.get_configuration().patient_journey:
+        raise ValueError("The Patient Journey is empty.")
+    orchestrator.set_data(
+        pd.DataFrame(
+            {
+                "case:concept:name": [1],
+                "activity": ["visiting the doctor"],
+                "event_type": ["Doctor Visit"],
+                "time:timestamp": pd.to_datetime(["2023-01-01 10:00"]),
+                "time:end_timestamp": pd.to_datetime(["2023-01-01 11:00"]),
+                "time:duration": ["01:00:00"],
+                "attribute_location": ["Doctors"],
+                "activity_relevance": [None],
+                "timestamp_correctness": [None],
+                "correctness_confidence": [None],
+            }
+        )
+    )
+    orchestrator.set_cohort({"age": 30, "sex": "female"})
+
+
+@mock.patch.object(Orchestrator, "run", autospec=True, side_effect=fake_run)
+class ExtractBatchCommandTests(TestCase):
+    """Test cases for the management command extract_batch."""
+
+    fixtures = ["tracex_project/extraction/fixtures/prompts_fixture.json"]
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """Set up Patient Journeys, one of which fails to extract."""
+        self.journeys = [
+            PatientJourney.manager.create(name=f"Journey {index}", patient_journey=f"I visited the doctor {index}.")
+            for index in range(3)
+        ]
+        self.empty_journey = PatientJourney.manager.create(name="Empty Journey", patient_journey="")
+
+    def call_extract_batch(self, *args):
+        """Call the command and return what it wrote to stdout and stderr."""
+        stdout, stderr = StringIO(), StringIO()
+        call_command("extract_batch", *args, stdout=stdout, stderr=stderr)
+
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_traces_are_saved_with_fingerprint_and_failures_reported(self, _run):
+        """Test if the selected Patient Journeys are extracted, saved with the fingerprint, and failures summarized."""
+        stdout, stderr = self.call_extract_batch("--all", "--modules", "time_extraction")
+        fingerprint = get_batch_configuration(
+            ["activity_labeling", "cohort_tagging", "time_extraction"]
+        ).get_fingerprint()
+
+        self.assertEqual(
+            set(Trace.manager.filter(config_fingerprint=fingerprint).values_list("patient_journey", flat=True)),
+            {journey.id for journey in self.journeys},
+        )
+        self.assertEqual(
+            Trace.manager.get(patient_journey=self.journeys[0]).events.get().activity, "visiting the doctor"
+        )
+        self.assertIn("Extracted 3 of 4 Patient Journeys", stdout)
+        self.assertIn("ValueError: The Patient Journey is empty.", stderr)
+        self.assertIn(f"1 failed: Empty Journey (id {self.empty_journey.id})", stderr)
+
+    def test_extracted_patient_journeys_are_skipped_for_same_configuration(self, run):
+        """Test if a restarted batch only extracts Patient Journeys without a trace for the same configuration."""
+        self.call_extract_batch("--ids", str(self.journeys[0].id), str(self.journeys[1].id))
+        run.reset_mock()
+
+        stdout, _ = self.call_extract_batch("--names", "Journey 0", "Journey 1", "Journey 2")
+        self.assertEqual(run.call_count, 1)
+        self.assertIn("Extracting 1 of 3 Patient Journeys", stdout)
+
+        self.call_extract_batch("--names", "Journey 0", "--modules", "time_extraction")
+        self.call_extract_batch("--names", "Journey 0", "--force")
+        self.assertEqual(run.call_count, 3)
+        self.assertEqual(Trace.manager.filter(patient_journey=self.journeys[0]).count(), 3)
+
+    def test_unknown_patient_journeys_and_invalid_modules_are_rejected(self, run):
+        """Test if unknown names and a Metrics Analyzer without Time Extractor raise an error before extracting."""
+        with self.assertRaisesMessage(CommandError, "Unknown Patient Journeys: Journey 9"):
+            self.call_extract_batch("--names", "Journey 0", "Journey 9")
+        with self.assertRaisesMessage(CommandError, "Metrics Analyzer depends on Time Extractor"):
+            self.call_extract_batch("--all", "--modules", "metrics_analyzer")
+
+        run.assert_not_called()
@@ -0,0 +1,185 @@
+"""Test cases for the checkpoints of extraction runs."""
+import os
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+from django.test import TestCase
+
+from extraction.logic.checkpoints import CheckpointStore
+from extraction.logic.module import Module
+from extraction.logic.modules import CohortTagger
+from extraction.logic.orchestrator import ExtractionConfiguration, Orchestrator
+
+executed_modules = []
+
+
+class RecordingModule(Module):
+    """Module that records its execution and writes fixed values to its columns."""
+
+    fail = False
+
+    def __init__(self):
+        super().__init__()
+        self.name = type(self).__name__
+
+    def execute(self, df=None, **_kwargs):
+        """Record the execution, fail if requested, and write the columns."""
+        executed_modules.append(self.name)
+        if self.fail:
+            raise RuntimeError(f"{self.name} failed.")
+        for column in self.writes:
+            df[column] = f"{column} value"
+
+        return df
+
+
+class PreprocessingModule(RecordingModule):
+    """Module that preprocesses the Patient Journey."""
+
+    def execute(self, df=None, patient_journey=None, **_kwargs):
+        """Record the execution and return the preprocessed Patient Journey."""
+        super().execute(df)
+
+        return patient_journey.upper()
+
+
+class LabelingModule(RecordingModule):
+    """Module that creates the activities."""
+
+    writes = ("activity", "sentence_id")
+
+    def execute(self, df=None, patient_journey=None, **_kwargs):
+        """Record the execution and return an activity per sentence of the preprocessed Patient Journey."""
+        executed_modules.append(self.name)
+        sentences = patient_journey.split(". ")
+
+        return pd.DataFrame({"activity": sentences, "sentence_id": [str(index) for index in range(len(sentences))]})
+
+
+class TimeModule(RecordingModule):
+    """Module that writes the timestamps of the activities."""
+
+    reads = ("activity", "sentence_id")
+    writes = ("time:timestamp",)
+
+
+class MetricsModule(RecordingModule):
+    """Module that analyzes the timestamps of the activities."""
+
+    reads = ("activity", "time:timestamp")
+    writes = ("activity_relevance",)
+
+
+class CheckpointStoreTests(TestCase):
+    """Test cases for the CheckpointStore."""
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """Set up a store in a temporary directory."""
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.directory.cleanup)
+        self.store = CheckpointStore(Path(self.directory.name), retention=60)
+
+    def test_checkpoints_are_saved_and_loaded(self):
+        """Test if checkpoints keep their DataFrames with dtypes, and are removed with their run."""
+        data = pd.DataFrame({"activity": ["visiting the doctor"], "time:timestamp": pd.to_datetime(["2023-01-01"])})
+        self.store.save("run", "time_extraction", {"output": data})
+
+        pd.testing.assert_frame_equal(self.store.load("run", "time_extraction")["output"], data)
+        self.assertIsNone(self.store.load("run", "metrics_analyzer"))
+
+        self.store.remove("run")
+        self.assertIsNone(self.store.load("run", "time_extraction"))
+        with self.assertRaises(ValueError):
+            self.store.load("../run", "time_extraction")
+
+    def test_garbage_collection_removes_expired_runs(self):
+        """Test if runs whose checkpoints were not written for the retention period are removed."""
+        self.store.save("old_run", "cohort_tagging", {"output": None})
+        self.store.save("new_run", "cohort_tagging", {"output": None})
+        expired = time.time() - 61
+        os.utime(Path(self.directory.name) / "old_run", (expired, expired))
+
+        self.assertEqual(self.store.collect_garbage(), 1)
+        self.assertIsNone(self.store.load("old_run", "cohort_tagging"))
+        self.assertIsNotNone(self.store.load("new_run", "cohort_tagging"))
+
+
+class OrchestratorCheckpointTests(TestCase):
+    """Test cases for resuming runs of the Orchestrator from their checkpoints."""
+
+    fixtures = ["tracex_project/extraction/fixtures/prompts_fixture.json"]
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """Set up a checkpoint store in a temporary directory and modules that record their execution."""
+        directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(directory.cleanup)
+        patches = [
+            mock.patch("extraction.logic.orchestrator.checkpoint_store", CheckpointStore(Path(directory.name))),
+            mock.patch("extraction.logic.orchestrator.log_token_report"),
+            mock.patch.object(CohortTagger, "execute_and_save", side_effect=self.tag_cohort),
+            mock.patch.object(Orchestrator, "set_default_values"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        executed_modules.clear()
+
+    @staticmethod
+    def tag_cohort(*_args, **_kwargs):
+        """Record the execution of the Cohort Tagger and return a cohort."""
+        executed_modules.append("CohortTagger")
+
+        return {"age": 30}
+
+    @staticmethod
+    def create_orchestrator(patient_journey: str, metrics_fail: bool = False) -> Orchestrator:
+        """Return an orchestrator of the same run with the recording modules."""
+        configuration = ExtractionConfiguration(patient_journey=patient_journey, stream_activities=False)
+        configuration.update(
+            modules={
+                "preprocessing": PreprocessingModule,
+                "cohort_tagging": CohortTagger,
+                "activity_labeling": LabelingModule,
+                "time_extraction": TimeModule,
+                "metrics_analyzer": type("MetricsModule", (MetricsModule,), {"fail": metrics_fail}),
+            }
+        )
+
+        return Orchestrator(configuration, run_id="run")
+
+    def test_failed_run_resumes_after_last_completed_module(self):
+        """Test if a run that failed in the Metrics Analyzer only runs the Metrics Analyzer again."""
+        with self.assertRaises(RuntimeError):
+            self.create_orchestrator("i visited the doctor. i took medication", metrics_fail=True).run()
+        executed_modules.clear()
+
+        orchestrator = self.create_orchestrator("i visited the doctor. i took medication")
+        orchestrator.run()
+
+        self.assertEqual(executed_modules, ["MetricsModule"])
+        self.assertEqual(orchestrator.get_cohort(), {"age": 30})
+        self.assertEqual(
+            orchestrator.get_data().to_dict("list"),
+            {
+                "case:concept:name": [1, 1],
+                "activity": ["I VISITED THE DOCTOR", "I TOOK MEDICATION"],
+                "time:timestamp": ["time:timestamp value"] * 2,
+                "activity_relevance": ["activity_relevance value"] * 2,
+            },
+        )
+
+    def test_checkpoints_of_another_patient_journey_are_not_restored(self):
+        """Test if changing the Patient Journey of a run runs all modules again."""
+        self.create_orchestrator("i visited the doctor").run()
+        executed_modules.clear()
+
+        orchestrator = self.create_orchestrator("i took medication")
+        orchestrator.run()
+
+        self.assertEqual(
+            executed_modules, ["PreprocessingModule", "CohortTagger", "LabelingModule", "TimeModule", "MetricsModule"]
+        )
+        self.assertEqual(orchestrator.get_data()["activity"].tolist(), ["I TOOK MEDICATION"])
@@ -0,0 +1,199 @@
+"""Test cases for the extraction jobs executed by the extraction workers."""
+import time
+from datetime import timedelta
+from unittest import mock
+
+import pandas as pd
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from extraction.logic.extraction_jobs import (
+    apply_job_result,
+    claim_job,
+    enqueue_job,
+    execute_job,
+    run_worker,
+)
+from extraction.logic.orchestrator import ExtractionConfiguration, Orchestrator
+from extraction.logic.run_registry import RUN_ID_SESSION_KEY, run_registry
+from extraction.models import ExtractionJob, PatientJourney
+
+
+def fake_run(orchestrator, view=None, on_progress=None):  # pylint: disable=unused-argument
+    """Stand in for Orchestrator.run by reporting progress and setting a result."""
+    on_progress(50, "Activity Labeler")
+    orchestrator.set_data(
+        pd.DataFrame(
+            {
+                "case:concept:name": [1, 1],
+                "activity": ["visiting the doctor", "taking ibuprofen"],
+                "time:timestamp": pd.to_datetime(["2023-01-01 10:00", "2023-01-02 08:00"]),
+            }
+        )
+    )
+    orchestrator.set_cohort({"age": 30, "gender": "female"})
+
+
+class ExtractionJobTests(TestCase):
+    """Test cases for enqueuing, claiming and executing extraction jobs."""
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """Set up a Patient Journey and an orchestrator configured to extract from it."""
+        self.journey = PatientJourney.manager.create(name="Test Journey", patient_journey="I visited the doctor.")
+        self.orchestrator = Orchestrator(
+            ExtractionConfiguration(patient_journey=self.journey.patient_journey, activity_key="activity")
+        )
+        self.orchestrator.reduce_modules_to(["activity_labeling", "time_extraction"])
+        self.orchestrator.set_db_objects_id("patient_journey", self.journey.id)
+
+    def test_job_is_claimed_by_one_worker(self):
+        """Test if an enqueued job is claimed once and a second worker finds nothing to claim."""
+        job = enqueue_job(self.orchestrator)
+
+        claimed_job = claim_job("worker-1")
+
+        self.assertEqual(claimed_job.pk, job.pk)
+        self.assertEqual(claimed_job.status, ExtractionJob.RUNNING)
+        self.assertEqual(claimed_job.worker, "worker-1")
+        self.assertEqual(claimed_job.configuration["modules"], ["activity_labeling", "time_extraction"])
+        self.assertIsNone(claim_job("worker-2"))
+
+    def test_stale_job_is_claimed_again(self):
+        """Test if a running job whose worker sent no heartbeat for too long is claimed by another worker."""
+        enqueue_job(self.orchestrator)
+        job = claim_job("worker-1")
+        ExtractionJob.manager.filter(pk=job.pk).update(heartbeat=timezone.now() - timedelta(days=1))
+
+        reclaimed_job = claim_job("worker-2")
+
+        self.assertEqual(reclaimed_job.pk, job.pk)
+        self.assertEqual(reclaimed_job.worker, "worker-2")
+
+    def test_job_without_progress_is_not_claimed_while_heartbeat_is_alive(self):
+        """Test if a long module without progress keeps its job as long as the worker sends heartbeats."""
+        enqueue_job(self.orchestrator)
+        job = claim_job("worker-1")
+        ExtractionJob.manager.filter(pk=job.pk).update(last_modified=timezone.now() - timedelta(days=1))
+
+        self.assertIsNone(claim_job("worker-2"))
+
+    def test_executed_job_result_is_applied_to_orchestrator(self):
+        """Test if the progress and the result of a job are stored and set in the orchestrator of the run."""
+        progress = []
+        enqueue_job(self.orchestrator)
+        job = claim_job("worker-1")
+
+        def record_progress(orchestrator, view=None, on_progress=None):
+            def on_progress_recorded(percentage, module_name):
+                on_progress(percentage, module_name)
+                progress.append(ExtractionJob.manager.values_list("progress", "status_message").get(pk=job.pk))
+
+            fake_run(orchestrator, view, on_progress_recorded)
+
+        with mock.patch.object(Orchestrator, "run", autospec=True, side_effect=record_progress):
+            execute_job(job)
+        job.refresh_from_db()
+        apply_job_result(self.orchestrator, job)
+
+        self.assertEqual(progress, [(50, "Activity Labeler")])
+        self.assertEqual(job.status, ExtractionJob.SUCCEEDED)
+        self.assertEqual(job.progress, 100)
+        self.assertIsNone(job.trace)
+        self.assertEqual(self.orchestrator.get_data()["activity"].tolist(), ["visiting the doctor", "taking ibuprofen"])
+        self.assertEqual(self.orchestrator.get_data()["time:timestamp"].iloc[1], pd.Timestamp("2023-01-02 08:00"))
+        self.assertEqual(self.orchestrator.get_cohort(), {"age": 30, "gender": "female"})
+
+    def test_failed_job_stores_traceback(self):
+        """Test if the traceback of a failing run is stored in the job."""
+        enqueue_job(self.orchestrator)
+
+        with mock.patch.object(Orchestrator, "run", side_effect=ValueError("No activities found.")):
+            executed_jobs = run_worker("worker-1", once=True)
+        job = ExtractionJob.manager.get()
+
+        self.assertEqual(executed_jobs, 1)
+        self.assertEqual(job.status, ExtractionJob.FAILED)
+        self.assertIn("ValueError: No activities found.", job.error)
+
+    @mock.patch("extraction.views.EXTRACTION_JOBS_ENABLED", True)
+    def test_filter_view_enqueues_job_and_reports_redirect(self):
+        """Test if starting an extraction enqueues a job, and the progress request redirects once it succeeded."""
+        self.client.get(reverse("journey_details", kwargs={"pk": self.journey.id}))
+        self.client.post(reverse("journey_details", kwargs={"pk": self.journey.id}))
+
+        response = self.client.post(
+            reverse("journey_filter"),
+            {
+                "modules_required": ["activity_labeling", "cohort_tagging"],
+                "modules_optional": ["time_extraction"],
+                "event_types": ["Symptom Onset", "Symptom Offset"],
+                "locations": ["Home"],
+                "activity_key": "activity",
+            },
+        )
+        job = ExtractionJob.manager.get()
+
+        self.assertRedirects(response, reverse("journey_filter"))
+        self.assertEqual(job.status, ExtractionJob.QUEUED)
+        self.assertEqual(job.patient_journey, self.journey)
+        self.assertTrue(self.client.get(reverse("journey_filter")).context["job_running"])
+
+        with mock.patch.object(Orchestrator, "run", autospec=True, side_effect=fake_run):
+            run_worker("worker-1", once=True)
+        response = self.client.get(reverse("journey_filter"), HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+        orchestrator = run_registry.get(self.client.session[RUN_ID_SESSION_KEY])
+
+        self.assertEqual(response.json(), {"progress": 100, "status": None, "redirect": reverse("result")})
+        self.assertEqual(orchestrator.get_cohort(), {"age": 30, "gender": "female"})
+
+    @mock.patch("extraction.views.EXTRACTION_JOBS_ENABLED", True)
+    def test_run_evicted_while_job_runs_is_rebuilt(self):
+        """Test if the result of a job is applied to a rebuilt run if the run was evicted while the job ran."""
+        self.client.get(reverse("journey_details", kwargs={"pk": self.journey.id}))
+        self.client.post(reverse("journey_details", kwargs={"pk": self.journey.id}))
+        self.client.post(
+            reverse("journey_filter"),
+            {
+                "modules_required": ["activity_labeling", "cohort_tagging"],
+                "modules_optional": ["time_extraction"],
+                "event_types": ["Symptom Onset", "Symptom Offset"],
+                "locations": ["Home"],
+                "activity_key": "activity",
+            },
+        )
+        run_id = self.client.session[RUN_ID_SESSION_KEY]
+        run_registry.remove(run_id)
+
+        with mock.patch.object(Orchestrator, "run", autospec=True, side_effect=fake_run):
+            run_worker("worker-1", once=True)
+        response = self.client.get(reverse("journey_filter"), HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+        orchestrator = run_registry.get(run_id)
+
+        self.assertEqual(response.json()["redirect"], reverse("result"))
+        self.assertNotIn("extraction_job_id", self.client.session)
+        self.assertEqual(self.client.session[RUN_ID_SESSION_KEY], run_id)
+        self.assertEqual(orchestrator.get_cohort(), {"age": 30, "gender": "female"})
+        self.assertIn("time_extraction", orchestrator.get_configuration().modules)
+
+
+class ExtractionJobHeartbeatTests(TransactionTestCase):
+    """Test cases for the heartbeat of running extraction jobs, which is written by another thread."""
+
+    @mock.patch("extraction.logic.extraction_jobs.EXTRACTION_JOB_HEARTBEAT_INTERVAL", 0.01)
+    def test_heartbeat_is_refreshed_while_job_runs_without_progress(self):
+        """Test if the heartbeat of a job is refreshed by its worker while a module runs without progress."""
+        orchestrator = Orchestrator(ExtractionConfiguration(patient_journey="I visited the doctor."))
+        enqueue_job(orchestrator)
+        job = claim_job("worker-1")
+
+        def wait_for_heartbeat(*_args, **_kwargs):
+            deadline = time.monotonic() + 5
+            while ExtractionJob.manager.get(pk=job.pk).heartbeat <= job.heartbeat:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+
+        with mock.patch.object(Orchestrator, "run", side_effect=wait_for_heartbeat):
+            execute_job(job)
+
+        self.assertEqual(ExtractionJob.manager.get(pk=job.pk).status, ExtractionJob.SUCCEEDED)
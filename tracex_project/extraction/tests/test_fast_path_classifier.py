@@ -0,0 +1,148 @@
+"""Test cases for the local fast-path classifier of event types and locations."""
+import tempfile
+from datetime import datetime, timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+from django.core.management import call_command
+from django.test import TestCase
+
+from extraction.logic.fast_path_classifier import FastPathClassifier, predict_confident, split_rows
+from extraction.logic.modules import EventTypeClassifier, LocationExtractor
+from extraction.models import Event, LocationMemo, PatientJourney, Trace
+
+ROWS = [
+    ("taking paracetamol", "Medication", "Home"),
+    ("taking ibuprofen", "Medication", "Home"),
+    ("taking antibiotics", "Medication", "Home"),
+    ("visiting the doctor", "Doctor Visit", "Doctors"),
+    ("visiting the general practitioner", "Doctor Visit", "Doctors"),
+    ("visiting a doctor again", "Doctor Visit", "Doctors"),
+    ("being admitted to the hospital", "Hospital Admission", "Hospital"),
+    ("getting admitted to the hospital", "Hospital Admission", "Hospital"),
+]
+
+
+class FastPathClassifierTests(TestCase):
+    """Test cases for the FastPathClassifier."""
+
+    def test_fit_predict_and_reload(self):
+        """Test if the classifier learns the training rows and predicts the same after saving and loading."""
+        classifier = FastPathClassifier.fit(ROWS)
+        labels = ["taking aspirin", "visiting the doctor", "admitted to the hospital"]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "classifier.npz"
+            classifier.save(path)
+            loaded_classifier = FastPathClassifier.load(path)
+
+        self.assertEqual(
+            [prediction for prediction, _ in classifier.predict(labels, "event_type")],
+            ["Medication", "Doctor Visit", "Hospital Admission"],
+        )
+        self.assertEqual(
+            [prediction for prediction, _ in classifier.predict(labels, "location")], ["Home", "Doctors", "Hospital"]
+        )
+        self.assertEqual(loaded_classifier.predict(labels, "location"), classifier.predict(labels, "location"))
+        self.assertEqual(loaded_classifier.version, classifier.version)
+
+    def test_labels_without_known_terms_have_no_confidence(self):
+        """Test if labels without any word of the vocabulary get no confidence instead of the prior of the classes."""
+        classifier = FastPathClassifier.fit(ROWS)
+
+        (prediction,) = classifier.predict(["xyz"], "location")
+        self.assertEqual(prediction[1], 0.0)
+        self.assertGreater(classifier.predict(["taking xyz"], "location")[0][1], 0.0)
+        with mock.patch("extraction.logic.fast_path_classifier.get_fast_path_classifier", return_value=classifier):
+            self.assertEqual(predict_confident(["xyz", "taking paracetamol"], "location", 0.0), [None, "Home"])
+
+    def test_version_depends_on_training_data(self):
+        """Test if the version of the classifier changes with the training data."""
+        self.assertEqual(FastPathClassifier.fit(ROWS).version, FastPathClassifier.fit(ROWS).version)
+        self.assertNotEqual(FastPathClassifier.fit(ROWS).version, FastPathClassifier.fit(ROWS[1:]).version)
+
+    def test_evaluate(self):
+        """Test if only confident predictions count as saved requests."""
+        classifier = FastPathClassifier.fit(ROWS)
+
+        self.assertEqual(classifier.evaluate(ROWS, "location", threshold=0.0)["saved_requests"], len(ROWS))
+        self.assertEqual(classifier.evaluate(ROWS, "location", threshold=0.0)["precision"], 1.0)
+        self.assertEqual(classifier.evaluate(ROWS, "location", threshold=1.0)["saved_requests"], 0)
+
+    def test_fit_rejects_single_class(self):
+        """Test if training rows with only one value of a target are rejected."""
+        with self.assertRaisesMessage(ValueError, "1 location values"):
+            FastPathClassifier.fit([(activity, event_type, "Home") for activity, event_type, _ in ROWS])
+
+    def test_split_keeps_activity_labels_apart(self):
+        """Test if rows with the same activity label end up in the same part of the split."""
+        rows = ROWS * 2 + [("Taking Paracetamol", "Medication", "Home")]
+
+        training_rows, held_out_rows = split_rows(rows, held_out_share=0.25)
+
+        self.assertEqual(len(training_rows) + len(held_out_rows), len(rows))
+        self.assertGreaterEqual(len(held_out_rows), 4)
+        self.assertFalse({row[0].lower() for row in training_rows} & {row[0].lower() for row in held_out_rows})
+
+    def test_build_command(self):
+        """Test if the management command trains the classifier from the stored events and reports its evaluation."""
+        trace = Trace.manager.create(patient_journey=PatientJourney.manager.create(name="test", patient_journey="-"))
+        start = datetime(2020, 1, 1)
+        for activity, event_type, location in ROWS * 2:
+            Event.manager.create(
+                trace=trace,
+                activity=activity,
+                event_type=event_type,
+                location=location,
+                start=start,
+                end=start,
+                duration=timedelta(0),
+            )
+        output = StringIO()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "classifier.npz"
+            call_command("build_fast_path_classifier", output=path, held_out=0.25, stdout=output)
+            classifier = FastPathClassifier.load(path)
+
+        self.assertIn(f"Trained on {len(ROWS) * 2} events", output.getvalue())
+        self.assertEqual(set(classifier.metadata["evaluation"]), {"event_type", "location"})
+        self.assertEqual(classifier.metadata["evaluation"]["location"]["rows"], 4)
+
+
+class FastPathModuleTests(TestCase):
+    """Test cases for the use of the fast-path classifier in the modules."""
+
+    fixtures = ["tracex_project/extraction/fixtures/prompts_fixture.json"]
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """Set up method that gets called everytime before tests are executed."""
+        patcher = mock.patch(
+            "extraction.logic.fast_path_classifier.get_fast_path_classifier",
+            return_value=FastPathClassifier.fit(ROWS),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_event_type_classifier_asks_model_only_below_threshold(self):
+        """Test if only activities the classifier is not confident about are sent to the model."""
+        input_dataframe = pd.DataFrame({"activity": ["taking paracetamol", "feeling anxious"]})
+
+        with mock.patch("tracex.logic.utils.gather_gpt", return_value=["Feelings"]) as gather_gpt:
+            result = EventTypeClassifier(batch_size=1, fast_path_confidence=0.6).execute(input_dataframe)
+
+        self.assertEqual([messages[-1]["content"] for messages in gather_gpt.call_args.args[0]], ["feeling anxious"])
+        self.assertEqual(list(result["event_type"]), ["Medication", "Feelings"])
+
+    def test_location_extractor_does_not_save_predictions(self):
+        """Test if predicted locations are used, but not saved to the memo table for later runs."""
+        input_dataframe = pd.DataFrame({"activity": ["taking paracetamol", "feeling anxious"]})
+
+        with mock.patch("tracex.logic.utils.gather_gpt", return_value=["Home"]) as gather_gpt:
+            result = LocationExtractor(use_database_memo=True, fast_path_confidence=0.6).execute(input_dataframe)
+
+        self.assertEqual([messages[-1]["content"] for messages in gather_gpt.call_args.args[0]], ["feeling anxious"])
+        self.assertEqual(list(result["attribute_location"]), ["Home", "Home"])
+        self.assertEqual(list(LocationMemo.manager.values_list("activity", flat=True)), ["feeling anxious"])
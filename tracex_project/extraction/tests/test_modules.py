@@ -1,13 +1,27 @@
 """Test cases for the modules in the extraction app."""
+import asyncio
+import json
+import re
+import threading
+from datetime import datetime, timedelta
+from unittest import mock
+
 from django.test import TestCase
 import pandas as pd
 
+from extraction.models import LocationMemo, Prompt
 from extraction.logic.modules import (
     ActivityLabeler,
+    CohortTagger,
     TimeExtractor,
     EventTypeClassifier,
     LocationExtractor,
+    MetricsAnalyzer,
+    Preprocessor,
 )
+from extraction.logic.modules.module_patient_journey_preprocessor import DATE_PATTERN
+from extraction.logic.prompt_registry import get_prompt
+from tracex.logic.constants import EVENT_TYPES
 
 
 class ActivityLabelerTests(TestCase):
@@ -25,6 +39,139 @@ class ActivityLabelerTests(TestCase):
         self.assertIn("activity", result.columns)
         self.assertIn("sentence_id", result.columns)
 
+    def test_windows_are_labeled_in_parallel_and_merged(self):
+        """Test if long Patient Journeys are labeled in overlapping windows and duplicates in overlaps are merged."""
+        test_data = [f"Sentence {index}." for index in range(10)]
+        responses = [
+            "falling ill #0\ntaking medication #3",
+            "Taking medication #3\nvisiting doctor #3\nvisiting doctor again #5\ngetting tested #6",
+            "getting tested #6\nrecovering #9",
+        ]
+
+        with mock.patch("tracex.logic.utils.gather_gpt", return_value=responses) as gather_gpt:
+            result = ActivityLabeler(window_size=4, window_overlap=1).execute(patient_journey_sentences=test_data)
+
+        windows = [messages[-1]["content"] for messages in gather_gpt.call_args.args[0]]
+        self.assertEqual(len(windows), 3)
+        self.assertTrue(windows[1].startswith("3: Sentence 3.\n4: Sentence 4."))
+        self.assertTrue(windows[2].endswith("9: Sentence 9."))
+        self.assertEqual(
+            list(result["activity"]),
+            [
+                "falling ill",
+                "taking medication",
+                "visiting doctor",
+                "visiting doctor again",
+                "getting tested",
+                "recovering",
+            ],
+        )
+        self.assertEqual(list(result["sentence_id"]), ["0", "3", "3", "5", "6", "9"])
+
+
+class CohortTaggerTests(TestCase):
+    """Test cases for the CohortTagger."""
+
+    fixtures = ["tracex_project/extraction/fixtures/prompts_fixture.json"]
+
+    def test_structured_tags_fall_back_per_tag(self):
+        """Test if all tags are extracted with one request and malformed or missing tags are extracted on their own."""
+        response = json.dumps({"condition": "Covid-19", "gender": "female", "age": "in her twenties", "origin": None})
+
+        with mock.patch("tracex.logic.utils.query_gpt", return_value=response) as query_gpt, \
+                mock.patch("tracex.logic.utils.gather_gpt", return_value=["25", "Asthma"]) as gather_gpt, \
+                mock.patch("tracex.logic.utils.get_snomed_ct_info", side_effect=lambda term: (term, 1)):
+            cohort = CohortTagger(structured=True).execute_and_save(patient_journey="I got Covid-19.")
+
+        self.assertEqual(query_gpt.call_count, 1)
+        self.assertEqual(
+            [messages[0]["content"] for messages in gather_gpt.call_args.args[0]],
+            [
+                message_list[1]["content"]
+                for message_list in Prompt.objects.get(name="COHORT_TAG_MESSAGES").text
+                if message_list[0] in ("age", "preexisting_condition")
+            ],
+        )
+        self.assertEqual(
+            cohort,
+            {
+                "condition": "Covid-19",
+                "condition_snomed_code": 1,
+                "gender": "female",
+                "age": "25",
+                "preexisting_condition": "Asthma",
+                "preexisting_condition_snomed_code": 1,
+            },
+        )
+
+    def test_unstructured_tags_are_extracted_concurrently(self):
+        """Test if all tags are extracted with concurrent single-tag requests if structured mode is off."""
+        with mock.patch("tracex.logic.utils.query_gpt") as query_gpt, \
+                mock.patch("tracex.logic.utils.gather_gpt", return_value=["N/A"] * 4 + ["Asthma"]) as gather_gpt, \
+                mock.patch("tracex.logic.utils.get_snomed_ct_info", side_effect=lambda term: (term, 1)):
+            cohort = CohortTagger(structured=False).execute_and_save(patient_journey="I got Covid-19.")
+
+        query_gpt.assert_not_called()
+        self.assertEqual(len(gather_gpt.call_args.args[0]), 5)
+        self.assertEqual(cohort, {"preexisting_condition": "Asthma", "preexisting_condition_snomed_code": 1})
+
+
+class PreprocessorTests(TestCase):
+    """Test cases for the Preprocessor."""
+
+    fixtures = ["tracex_project/extraction/fixtures/prompts_fixture.json"]
+
+    def test_chunks_are_preprocessed_with_chained_dates(self):
+        """Test if long Patient Journeys are preprocessed in chunks that resolve dates relative to earlier chunks."""
+        patient_journey = (
+            "I fell ill on 2020/03/01. I stayed at home. 2 days later I went to the doctor. I got medication. "
+            "3 days later I recovered."
+        )
+        messages_lists = []
+
+        def gather_gpt(messages_list):
+            messages_lists.append(messages_list)
+            return [messages[-1]["content"] for messages in messages_list]
+
+        def resolve_relative_dates(messages):
+            """Replace 'N days later' by the date N days after the latest date in the earlier text or the chunk."""
+            text = messages[-1]["content"]
+            earlier_text = messages[-2]["content"] if "Earlier text" in messages[-2]["content"] else ""
+            match = re.search(r"(\d+) days later", text)
+            dates = DATE_PATTERN.findall(earlier_text + text[: match.start()]) if match else []
+            if not dates:
+                return text
+            date = datetime.strptime(dates[-1], "%Y/%m/%d") + timedelta(days=int(match.group(1)))
+
+            return text.replace(match.group(0), f"On {date:%Y/%m/%d}")
+
+        with mock.patch("tracex.logic.utils.gather_gpt", side_effect=gather_gpt), mock.patch(
+            "tracex.logic.utils.query_gpt", side_effect=resolve_relative_dates
+        ) as query_gpt:
+            result = Preprocessor(chunk_tokens=21, overlap=1).execute(patient_journey=patient_journey)
+
+        self.assertEqual(
+            result,
+            "I fell ill on 2020/03/01. I stayed at home. On 2020/03/03 I went to the doctor. I got medication. "
+            "On 2020/03/06 I recovered.",
+        )
+        self.assertEqual(len(messages_lists), 6)
+        self.assertTrue(all(len(messages_list) == 3 for messages_list in messages_lists))
+        self.assertEqual(query_gpt.call_count, 6)
+        self.assertTrue(
+            query_gpt.call_args_list[2].args[0][-2]["content"].endswith(
+                "(Latest date mentioned so far: 2020/03/03) I got medication."
+            )
+        )
+
+    def test_short_patient_journey_is_not_chunked(self):
+        """Test if a Patient Journey that fits into a single chunk is preprocessed as a whole."""
+        with mock.patch("tracex.logic.utils.query_gpt", side_effect=lambda messages: messages[-1]["content"]) as query:
+            result = Preprocessor().execute(patient_journey="I fell ill.\nI recovered.")
+
+        self.assertEqual(result, "I fell ill.\nI recovered.")
+        self.assertEqual(query.call_count, 8)
+
 
 class TimeExtractorTests(TestCase):
     """Test cases for the TimeExtractor."""
@@ -85,6 +232,32 @@ class TimeExtractorTests(TestCase):
         self.assertTrue((result["time:timestamp"].apply(lambda x: isinstance(x, pd.Timestamp))).all())
         self.assertTrue((result["time:end_timestamp"].apply(lambda x: isinstance(x, pd.Timestamp))).all())
 
+    def test_fused_dates_fall_back_to_separate_requests(self):
+        """Test if both dates are extracted with one request and unparsable answers are extracted separately."""
+        data = {"activity": ["fell ill", "recovered"], "sentence_id": ["0", "1"]}
+        patient_journey = ["I fell ill on June 5", "I recovered on June 7"]
+        gather_outputs = [
+            [json.dumps({"start": "20200605T0000", "end": "20200606T0000"}), "June 7"],
+            ["20200607T0000"],
+            ["20200607T1200"],
+        ]
+        time_extractor = TimeExtractor(fused=True)
+
+        with mock.patch("tracex.logic.utils.gather_gpt", side_effect=gather_outputs) as gather_gpt:
+            result = time_extractor.execute(df=pd.DataFrame(data), patient_journey_sentences=patient_journey)
+
+        fused_messages, start_messages, end_messages = (call.args[0] for call in gather_gpt.call_args_list)
+        self.assertEqual(len(fused_messages), 2)
+        self.assertEqual(len(start_messages), 1)
+        self.assertIn("Start date: 20200607T0000", end_messages[0][-1]["content"])
+        self.assertEqual(
+            list(result["time:timestamp"]), [pd.Timestamp("2020-06-05 00:00"), pd.Timestamp("2020-06-07 00:00")]
+        )
+        self.assertEqual(
+            list(result["time:end_timestamp"]), [pd.Timestamp("2020-06-06 00:00"), pd.Timestamp("2020-06-07 12:00")]
+        )
+        self.assertEqual(list(result["time:duration"]), ["24:00:00", "12:00:00"])
+
 
 class EventTypeClassifierTests(TestCase):
     """Test cases for the EventTypeClassifier."""
@@ -106,6 +279,53 @@ class EventTypeClassifierTests(TestCase):
         self.assertIsInstance(result, pd.DataFrame)
         self.assertIn("event_type", result.columns)
 
+    def test_batches_fall_back_to_single_activities(self):
+        """Test if activities are classified in batches and invalid answers are classified again one by one."""
+        input_dataframe = pd.DataFrame({"activity": ["tested positive", "felt dizzy", "took ibuprofen"]})
+        batch_outputs = [json.dumps(["diagnosis", "Dizziness"]), "Symptom Onset"]
+        single_outputs = ["Symptom Onset", "Medication"]
+        event_type_classifier = EventTypeClassifier(batch_size=2)
+
+        with mock.patch(
+            "tracex.logic.utils.gather_gpt", side_effect=[batch_outputs, single_outputs]
+        ) as gather_gpt:
+            result = event_type_classifier.execute(input_dataframe)
+
+        batch_messages, single_messages = (call.args[0] for call in gather_gpt.call_args_list)
+        self.assertEqual(len(batch_messages), 2)
+        self.assertEqual(json.loads(batch_messages[0][-1]["content"]), ["tested positive", "felt dizzy"])
+        self.assertEqual([messages[-1]["content"] for messages in single_messages], ["felt dizzy", "took ibuprofen"])
+        self.assertEqual(list(result["event_type"]), ["Diagnosis", "Symptom Onset", "Medication"])
+
+    def test_single_answers_are_spelled_as_batch_answers(self):
+        """Test if the answers of single-item requests are spelled as in EVENT_TYPES, like the answers of a batch."""
+        input_dataframe = pd.DataFrame({"activity": ["tested positive", "felt dizzy"]})
+        batch_outputs = [json.dumps(["diagnosis", "unknown"])]
+        single_outputs = ["symptom onsets"]
+
+        with mock.patch("tracex.logic.utils.gather_gpt", side_effect=[batch_outputs, single_outputs]):
+            result = EventTypeClassifier(batch_size=2).execute(input_dataframe.copy())
+        with mock.patch("tracex.logic.utils.gather_gpt", return_value=["diagnosis", "Not an event type"]):
+            single_result = EventTypeClassifier(batch_size=1).execute(input_dataframe.copy())
+
+        self.assertEqual(list(result["event_type"]), ["Diagnosis", "Symptom Onset"])
+        self.assertEqual(list(single_result["event_type"]), ["Diagnosis", "Not an event type"])
+
+    def test_batch_prompt_keeps_all_examples(self):
+        """Test if the batch prompt contains every example of the single-item prompt, spelled as in EVENT_TYPES."""
+        examples = get_prompt("EVENT_TYPE_MESSAGES")[1:]
+
+        with mock.patch("tracex.logic.utils.gather_gpt", return_value=[json.dumps(["Diagnosis"])]) as gather_gpt:
+            EventTypeClassifier(batch_size=2).execute(pd.DataFrame({"activity": ["tested positive"]}))
+
+        batch_messages = gather_gpt.call_args_list[0].args[0][0]
+        example_event_types = json.loads(batch_messages[2]["content"])
+        self.assertEqual(len(json.loads(batch_messages[1]["content"])), len(examples) // 2)
+        self.assertEqual(len(example_event_types), len(examples) // 2)
+        self.assertIn("Doctor Visit", example_event_types)
+        self.assertIn("Feelings", example_event_types)
+        self.assertTrue(set(example_event_types) <= {key for key, _ in EVENT_TYPES})
+
 
 class LocationExtractorTests(TestCase):
     """Test cases for the LocationExtractor."""
@@ -127,3 +347,137 @@ class LocationExtractorTests(TestCase):
 
         self.assertIsInstance(result, pd.DataFrame)
         self.assertIn("attribute_location", result.columns)
+
+    def test_repeated_labels_are_extracted_once(self):
+        """Test if only unique activity labels are sent to the model and if locations are reused in later runs."""
+        input_dataframe = pd.DataFrame(
+            {"activity": ["taking paracetamol", "visiting the doctor", "Taking  Paracetamol"]}
+        )
+
+        with mock.patch("tracex.logic.utils.gather_gpt", return_value=["Home", "Doctors"]) as gather_gpt:
+            result = LocationExtractor(use_database_memo=True).execute(input_dataframe.copy())
+        with mock.patch("tracex.logic.utils.gather_gpt", return_value=[]) as second_gather_gpt:
+            second_result = LocationExtractor(use_database_memo=True).execute(input_dataframe.copy())
+
+        messages_list = gather_gpt.call_args.args[0]
+        self.assertEqual([messages[-1]["content"] for messages in messages_list], list(input_dataframe["activity"][:2]))
+        self.assertEqual(list(result["attribute_location"]), ["Home", "Doctors", "Home"])
+        self.assertEqual(second_gather_gpt.call_args.args[0], [])
+        self.assertEqual(list(second_result["attribute_location"]), ["Home", "Doctors", "Home"])
+        self.assertEqual(LocationMemo.manager.count(), 2)
+
+
+class MetricsAnalyzerTests(TestCase):
+    """Test cases for the MetricsAnalyzer."""
+
+    fixtures = ["tracex_project/extraction/fixtures/prompts_fixture.json"]
+
+    def rate_timestamp_contexts(self, timestamp_context):
+        """Run the MetricsAnalyzer with mocked requests and return the texts the timestamps were rated against."""
+        patient_journey_sentences = [f"Sentence {index}" for index in range(20)]
+        input_dataframe = pd.DataFrame(
+            {
+                "activity": ["first activity", "last activity"],
+                "sentence_id": ["0", "19"],
+                "time:timestamp": ["20200101T0000"] * 2,
+                "time:end_timestamp": ["20200102T0000"] * 2,
+            }
+        )
+        timestamp_requested = asyncio.Event()
+        timestamp_contents = []
+
+        async def aquery_gpt(messages, return_linear_probability=False, **_kwargs):
+            if not return_linear_probability:
+                # Relevance ratings only finish once a timestamp rating was requested, so both must run concurrently.
+                await asyncio.wait_for(timestamp_requested.wait(), timeout=5)
+                return "High Relevance" if messages[-1]["content"] == "first activity" else "Low Relevance"
+            timestamp_requested.set()
+            timestamp_contents.append(messages[-1]["content"])
+            return ("True", 0.9) if "first activity" in messages[-1]["content"] else ("False", 0.6)
+
+        with mock.patch("tracex.logic.utils.aquery_gpt", side_effect=aquery_gpt):
+            result = MetricsAnalyzer(timestamp_context=timestamp_context).execute(
+                input_dataframe,
+                patient_journey=". ".join(patient_journey_sentences),
+                patient_journey_sentences=patient_journey_sentences,
+            )
+
+        self.assertEqual(list(result["activity_relevance"]), ["High Relevance", "Low Relevance"])
+        self.assertEqual(list(result["timestamp_correctness"]), ["True", "False"])
+        self.assertEqual(list(result["correctness_confidence"]), [0.9, 0.6])
+
+        return sorted(timestamp_contents, key=lambda content: "last activity" in content)
+
+    def test_timestamps_are_rated_against_snippets(self):
+        """Test if the timestamps are rated against the snippet around the sentence of each activity."""
+        contents = self.rate_timestamp_contexts("snippet")
+
+        self.assertTrue(contents[0].startswith("Text: Sentence 0. Sentence 1. Sentence 2. Sentence 3. Sentence 4\n"))
+        self.assertTrue(contents[1].startswith("Text: Sentence 16. Sentence 17. Sentence 18. Sentence 19\n"))
+
+    def test_timestamps_are_rated_against_full_patient_journey(self):
+        """Test if the full Patient Journey can still be selected as context for the timestamps."""
+        contents = self.rate_timestamp_contexts("full")
+
+        self.assertTrue(all(content.startswith("Text: Sentence 0. Sentence 1.") for content in contents))
+        self.assertTrue(all("Sentence 19\n" in content for content in contents))
+
+    def test_unknown_timestamp_context(self):
+        """Test if an unknown timestamp context is rejected."""
+        with self.assertRaises(ValueError):
+            MetricsAnalyzer(timestamp_context="everything")
+
+    def test_failed_request_cancels_remaining_requests(self):
+        """Test if a failing rating cancels the other ratings of the execution instead of leaving them running."""
+        input_dataframe = pd.DataFrame(
+            {
+                "activity": ["first activity", "last activity"],
+                "time:timestamp": ["20200101T0000"] * 2,
+                "time:end_timestamp": ["20200102T0000"] * 2,
+            }
+        )
+        cancelled = []
+        all_cancelled = threading.Event()
+
+        async def aquery_gpt(messages, **_kwargs):
+            if messages[-1]["content"] == "first activity":
+                raise ValueError("context length exceeded")
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.append(messages[-1]["content"])
+                if len(cancelled) == 3:
+                    all_cancelled.set()
+                raise
+
+        with mock.patch("tracex.logic.utils.aquery_gpt", side_effect=aquery_gpt):
+            with self.assertRaisesMessage(ValueError, "context length exceeded"):
+                MetricsAnalyzer(timestamp_context="full").execute(input_dataframe, patient_journey="Text")
+
+        self.assertTrue(all_cancelled.wait(timeout=5))
+
+    def test_requests_are_bounded_per_execution(self):
+        """Test if the ratings of an execution run at most LLM_CONCURRENCY at the same time."""
+        input_dataframe = pd.DataFrame(
+            {
+                "activity": [f"activity {index}" for index in range(4)],
+                "time:timestamp": ["20200101T0000"] * 4,
+                "time:end_timestamp": ["20200102T0000"] * 4,
+            }
+        )
+        in_flight = []
+        max_in_flight = []
+
+        async def aquery_gpt(_messages, return_linear_probability=False, **_kwargs):
+            in_flight.append(None)
+            max_in_flight.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.pop()
+            return ("True", 0.9) if return_linear_probability else "High Relevance"
+
+        with mock.patch("tracex.logic.utils.aquery_gpt", side_effect=aquery_gpt), \
+                mock.patch("extraction.logic.modules.module_metrics_analyzer.LLM_CONCURRENCY", 2):
+            MetricsAnalyzer(timestamp_context="full").execute(input_dataframe, patient_journey="Text")
+
+        self.assertEqual(len(max_in_flight), 8)
+        self.assertEqual(max(max_in_flight), 2)
@@ -1,12 +1,21 @@
 """Test cases for the Orchestrator class."""
+import asyncio
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
 import pandas as pd
 from django.contrib.sessions.middleware import SessionMiddleware
 from django.test import TestCase, RequestFactory
 
-from extraction.logic.orchestrator import ExtractionConfiguration, Orchestrator
+from extraction.logic.module import Module
+from extraction.logic.orchestrator import ExtractionConfiguration, Orchestrator, get_module_dependencies
 from extraction.logic.modules import (
     ActivityLabeler,
     CohortTagger,
+    EventTypeClassifier,
+    LocationExtractor,
+    TimeExtractor,
 )
 
 
@@ -22,6 +31,93 @@ class MockConfiguration:
     ]
 
 
+class StreamingBackend:
+    """Backend that streams two activities and answers all other requests with a fixed date."""
+
+    uses_rate_limit = False
+
+    def __init__(self):
+        self.first_activity_processed = threading.Event()
+        self.overlapped = False
+
+    def stream(self, **_request):
+        """Yield the second activity only after the first one was passed on to the following modules."""
+        yield "Visiting the doctor #0\n"
+        self.overlapped = self.first_activity_processed.wait(timeout=5)
+        yield "Taking medication #1"
+
+    async def acreate(self, **_request):
+        """Answer a request for a single activity."""
+        self.first_activity_processed.set()
+
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="20200101T0000"))],
+            usage=SimpleNamespace(prompt_tokens=10, completion_tokens=2, total_tokens=12),
+        )
+
+
+class FailingStreamingBackend:
+    """Backend that fails to stream the second activity while the requests for the first activity are in flight."""
+
+    uses_rate_limit = False
+
+    def __init__(self):
+        self.request_started = threading.Event()
+        self.request_cancelled = threading.Event()
+
+    def stream(self, **_request):
+        """Yield the first activity and fail once the requests for it were sent."""
+        yield "Visiting the doctor #0\n"
+        self.request_started.wait(timeout=5)
+        raise RuntimeError("stream failed")
+
+    async def acreate(self, **_request):
+        """Wait for a response that never arrives, recording if the request was cancelled."""
+        self.request_started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            self.request_cancelled.set()
+            raise
+
+
+class ColumnModule(Module):
+    """Module that writes fixed values to its columns, after all modules of its barrier started, if it has one."""
+
+    barrier = None
+
+    def __init__(self):
+        super().__init__()
+        self.name = type(self).__name__
+
+    def execute(self, df, **_kwargs):
+        """Check that only the read columns are passed and write the columns."""
+        assert list(df.columns) == list(self.reads), (self.name, list(df.columns))
+        if self.barrier is not None:
+            self.barrier.wait(timeout=5)
+        for column in self.writes:
+            df[column] = f"{column} value"
+
+        return df
+
+
+class Session(dict):
+    """Session that only stores the progress in memory."""
+
+    def save(self):
+        """Do nothing, since there is no session store."""
+
+
+class LabelingModule(ColumnModule):
+    """Module that creates the activities."""
+
+    writes = ("activity", "sentence_id")
+
+    def execute(self, df, **_kwargs):
+        """Return two activities."""
+        return pd.DataFrame({"activity": ["Visiting the doctor", "Taking medication"], "sentence_id": ["0", "1"]})
+
+
 class OrchestratorTests(TestCase):
     """Test cases for the Orchestrator class utilizing the ExtractionConfiguration."""
 
@@ -35,42 +131,15 @@ class OrchestratorTests(TestCase):
         # pylint: disable=unnecessary-lambda
         self.orchestrator.get_configuration = lambda: MockConfiguration()
 
-    def tearDown(self):  # pylint: disable=invalid-name
-        """Tear down method that gets called after every test is executed."""
-        Orchestrator.reset_instance()
-
-    def test_single_instance_creation(self):
-        """Test if two initialized orchestrators are the same instance."""
-        orchestrator1 = Orchestrator()
-        orchestrator2 = Orchestrator()
-
-        self.assertIs(orchestrator1, orchestrator2)
-
-    def test_consistent_object_state(self):
-        """Test if the state of the orchestrator instance is the same for two instances."""
-        orchestrator1 = Orchestrator()
-        orchestrator2 = Orchestrator()
+    def test_instances_are_independent(self):
+        """Test if two orchestrators have their own configuration and state."""
+        orchestrator1 = Orchestrator(ExtractionConfiguration())
+        orchestrator2 = Orchestrator(ExtractionConfiguration())
         orchestrator1.data = "test_data"
 
-        self.assertEqual(orchestrator1.data, orchestrator2.data)
-
-    def test_get_instance_method(self):
-        """Test if the get_instance method returns the same instance and if a new instance is the same instance."""
-        Orchestrator()
-        orchestrator1 = Orchestrator.get_instance()
-        orchestrator2 = Orchestrator.get_instance()
-        orchestrator3 = Orchestrator()
-
-        self.assertIs(orchestrator1, orchestrator2)
-        self.assertIs(orchestrator1, orchestrator3)
-
-    def test_reset_instance(self):
-        """Test if reset_instance resets the instance for all objects."""
-        orchestrator1 = Orchestrator()
-        Orchestrator.reset_instance()
-        orchestrator2 = Orchestrator()
-
         self.assertIsNot(orchestrator1, orchestrator2)
+        self.assertIsNot(orchestrator1.get_configuration(), orchestrator2.get_configuration())
+        self.assertIsNone(orchestrator2.data)
 
     def test_set_configuration(self):
         """Test if the set_configuration method correctly updates the Orchestrators instance's configuration."""
@@ -81,19 +150,8 @@ class OrchestratorTests(TestCase):
 
         self.assertIs(orchestrator.configuration, new_configuration)
 
-    def test_singleton_with_configuration(self):
-        """Test that the Orchestrator's configuration remains unchanged with subsequent instantiations."""
-        Orchestrator.reset_instance()
-        configuration_1 = ExtractionConfiguration()
-        orchestrator1 = Orchestrator(configuration_1)
-        configuration_2 = ExtractionConfiguration()
-        orchestrator2 = Orchestrator(configuration_2)
-
-        self.assertIs(orchestrator1.configuration, orchestrator2.configuration)
-
     def test_initialize_modules(self):
         """Test if initialize_modules correctly initializes a module."""
-        Orchestrator.reset_instance()
         configuration = ExtractionConfiguration()
         orchestrator = Orchestrator(configuration=configuration)
         orchestrator.configuration.update(
@@ -110,7 +168,6 @@ class OrchestratorTests(TestCase):
         """Test if the run method correctly returns a dataframe. Execution of ActivityLabeler, CohortTagger and
         Preprocessor is necessary since the run method makes assumptions on how the Patient Journey looks like.
         """
-        Orchestrator.reset_instance()
         configuration = ExtractionConfiguration(
             patient_journey="This is a test Patient Journey. This is some description about how I fell ill and "
             "recovered in the end.",
@@ -127,6 +184,115 @@ class OrchestratorTests(TestCase):
         self.assertIsNot(orchestrator.get_data(), None)
         self.assertIsInstance(orchestrator.get_data(), pd.DataFrame)
 
+    def test_run_with_streamed_activities(self):
+        """Test if streamed activities are processed by the per-activity modules while labeling is still running."""
+        configuration = ExtractionConfiguration(
+            patient_journey="I visited the doctor. I took medication.", stream_activities=True
+        )
+        configuration.update(
+            modules={
+                "cohort_tagging": CohortTagger,
+                "activity_labeling": ActivityLabeler,
+                "time_extraction": TimeExtractor,
+                "event_type_classification": EventTypeClassifier,
+                "location_extraction": LocationExtractor,
+            }
+        )
+        orchestrator = Orchestrator(configuration=configuration)
+        backend = StreamingBackend()
+
+        with mock.patch("tracex.logic.utils.get_backend", return_value=backend), \
+                mock.patch("tracex.logic.utils.get_cache", return_value=None), \
+                mock.patch("tracex.logic.utils.log_tokens_used", return_value=lambda func: func), \
+                mock.patch("extraction.logic.orchestrator.log_token_report"), \
+                mock.patch.object(CohortTagger, "execute_and_save", return_value=None):
+            orchestrator.run()
+        data = orchestrator.get_data()
+
+        self.assertTrue(backend.overlapped)
+        self.assertEqual(list(data["activity"]), ["Visiting the doctor", "Taking medication"])
+        self.assertEqual(list(data["event_type"]), ["20200101T0000"] * 2)
+        self.assertEqual(list(data["time:timestamp"]), [pd.Timestamp("2020-01-01 00:00")] * 2)
+        self.assertEqual(list(data["time:duration"]), ["00:00:00"] * 2)
+
+    def test_streamed_activities_cancelled_on_error(self):
+        """Test if the requests for streamed activities are cancelled when the labeling fails."""
+        configuration = ExtractionConfiguration(patient_journey="I visited the doctor.", stream_activities=True)
+        configuration.update(
+            modules={
+                "cohort_tagging": CohortTagger,
+                "activity_labeling": ActivityLabeler,
+                "location_extraction": LocationExtractor,
+            }
+        )
+        orchestrator = Orchestrator(configuration=configuration)
+        backend = FailingStreamingBackend()
+
+        with mock.patch("tracex.logic.utils.get_backend", return_value=backend), \
+                mock.patch("tracex.logic.utils.get_cache", return_value=None), \
+                mock.patch("tracex.logic.utils.log_tokens_used", return_value=lambda func: func), \
+                mock.patch("extraction.logic.orchestrator.log_token_report"), \
+                mock.patch.object(CohortTagger, "execute_and_save", return_value=None):
+            with self.assertRaises(RuntimeError):
+                orchestrator.run()
+
+        self.assertTrue(backend.request_cancelled.wait(timeout=5))
+
+    def test_independent_modules_run_concurrently(self):
+        """Test if modules run as soon as the columns they read are written and their columns are merged in order."""
+        barrier = threading.Barrier(3)
+        modules = {
+            "cohort_tagging": CohortTagger,
+            "activity_labeling": LabelingModule,
+            "time_extraction": type(
+                "Time", (ColumnModule,), {"reads": ("activity", "sentence_id"), "writes": ("start", "end")}
+            ),
+            "event_type_classification": type(
+                "EventType", (ColumnModule,), {"reads": ("activity",), "writes": ("event_type",), "barrier": barrier}
+            ),
+            "location_extraction": type(
+                "Location", (ColumnModule,), {"reads": ("activity",), "writes": ("location",), "barrier": barrier}
+            ),
+            "metrics_analyzer": type(
+                "Metrics",
+                (ColumnModule,),
+                {"reads": ("activity", "start"), "writes": ("relevance",), "barrier": barrier},
+            ),
+        }
+        configuration = ExtractionConfiguration(patient_journey="I visited the doctor. I took medication.")
+        configuration.update(modules=modules)
+        orchestrator = Orchestrator(configuration=configuration)
+        view = SimpleNamespace(request=SimpleNamespace(session=Session()))
+
+        with mock.patch("extraction.logic.orchestrator.log_token_report"), \
+                mock.patch.object(CohortTagger, "execute_and_save", return_value=None), \
+                mock.patch.object(Orchestrator, "set_default_values"):
+            orchestrator.run(view)
+
+        dependencies = get_module_dependencies(
+            {key: module() for key, module in modules.items() if key != "cohort_tagging"}
+        )
+        self.assertEqual(dependencies["location_extraction"], {"activity_labeling"})
+        self.assertEqual(dependencies["metrics_analyzer"], {"activity_labeling", "time_extraction"})
+        self.assertEqual(
+            list(orchestrator.get_data().columns),
+            ["case:concept:name", "activity", "start", "end", "event_type", "location", "relevance"],
+        )
+        self.assertEqual(list(orchestrator.get_data()["location"]), ["location value"] * 2)
+        self.assertEqual(view.request.session["progress"], 86)
+        self.assertEqual(view.request.session["status"], "EventType, Location, Metrics")
+
+    def test_fingerprint_changes_with_extraction_settings(self):
+        """Test if the fingerprint changes with the settings and the fast path classifier that change the trace."""
+        configuration = ExtractionConfiguration()
+        with mock.patch("extraction.logic.orchestrator.get_fast_path_classifier", return_value=None):
+            fingerprint = configuration.get_fingerprint()
+            with mock.patch("extraction.logic.orchestrator.FUSED_TIME_EXTRACTION", "changed"):
+                self.assertNotEqual(configuration.get_fingerprint(), fingerprint)
+        classifier = SimpleNamespace(version="1-abc")
+        with mock.patch("extraction.logic.orchestrator.get_fast_path_classifier", return_value=classifier):
+            self.assertNotEqual(configuration.get_fingerprint(), fingerprint)
+
     def test_set_db_objects_id(self):
         """Test if the set_db_objects_id method correctly sets the object ID."""
         object_name = "test_object"
@@ -0,0 +1,71 @@
+"""Test cases for the in-process prompt registry."""
+from unittest import mock
+
+from django.test import TestCase
+
+from extraction.logic.prompt_registry import PromptRegistry, clear_prompt_registry, get_prompt, get_prompt_version
+from extraction.models import Prompt
+
+
+class PromptRegistryTests(TestCase):
+    """Test cases for the prompt registry."""
+
+    fixtures = ["tracex_project/extraction/fixtures/prompts_fixture.json"]
+
+    def setUp(self):
+        # Rolling back the transaction of an earlier test does not send signals, so the registry is cleared here.
+        clear_prompt_registry()
+
+    def test_prompts_are_loaded_once_and_copied(self):
+        """Test if all prompts are loaded with one query and callers receive independent copies."""
+        with self.assertNumQueries(1):
+            messages = get_prompt("LOCATION_MESSAGES")
+            messages.append({"role": "user", "content": "taking paracetamol"})
+            messages[0]["content"] = "changed"
+            cohort_messages = get_prompt("COHORT_TAG_MESSAGES")
+
+        self.assertEqual(get_prompt("LOCATION_MESSAGES"), Prompt.objects.get(name="LOCATION_MESSAGES").text)
+        self.assertEqual(cohort_messages, Prompt.objects.get(name="COHORT_TAG_MESSAGES").text)
+        with self.assertRaises(Prompt.DoesNotExist):
+            get_prompt("UNKNOWN_MESSAGES")
+
+    def test_saving_and_deleting_prompts_clears_the_registry(self):
+        """Test if changed, added and deleted prompts and their versions are visible on the next use."""
+        location_version = get_prompt_version("LOCATION_MESSAGES")
+        version = get_prompt_version()
+        prompt = Prompt.objects.get(name="LOCATION_MESSAGES")
+        prompt.text = [{"role": "system", "content": "Classify the location."}]
+        prompt.save()
+
+        self.assertEqual(get_prompt("LOCATION_MESSAGES"), prompt.text)
+        self.assertNotEqual(get_prompt_version("LOCATION_MESSAGES"), location_version)
+        self.assertNotEqual(get_prompt_version(), version)
+        self.assertEqual(
+            get_prompt_version("EVENT_TYPE_MESSAGES", "LOCATION_MESSAGES"),
+            get_prompt_version("LOCATION_MESSAGES", "EVENT_TYPE_MESSAGES"),
+        )
+
+        Prompt.objects.create(name="NEW_MESSAGES", text=[{"role": "system", "content": "New."}])
+        self.assertEqual(get_prompt("NEW_MESSAGES"), [{"role": "system", "content": "New."}])
+
+        prompt.delete()
+        with self.assertRaises(Prompt.DoesNotExist):
+            get_prompt("LOCATION_MESSAGES")
+
+    def test_prompts_changed_by_other_processes_are_loaded_after_ttl(self):
+        """Test if the registries of two processes see a prompt changed without a signal once their ttl passed."""
+        web_registry = PromptRegistry(ttl=30)
+        worker_registry = PromptRegistry(ttl=30)
+        with mock.patch("extraction.logic.prompt_registry.time.monotonic", return_value=0):
+            version = web_registry.get_prompt_version()
+            worker_registry.get_prompt("LOCATION_MESSAGES")
+        text = [{"role": "system", "content": "Classify the location."}]
+        # Updating the rows sends no signal, like a change made by another process.
+        Prompt.objects.filter(name="LOCATION_MESSAGES").update(text=text)
+
+        with mock.patch("extraction.logic.prompt_registry.time.monotonic", return_value=29):
+            self.assertEqual(web_registry.get_prompt_version(), version)
+            self.assertNotEqual(worker_registry.get_prompt("LOCATION_MESSAGES"), text)
+        with mock.patch("extraction.logic.prompt_registry.time.monotonic", return_value=30):
+            self.assertNotEqual(web_registry.get_prompt_version(), version)
+            self.assertEqual(worker_registry.get_prompt("LOCATION_MESSAGES"), text)
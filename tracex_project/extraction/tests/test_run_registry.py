@@ -0,0 +1,81 @@
+"""Test cases for the registry of extraction runs."""
+from unittest import mock
+
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from extraction.logic.orchestrator import ExtractionConfiguration
+from extraction.logic.run_registry import RUN_ID_SESSION_KEY, RunRegistry, run_registry
+from extraction.models import PatientJourney
+
+
+class RunRegistryTests(TestCase):
+    """Test cases for the RunRegistry."""
+
+    def test_runs_are_evicted_after_ttl_unless_running(self):
+        """Test if idle runs expire after the time to live, while executing runs are kept."""
+        registry = RunRegistry(ttl=60, max_runs=10)
+        with mock.patch("extraction.logic.run_registry.time.monotonic", return_value=0):
+            idle_run_id, _ = registry.create(ExtractionConfiguration())
+            running_run_id, running_orchestrator = registry.create(ExtractionConfiguration())
+        running_orchestrator.is_running = True
+
+        with mock.patch("extraction.logic.run_registry.time.monotonic", return_value=61):
+            self.assertIsNone(registry.get(idle_run_id))
+            self.assertIs(registry.get(running_run_id), running_orchestrator)
+        self.assertEqual(len(registry), 1)
+
+    def test_least_recently_used_runs_are_evicted_beyond_maximum(self):
+        """Test if the number of runs is bounded by evicting the least recently used runs."""
+        registry = RunRegistry(ttl=60, max_runs=2)
+        first_run_id, first_orchestrator = registry.create(ExtractionConfiguration())
+        second_run_id, _ = registry.create(ExtractionConfiguration())
+
+        registry.get(first_run_id)
+        third_run_id, _ = registry.create(ExtractionConfiguration())
+
+        self.assertIs(registry.get(first_run_id), first_orchestrator)
+        self.assertIsNone(registry.get(second_run_id))
+        self.assertIsNotNone(registry.get(third_run_id))
+        self.assertEqual(len(registry), 2)
+
+    def test_new_run_is_kept_when_all_runs_are_executing(self):
+        """Test if a run created while the maximum number of runs is reached with executing runs is not evicted."""
+        registry = RunRegistry(ttl=60, max_runs=2)
+        for _ in range(2):
+            _, orchestrator = registry.create(ExtractionConfiguration())
+            orchestrator.is_running = True
+
+        run_id, orchestrator = registry.create(ExtractionConfiguration())
+
+        self.assertIs(registry.get(run_id), orchestrator)
+        self.assertEqual(len(registry), 3)
+
+    def test_sessions_have_independent_runs(self):
+        """Test if two users selecting different Patient Journeys get their own orchestrator."""
+        journeys = [
+            PatientJourney.manager.create(name=f"Journey {index}", patient_journey=f"Patient Journey {index}.")
+            for index in range(2)
+        ]
+        clients = [Client(), Client()]
+
+        for client, journey in zip(clients, journeys):
+            client.get(reverse("journey_details", kwargs={"pk": journey.id}))
+            client.post(reverse("journey_details", kwargs={"pk": journey.id}))
+        orchestrators = [run_registry.get(client.session[RUN_ID_SESSION_KEY]) for client in clients]
+
+        self.assertIsNot(orchestrators[0], orchestrators[1])
+        self.assertEqual(
+            [orchestrator.get_configuration().patient_journey for orchestrator in orchestrators],
+            ["Patient Journey 0.", "Patient Journey 1."],
+        )
+        self.assertEqual(
+            [orchestrator.get_db_objects_id("patient_journey") for orchestrator in orchestrators],
+            [journey.id for journey in journeys],
+        )
+
+    def test_view_without_run_returns_not_found(self):
+        """Test if a view that needs a run responds with 404 when the session has no run."""
+        response = self.client.get(reverse("result"))
+
+        self.assertEqual(response.status_code, 404)
@@ -10,7 +10,7 @@ from typing import Dict, List
 
 import pandas as pd
 
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.views import generic
 from django.http import JsonResponse
 from django.shortcuts import redirect, render
@@ -21,10 +21,21 @@ from extraction.forms import (
     FilterForm,
     JourneySelectForm,
 )
-from extraction.logic.orchestrator import Orchestrator, ExtractionConfiguration
-from extraction.models import PatientJourney
+from extraction.logic.extraction_jobs import apply_job_result, build_job_orchestrator, enqueue_job
+from extraction.logic.orchestrator import ExtractionConfiguration
+from extraction.logic.run_registry import (
+    RUN_ID_SESSION_KEY,
+    get_run_or_404,
+    restore_run,
+    run_registry,
+    start_run,
+)
+from extraction.models import ExtractionJob, PatientJourney
 from tracex.views import DownloadXesView
 from tracex.logic import utils
+from tracex.logic.constants import EXTRACTION_JOBS_ENABLED
+
+EXTRACTION_JOB_SESSION_KEY = "extraction_job_id"
 
 
 class JourneyInputSelectView(generic.TemplateView):
@@ -92,7 +103,7 @@ class JourneyDetailView(generic.DetailView):
         configuration = ExtractionConfiguration(
             patient_journey=patient_journey.patient_journey
         )
-        orchestrator = Orchestrator(configuration)
+        orchestrator = start_run(self.request.session, configuration)
         orchestrator.set_db_objects_id("patient_journey", patient_journey_id)
 
         return redirect("journey_filter")
@@ -106,9 +117,14 @@ class JourneyFilterView(generic.FormView):
     success_url = reverse_lazy("result")
 
     def get_context_data(self, **kwargs):
-        """Overrides the get_context_data method to add the 'is_comparing' session variable to the context data."""
+        """
+        Overrides the get_context_data method to add the 'is_comparing' session variable and whether an extraction job
+        of the session is still running to the context data.
+        """
         context = super().get_context_data(**kwargs)
         context["is_comparing"] = self.request.session.get("is_comparing")
+        job = self.get_extraction_job()
+        context["job_running"] = job is not None and job.status in (ExtractionJob.QUEUED, ExtractionJob.RUNNING)
 
         return context
 
@@ -118,11 +134,13 @@ class JourneyFilterView(generic.FormView):
 
         This method is called when the form is valid. It updates the Orchestrator's configuration
         with the form data, reduces the modules to the selected ones, and runs the extraction pipeline.
-        If an exception occurs during the pipeline execution, it resets the Orchestrator instance,
-        flushes the session, and renders an error page. If the pipeline runs successfully, it saves
-        the session and selected modules. If the session indicates a comparison is being made, it
-        saves the results to the database and redirects to the comparison page. Otherwise, it calls
-        the parent class's form_valid method.
+        If extraction jobs are enabled, the run is enqueued as a job for the extraction workers instead, and
+        the view redirects back to itself, where the progress of the job is displayed.
+        If an exception occurs during the pipeline execution, it renders an error page. The run is kept, so
+        that submitting the form again resumes after the modules that completed. If the pipeline runs
+        successfully, it saves the session and selected modules. If the session indicates a comparison is
+        being made, it saves the results to the database and redirects to the comparison page. Otherwise,
+        it calls the parent class's form_valid method.
 
         Args:
             form (Form): The form instance that has just been validated.
@@ -131,7 +149,7 @@ class JourneyFilterView(generic.FormView):
             HttpResponse: The HTTP response to send back to the client.
         """
 
-        orchestrator = Orchestrator.get_instance()
+        orchestrator = get_run_or_404(self.request.session)
         orchestrator.get_configuration().update(
             event_types=form.cleaned_data["event_types"],
             locations=form.cleaned_data["locations"],
@@ -142,12 +160,16 @@ class JourneyFilterView(generic.FormView):
             + form.cleaned_data["modules_optional"]
         )
         orchestrator.reduce_modules_to(modules_list)
+        if EXTRACTION_JOBS_ENABLED:
+            job = enqueue_job(orchestrator, save_results=self.request.session.get("is_comparing") is True)
+            self.request.session[EXTRACTION_JOB_SESSION_KEY] = job.id
+            self.request.session["selected_modules"] = form.cleaned_data["modules_optional"]
+
+            return redirect("journey_filter")
+
         try:
             orchestrator.run(view=self)
         except Exception as e:  # pylint: disable=broad-except
-            orchestrator.reset_instance()
-            self.request.session.flush()
-
             return render(
                 self.request,
                 "error_page.html",
@@ -171,8 +193,10 @@ class JourneyFilterView(generic.FormView):
         Handle GET requests to the view.
 
         If the request is an AJAX request, it returns a JSON response with the current progress
-        and status of the extraction pipeline. If it's not an AJAX request, it resets the progress
-        and status in the session and calls the parent class's get method.
+        and status of the extraction pipeline, which is read from the extraction job of the session if
+        there is one. If it's not an AJAX request, it renders the error page if the extraction job failed,
+        keeping the run so that submitting the form again resumes it, or resets the progress and status
+        in the session and calls the parent class's get method.
 
         Args:
             request (HttpRequest): The request instance.
@@ -184,19 +208,70 @@ class JourneyFilterView(generic.FormView):
         """
 
         is_ajax = request.headers.get("X-Requested-With") == "XMLHttpRequest"
+        job = self.get_extraction_job()
         if is_ajax:
+            if job is not None:
+                return JsonResponse(self.get_job_progress(job))
             progress_information = {
                 "progress": self.request.session.get("progress"),
                 "status": self.request.session.get("status"),
             }
             return JsonResponse(progress_information)
 
+        if job is not None and job.status == ExtractionJob.FAILED:
+            self.get_job_run(job)
+            del self.request.session[EXTRACTION_JOB_SESSION_KEY]
+
+            return render(
+                self.request,
+                "error_page.html",
+                {"type": "ExtractionJob", "error_traceback": job.error},
+            )
+
         self.request.session["progress"] = 0
         self.request.session["status"] = None
         self.request.session.save()
 
         return super().get(request, *args, **kwargs)
 
+    def get_extraction_job(self):
+        """Return the extraction job of the session, or None if the session has none."""
+        job_id = self.request.session.get(EXTRACTION_JOB_SESSION_KEY)
+        if job_id is None:
+            return None
+
+        return ExtractionJob.manager.filter(pk=job_id).first()
+
+    def get_job_run(self, job: ExtractionJob):
+        """
+        Return the orchestrator of the session's run. The run is not executing in the web process while its job runs
+        in a worker, so it may have been evicted in the meantime, in which case it is rebuilt from the job.
+        """
+        orchestrator = run_registry.get(self.request.session.get(RUN_ID_SESSION_KEY))
+        if orchestrator is None:
+            orchestrator = restore_run(self.request.session, build_job_orchestrator(job))
+
+        return orchestrator
+
+    def get_job_progress(self, job: ExtractionJob) -> Dict:
+        """
+        Return the progress and status of an extraction job. Once the job is finished, the URL to continue with is
+        added. The result of a succeeded job is set in the orchestrator of the session's run, which is rebuilt if it
+        was evicted while the job ran, and the job is removed from the session.
+        """
+        progress_information = {"progress": job.progress, "status": job.status_message}
+        if job.status == ExtractionJob.SUCCEEDED:
+            apply_job_result(self.get_job_run(job), job)
+            del self.request.session[EXTRACTION_JOB_SESSION_KEY]
+            if self.request.session.get("is_comparing") is True:
+                progress_information["redirect"] = reverse("testing_comparison")
+            else:
+                progress_information["redirect"] = reverse("result")
+        elif job.status == ExtractionJob.FAILED:
+            progress_information["redirect"] = reverse("journey_filter")
+
+        return progress_information
+
 
 class ResultView(generic.FormView):
     """View for displaying the result."""
@@ -208,7 +283,7 @@ class ResultView(generic.FormView):
     def get_form_kwargs(self):
         """Return the keyword arguments to instantiate the form."""
         kwargs = super().get_form_kwargs()
-        orchestrator = Orchestrator.get_instance()
+        orchestrator = get_run_or_404(self.request.session)
         kwargs["initial"] = {
             "activity_key": orchestrator.get_configuration().activity_key,
             "selected_modules": self.request.session.get("selected_modules"),
@@ -223,7 +298,7 @@ class ResultView(generic.FormView):
         Prepare the data for the result page.
 
         This method overrides the get_context_data method from the parent class. It retrieves the
-        current instance of the Orchestrator and its configuration, builds the trace and event log
+        Orchestrator of the run of the session and its configuration, builds the trace and event log
         dataframes based on the filter settings, and validates the form. It then updates the context
         with the form, journey, direct follow graph (dfg) images, and tables. Finally, it saves the
         trace and event log dataframes to the session and returns the context.
@@ -236,14 +311,14 @@ class ResultView(generic.FormView):
         """
 
         context = super().get_context_data(**kwargs)
-        orchestrator = Orchestrator.get_instance()
+        orchestrator = get_run_or_404(self.request.session)
         activity_key: str = orchestrator.get_configuration().activity_key
         filter_dict = {
             "event_type": orchestrator.get_configuration().event_types,
             "attribute_location": orchestrator.get_configuration().locations,
         }
 
-        trace = self.build_trace_df(filter_dict)
+        trace = self.build_trace_df(orchestrator.get_data(), filter_dict)
         event_log = self.build_event_log_df(filter_dict, trace)
 
         form = self.get_form()
@@ -274,9 +349,8 @@ class ResultView(generic.FormView):
         return context
 
     @staticmethod
-    def build_trace_df(filter_dict: Dict[str, List[str]]) -> pd.DataFrame:
-        """Build the trace dataframe based on the filter settings."""
-        trace_df: pd.DataFrame = Orchestrator.get_instance().get_data()
+    def build_trace_df(trace_df: pd.DataFrame, filter_dict: Dict[str, List[str]]) -> pd.DataFrame:
+        """Build the trace dataframe of the extracted data based on the filter settings."""
         trace_df_filtered = utils.DataFrameUtilities.filter_dataframe(
             trace_df, filter_dict
         )
@@ -310,7 +384,7 @@ class ResultView(generic.FormView):
 
     def form_valid(self, form):
         """Update the Orchestrator's configuration with the filter settings from the form."""
-        orchestrator = Orchestrator.get_instance()
+        orchestrator = get_run_or_404(self.request.session)
         orchestrator.get_configuration().update(
             event_types=form.cleaned_data["event_types"],
             locations=form.cleaned_data["locations"],
@@ -333,7 +407,7 @@ class SaveSuccessView(generic.TemplateView):
     def get_context_data(self, **kwargs):
         """Prepare and return the context data for the save success page."""
         context = super().get_context_data(**kwargs)
-        orchestrator = Orchestrator.get_instance()
+        orchestrator = get_run_or_404(self.request.session)
         orchestrator.save_results_to_db()
 
         return context
@@ -348,7 +422,7 @@ class DownloadXesResultView(DownloadXesView):
     @staticmethod
     def process_trace_type(request, trace_type):
         """Process and provide the XES files to be downloaded based on the trace type."""
-        orchestrator = Orchestrator.get_instance()
+        orchestrator = get_run_or_404(request.session)
         activity_key = orchestrator.get_configuration().activity_key
 
         if trace_type == "event_log":
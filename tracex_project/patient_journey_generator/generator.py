@@ -11,14 +11,14 @@ get_life_circumstances -- Generates life circumstances for the synthetic Patient
 from datetime import datetime, timedelta
 import random
 
-from extraction.models import Prompt
+from extraction.logic.prompt_registry import get_prompt
 from tracex.logic import utils as u
 from tracex.logic import constants as c
 
 
 def generate_patient_journey():
     """Generate a synthetic Patient Journey."""
-    messages = Prompt.objects.get(name="CREATE_PATIENT_JOURNEY").text
+    messages = get_prompt("CREATE_PATIENT_JOURNEY")
     messages.insert(0, {"role": "system", "content": create_patient_journey_context()})
     patient_journey = u.query_gpt(messages=messages, temperature=1)
 
@@ -62,7 +62,7 @@ def get_date(start="01/01/2020", end="01/09/2023"):
 
 def get_life_circumstances(sex):
     """Generate life circumstances by using the OpenAI API."""
-    messages = Prompt.objects.get(name="CREATE_PATIENT_JOURNEY_LIFE_CIRCUMSTANCES").text
+    messages = get_prompt("CREATE_PATIENT_JOURNEY_LIFE_CIRCUMSTANCES")
     messages[0]["content"] = messages[0]["content"].replace("<SEX>", sex)
     life_circumstances = u.query_gpt(messages=messages, max_tokens=100, temperature=1)
 
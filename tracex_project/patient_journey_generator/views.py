@@ -11,7 +11,8 @@ from django.shortcuts import render
 from django.urls import reverse_lazy
 from django.views import generic
 
-from extraction.logic.orchestrator import Orchestrator, ExtractionConfiguration
+from extraction.logic.orchestrator import ExtractionConfiguration
+from extraction.logic.run_registry import end_run, get_run_or_404, start_run
 from patient_journey_generator.forms import GenerationOverviewForm
 from patient_journey_generator.generator import generate_patient_journey
 
@@ -37,7 +38,7 @@ class JourneyGeneratorOverviewView(generic.CreateView):
 
     def form_valid(self, form):
         """Create an empty Patient Journey instance and save the ID in the orchestrator."""
-        orchestrator = Orchestrator.get_instance()
+        orchestrator = get_run_or_404(self.request.session)
         form.instance.patient_journey = orchestrator.get_configuration().patient_journey
         response = super().form_valid(form)
         orchestrator.set_db_objects_id("patient_journey", self.object.id)
@@ -49,7 +50,7 @@ class JourneyGenerationView(generic.RedirectView):
     """
     View to inspect the generated Patient Journey.
 
-    By passing a GET request to the view, a Patient Journey is generated and saved in the orchestrator's configuration.
+    By passing a GET request to the view, a Patient Journey is generated and saved in the configuration of a new run.
     Since the JourneyGenerationView is a RedirectView, the user is redirected back to the JourneyGeneratorOverviewView.
     Therefore, this view does not render a template.
     """
@@ -58,21 +59,20 @@ class JourneyGenerationView(generic.RedirectView):
 
     def get(self, request, *args, **kwargs):
         """
-        Handle GET requests by generating a Patient Journey and updating the orchestrator's configuration.
+        Handle GET requests by generating a Patient Journey and starting a run with it in the orchestrator's
+        configuration.
 
-        The empty Patient Journey instance from the orchestrator's configuration is modified to contain the generated
-        Patient Journey text. The generated Patient Journey is also saved in the session to pass to the HTML file
-        of the JourneyGenerationOverviewView.
+        The run id is stored in the session, so that the Patient Journey can be saved and extracted later. The
+        generated Patient Journey is also saved in the session to pass to the HTML file of the
+        JourneyGenerationOverviewView.
 
         """
-        orchestrator = Orchestrator()
-
         try:
             configuration = ExtractionConfiguration(
                 patient_journey=generate_patient_journey()
             )
         except Exception as e:  # pylint: disable=broad-except
-            orchestrator.reset_instance()
+            end_run(self.request.session)
             self.request.session.flush()
 
             return render(
@@ -84,7 +84,7 @@ class JourneyGenerationView(generic.RedirectView):
                 },
             )
 
-        orchestrator.set_configuration(configuration)
+        orchestrator = start_run(request.session, configuration)
         request.session[
             "generated_journey"
         ] = orchestrator.get_configuration().patient_journey
@@ -1,11 +1,10 @@
 """The trace comparator compares the pipeline output against a ground truth and vice versa."""
-import time
 from typing import List, Tuple
 from pathlib import Path
 from django.conf import settings
 import pandas as pd
 
-from extraction.models import Prompt
+from extraction.logic.prompt_registry import get_prompt
 from tracex.logic.logger import log_execution_time
 from tracex.logic import utils as u, constants as c
 
@@ -110,7 +109,6 @@ def compare_activities(
             index,
             mapping_input_to_comparison,
         )
-        time.sleep(2)  # this prevents the token limit per minute from being exceeded
         current_step += 1
 
     return mapping_input_to_comparison
@@ -134,7 +132,7 @@ def find_activity(
     )
     possible_matches: List[Tuple[int, float]] = []
     for count, second_activity in enumerate(comparison_basis_activities[lower:upper]):
-        messages = Prompt.objects.get(name="COMPARE_MESSAGES").text
+        messages = get_prompt("COMPARE_MESSAGES")
         messages.append(
             {
                 "role": "user",
@@ -12,7 +12,8 @@ from django.views.generic import FormView, TemplateView
 from django.db.models import Q
 
 from extraction.models import PatientJourney, Trace
-from extraction.logic.orchestrator import Orchestrator, ExtractionConfiguration
+from extraction.logic.orchestrator import ExtractionConfiguration
+from extraction.logic.run_registry import start_run
 from trace_comparator.comparator import compare_traces
 from trace_comparator.forms import PatientJourneySelectForm
 from tracex.logic.utils import DataFrameUtilities, Conversion
@@ -58,7 +59,7 @@ class TraceTestingOverviewView(FormView):
         configuration = ExtractionConfiguration(
             patient_journey=patient_journey_entry.patient_journey,
         )
-        orchestrator = Orchestrator(configuration=configuration)
+        orchestrator = start_run(self.request.session, configuration)
         orchestrator.set_db_objects_id("patient_journey", patient_journey_entry.id)
         self.request.session["patient_journey_name"] = selected_journey
         self.request.session["is_comparing"] = True
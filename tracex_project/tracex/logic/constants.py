@@ -2,9 +2,53 @@
 Provide constants for the project.
 
 Constant Numbers:
+ACTIVITY_WINDOW_OVERLAP -- Number of sentences shared by neighboring windows of the Activity Labeler.
+ACTIVITY_WINDOW_SENTENCES -- Number of sentences labeled with one request. 0 labels the Patient Journey as a whole.
+CHECKPOINT_DIRECTORY -- Directory of the checkpoints of extraction runs. Defaults to checkpoints in the project.
+CHECKPOINT_RETENTION -- Seconds the checkpoints of an extraction run are kept after they were last written.
+CHECKPOINTS_ENABLED -- Whether extraction runs store a checkpoint after every module and resume from them.
+EVENT_TYPE_BATCH_SIZE -- Number of activities whose event types are classified in one request. 1 disables batching.
+EXTRACTION_JOB_HEARTBEAT_INTERVAL -- Seconds between two heartbeats of the worker executing an extraction job.
+EXTRACTION_JOB_STALE_AFTER -- Seconds without a heartbeat after which a running extraction job is claimed again.
+EXTRACTION_JOBS_ENABLED -- Whether extractions started in the web interface run as background jobs of the workers.
+EXTRACTION_WORKER_POLL_INTERVAL -- Seconds an extraction worker waits before looking for new jobs in an empty queue.
+FAST_PATH_CONFIDENCE -- Minimum confidence of the local classifier to use its prediction instead of the model.
+FAST_PATH_ENABLED -- Whether event types and locations are predicted by the local classifier first, if it was built.
+FAST_PATH_MODEL_PATH -- Path of the local classifier artifact. Defaults to fast_path_classifier.npz in the project.
+FUSED_TIME_EXTRACTION -- Whether the start date and the end date of an activity are extracted with a single request.
+LLM_BACKEND -- Backend that answers OpenAI API requests, one of "live", "record", "replay" and "stub".
+LLM_CACHE_ENABLED -- Whether responses of deterministic OpenAI API requests are cached on the local disk.
+LLM_CACHE_MAX_ENTRIES -- Maximum number of cached responses before the least recently used ones are evicted.
+LLM_CACHE_TTL -- Time to live of a cached response in seconds.
+LLM_CASSETTE_PATH -- Path of the JSONL cassette written by the "record" backend and read by "replay" and "stub".
+LLM_COMPLETION_TOKEN_PRICE -- Price in US dollars per million completion tokens of the model.
+LLM_CONCURRENCY -- Maximum number of concurrent OpenAI API requests issued by one batch of asynchronous requests.
+LLM_CONNECT_TIMEOUT -- Timeout in seconds for establishing a connection to the OpenAI API.
+LLM_CONTEXT_WINDOW -- Maximum number of prompt and completion tokens of a single request to the model.
+LLM_MAX_ATTEMPTS -- Maximum number of attempts for an OpenAI API request failing with a rate limit or server error.
+LLM_MAX_TIMEOUT_ATTEMPTS -- Maximum number of attempts for an OpenAI API request failing with a timeout.
+LLM_POOL_SIZE -- Maximum number of pooled keep-alive HTTP connections to the OpenAI API per process.
+LLM_PROMPT_OVERFLOW -- Handling of prompts exceeding the context window, either "reject" or "truncate".
+LLM_PROMPT_TOKEN_PRICE -- Price in US dollars per million prompt tokens of the model.
+LLM_REQUESTS_PER_MINUTE -- Requests per minute allowed by the OpenAI API for the API key. 0 disables the limit.
+LLM_RUN_TOKEN_BUDGET -- Maximum number of tokens a single extraction run may use. 0 disables the budget.
+LLM_STUB_ERROR_RATE -- Share of requests the local stub server answers with a rate limit error.
+LLM_STUB_LATENCY -- Latency in seconds the local stub server adds to every request.
+LLM_TIMEOUT -- Default timeout in seconds for a single OpenAI API request.
+LLM_TOKENS_PER_MINUTE -- Tokens per minute allowed by the OpenAI API for the API key. 0 disables the limit.
+LOCATION_MEMO_ENABLED -- Whether extracted locations of activity labels are stored in the database for later runs.
 MAX_TOKENS -- Maximum number of tokens allowed for a single OpenAI API request.
+METRICS_TIMESTAMP_CONTEXT -- Text the timestamps of an activity are rated against, either "full" or "snippet".
 MODEL -- Model to use for the OpenAI API requests.
+MODULE_CONCURRENCY -- Maximum number of independent modules the orchestrator runs at once. 1 runs them in order.
 OAIK -- OpenAI API Key retrieved from the environment variables.
+PREPROCESSING_CHUNK_OVERLAP -- Number of sentences of the previous chunk passed as context to date resolving steps.
+PREPROCESSING_CHUNK_TOKENS -- Maximum tokens per chunk of a preprocessed Patient Journey. 0 disables chunks.
+PROMPT_REGISTRY_TTL -- Time in seconds the prompts are kept in memory before they are loaded again.
+RUN_REGISTRY_MAX_RUNS -- Maximum number of extraction runs kept in memory. Executing runs are never evicted.
+RUN_REGISTRY_TTL -- Time in seconds an extraction run is kept in memory after it was last accessed.
+STREAM_ACTIVITY_LABELS -- Whether activities are passed to the following modules while they are still being labeled.
+STRUCTURED_COHORT_TAGS -- Whether all cohort tags are extracted with a single request returning a JSON object.
 TEMPERATURE_SUMMARIZING -- Temperature parameter for the OpenAI API requests for summarization tasks.
 TEMPERATURE_CREATION -- Temperature parameter for the OpenAI API requests for creation tasks.
 THRESHOLD_FOR_MATCH -- Threshold for the similarity score to consider a match. Similarity score range from 0 to 1.
@@ -22,9 +66,53 @@ import os
 from typing import Final
 
 # Constant Numbers
+ACTIVITY_WINDOW_OVERLAP: Final = int(os.environ.get("TRACEX_ACTIVITY_WINDOW_OVERLAP", 5))
+ACTIVITY_WINDOW_SENTENCES: Final = int(os.environ.get("TRACEX_ACTIVITY_WINDOW_SENTENCES", 0))
+CHECKPOINT_DIRECTORY: Final = os.environ.get("TRACEX_CHECKPOINT_DIRECTORY")
+CHECKPOINT_RETENTION: Final = float(os.environ.get("TRACEX_CHECKPOINT_RETENTION", 24 * 60 * 60))
+CHECKPOINTS_ENABLED: Final = os.environ.get("TRACEX_CHECKPOINTS", "1") == "1"
+EVENT_TYPE_BATCH_SIZE: Final = int(os.environ.get("TRACEX_EVENT_TYPE_BATCH_SIZE", 1))
+EXTRACTION_JOB_HEARTBEAT_INTERVAL: Final = float(os.environ.get("TRACEX_EXTRACTION_JOB_HEARTBEAT_INTERVAL", 30))
+EXTRACTION_JOB_STALE_AFTER: Final = float(os.environ.get("TRACEX_EXTRACTION_JOB_STALE_AFTER", 5 * 60))
+EXTRACTION_JOBS_ENABLED: Final = os.environ.get("TRACEX_EXTRACTION_JOBS", "0") == "1"
+EXTRACTION_WORKER_POLL_INTERVAL: Final = float(os.environ.get("TRACEX_EXTRACTION_WORKER_POLL_INTERVAL", 2))
+FAST_PATH_CONFIDENCE: Final = float(os.environ.get("TRACEX_FAST_PATH_CONFIDENCE", 0.9))
+FAST_PATH_ENABLED: Final = os.environ.get("TRACEX_FAST_PATH", "1") == "1"
+FAST_PATH_MODEL_PATH: Final = os.environ.get("TRACEX_FAST_PATH_MODEL")
+FUSED_TIME_EXTRACTION: Final = os.environ.get("TRACEX_FUSED_TIME_EXTRACTION", "0") == "1"
+LLM_BACKEND: Final = os.environ.get("TRACEX_LLM_BACKEND", "live")
+LLM_CACHE_ENABLED: Final = os.environ.get("TRACEX_LLM_CACHE", "0") == "1"
+LLM_CACHE_MAX_ENTRIES: Final = int(os.environ.get("TRACEX_LLM_CACHE_MAX_ENTRIES", 50000))
+LLM_CACHE_TTL: Final = float(os.environ.get("TRACEX_LLM_CACHE_TTL", 30 * 24 * 60 * 60))
+LLM_CASSETTE_PATH: Final = os.environ.get("TRACEX_LLM_CASSETTE")
+LLM_COMPLETION_TOKEN_PRICE: Final = float(os.environ.get("TRACEX_LLM_COMPLETION_TOKEN_PRICE", 1.5))
+LLM_CONCURRENCY: Final = int(os.environ.get("TRACEX_LLM_CONCURRENCY", 8))
+LLM_CONNECT_TIMEOUT: Final = 10.0
+LLM_CONTEXT_WINDOW: Final = int(os.environ.get("TRACEX_LLM_CONTEXT_WINDOW", 16385))
+LLM_MAX_ATTEMPTS: Final = int(os.environ.get("TRACEX_LLM_MAX_ATTEMPTS", 6))
+LLM_MAX_TIMEOUT_ATTEMPTS: Final = int(os.environ.get("TRACEX_LLM_MAX_TIMEOUT_ATTEMPTS", 2))
+LLM_POOL_SIZE: Final = int(os.environ.get("TRACEX_LLM_POOL_SIZE", 20))
+LLM_PROMPT_OVERFLOW: Final = os.environ.get("TRACEX_LLM_PROMPT_OVERFLOW", "reject")
+LLM_PROMPT_TOKEN_PRICE: Final = float(os.environ.get("TRACEX_LLM_PROMPT_TOKEN_PRICE", 0.5))
+LLM_REQUESTS_PER_MINUTE: Final = int(os.environ.get("TRACEX_LLM_REQUESTS_PER_MINUTE", 3500))
+LLM_RUN_TOKEN_BUDGET: Final = int(os.environ.get("TRACEX_LLM_RUN_TOKEN_BUDGET", 0))
+LLM_STUB_ERROR_RATE: Final = float(os.environ.get("TRACEX_LLM_STUB_ERROR_RATE", 0))
+LLM_STUB_LATENCY: Final = float(os.environ.get("TRACEX_LLM_STUB_LATENCY", 0))
+LLM_TIMEOUT: Final = float(os.environ.get("TRACEX_LLM_TIMEOUT", 60))
+LLM_TOKENS_PER_MINUTE: Final = int(os.environ.get("TRACEX_LLM_TOKENS_PER_MINUTE", 60000))
+LOCATION_MEMO_ENABLED: Final = os.environ.get("TRACEX_LOCATION_MEMO", "0") == "1"
 MAX_TOKENS: Final = 1100
+METRICS_TIMESTAMP_CONTEXT: Final = os.environ.get("TRACEX_METRICS_TIMESTAMP_CONTEXT", "full")
 MODEL: Final = "gpt-3.5-turbo"
+MODULE_CONCURRENCY: Final = int(os.environ.get("TRACEX_MODULE_CONCURRENCY", 4))
 OAIK: Final = os.environ.get("OPENAI_API_KEY")
+PREPROCESSING_CHUNK_OVERLAP: Final = int(os.environ.get("TRACEX_PREPROCESSING_CHUNK_OVERLAP", 2))
+PREPROCESSING_CHUNK_TOKENS: Final = int(os.environ.get("TRACEX_PREPROCESSING_CHUNK_TOKENS", 0))
+PROMPT_REGISTRY_TTL: Final = float(os.environ.get("TRACEX_PROMPT_REGISTRY_TTL", 30))
+RUN_REGISTRY_MAX_RUNS: Final = int(os.environ.get("TRACEX_RUN_REGISTRY_MAX_RUNS", 100))
+RUN_REGISTRY_TTL: Final = float(os.environ.get("TRACEX_RUN_REGISTRY_TTL", 2 * 60 * 60))
+STREAM_ACTIVITY_LABELS: Final = os.environ.get("TRACEX_STREAM_ACTIVITY_LABELS", "0") == "1"
+STRUCTURED_COHORT_TAGS: Final = os.environ.get("TRACEX_STRUCTURED_COHORT_TAGS", "0") == "1"
 TEMPERATURE_SUMMARIZING: Final = 0
 TEMPERATURE_CREATION: Final = 1
 THRESHOLD_FOR_MATCH: Final = 0.5
@@ -0,0 +1,445 @@
+"""
+Provide pluggable backends that answer the chat completion requests of query_gpt.
+
+The backend is selected with the TRACEX_LLM_BACKEND environment variable, see LLM_BACKEND in the constants:
+live -- Send requests to the OpenAI API. This is the default.
+record -- Send requests to the OpenAI API and append every request and response, including logprobs, to a JSONL
+          cassette at TRACEX_LLM_CASSETTE.
+replay -- Answer requests from the cassette at TRACEX_LLM_CASSETTE without any network access. Identical requests are
+          answered with the recorded responses in recording order.
+stub -- Send requests to a local OpenAI-compatible stub server, started in the same process, with a configurable
+        latency (TRACEX_LLM_STUB_LATENCY) and error rate (TRACEX_LLM_STUB_ERROR_RATE). If a cassette exists, the stub
+        answers with the recorded responses, otherwise with a fixed placeholder answer.
+
+Replay and stub mode make it possible to run, benchmark and regression-test the whole pipeline offline.
+
+Functions:
+get_backend -- Return the backend of the process as configured by the environment.
+set_backend -- Replace the backend of the process, e.g. in tests.
+
+Classes:
+CassetteMissError -- Error raised when a replayed request was not recorded.
+Cassette -- JSONL file of recorded requests and responses.
+LiveBackend -- Backend that sends requests to the OpenAI API.
+RecordingBackend -- Backend that sends requests to the OpenAI API and records them in a cassette.
+ReplayBackend -- Backend that answers requests from a cassette.
+StubServer -- Local OpenAI-compatible chat completion server for benchmarks and tests.
+StubBackend -- Backend that sends requests to a StubServer.
+"""
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from django.conf import settings
+from openai.types.chat import ChatCompletion
+
+from tracex.logic.constants import (
+    LLM_BACKEND,
+    LLM_CASSETTE_PATH,
+    LLM_STUB_ERROR_RATE,
+    LLM_STUB_LATENCY,
+    MODEL,
+)
+from tracex.logic.llm_cache import make_key
+from tracex.logic.llm_client import get_async_client, get_client
+from tracex.logic.tokenizer import count_message_tokens, count_tokens
+
+_backend: Optional["LiveBackend"] = None  # pylint: disable=invalid-name
+_backend_lock = threading.Lock()
+
+
+class CassetteMissError(KeyError):
+    """Error raised when a replayed request was not recorded in the cassette."""
+
+
+class Cassette:
+    """
+    JSONL file of recorded requests and responses. Every line holds the cache key of the request, the request and
+    the complete chat completion.
+
+    Public Methods:
+    append -- Append a request and its response to the cassette.
+    load -- Load all responses of the cassette, grouped by the key of their request.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, request: Dict[str, Any], response: ChatCompletion) -> None:
+        """Append a request and its response to the cassette."""
+        line = json.dumps(
+            {
+                "key": _make_request_key(request),
+                "request": request,
+                "response": response.model_dump(mode="json"),
+            },
+            ensure_ascii=False,
+        )
+        with self._lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+    def load(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Load all responses of the cassette, grouped by the key of their request in recording order."""
+        responses = defaultdict(list)
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as file:
+                for line in file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        responses[entry["key"]].append(entry["response"])
+
+        return responses
+
+
+class LiveBackend:
+    """
+    Backend that sends requests to the OpenAI API with the pooled clients.
+
+    Public Methods:
+    create -- Create a chat completion.
+    acreate -- Create a chat completion asynchronously.
+    stream -- Create a chat completion and return an iterator over its content as it arrives.
+    """
+
+    uses_rate_limit = True
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
+
+    def create(self, timeout: Optional[float] = None, **request) -> ChatCompletion:
+        """Create a chat completion for the request, given as the keyword arguments of the OpenAI API."""
+        client = get_client(base_url=self.base_url, api_key=self.api_key)
+        if timeout is not None:
+            client = client.with_options(timeout=timeout)
+
+        return client.chat.completions.create(**request)
+
+    async def acreate(self, timeout: Optional[float] = None, **request) -> ChatCompletion:
+        """Create a chat completion for the request asynchronously. See create for details."""
+        client = get_async_client(base_url=self.base_url, api_key=self.api_key)
+        if timeout is not None:
+            client = client.with_options(timeout=timeout)
+
+        return await client.chat.completions.create(**request)
+
+    def stream(self, timeout: Optional[float] = None, **request) -> Iterator[str]:
+        """
+        Create a chat completion for the request and return an iterator over the fragments of its content.
+
+        The request is sent before this method returns, so that errors of the request are raised here and can be
+        retried. Errors while reading the stream are raised by the iterator.
+        """
+        client = get_client(base_url=self.base_url, api_key=self.api_key)
+        if timeout is not None:
+            client = client.with_options(timeout=timeout)
+        chunks = client.chat.completions.create(stream=True, **request)
+
+        return (
+            chunk.choices[0].delta.content
+            for chunk in chunks
+            if chunk.choices and chunk.choices[0].delta.content
+        )
+
+
+class RecordingBackend(LiveBackend):
+    """Backend that sends requests to the OpenAI API and records every request and response in a cassette."""
+
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    def create(self, timeout: Optional[float] = None, **request) -> ChatCompletion:
+        """Create a chat completion for the request and record it."""
+        response = super().create(timeout=timeout, **request)
+        self.cassette.append(request, response)
+
+        return response
+
+    async def acreate(self, timeout: Optional[float] = None, **request) -> ChatCompletion:
+        """Create a chat completion for the request asynchronously and record it."""
+        response = await super().acreate(timeout=timeout, **request)
+        self.cassette.append(request, response)
+
+        return response
+
+    def stream(self, timeout: Optional[float] = None, **request) -> Iterator[str]:
+        """Stream a chat completion for the request and record it as a whole once the stream is exhausted."""
+        fragments = super().stream(timeout=timeout, **request)
+
+        def record():
+            content = []
+            for fragment in fragments:
+                content.append(fragment)
+                yield fragment
+            self.cassette.append(request, _build_completion(request, "".join(content)))
+
+        return record()
+
+
+class ReplayBackend(LiveBackend):
+    """
+    Backend that answers requests from a cassette without network access.
+
+    If the same request was recorded several times, the responses are replayed in recording order and the last one is
+    repeated afterwards. A request that was never recorded raises a CassetteMissError.
+    """
+
+    uses_rate_limit = False
+
+    def __init__(self, cassette: Cassette):
+        self.responses = cassette.load()
+        self._positions: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def create(self, timeout: Optional[float] = None, **request) -> ChatCompletion:
+        """Return the recorded chat completion for the request."""
+        key = _make_request_key(request)
+        recorded_responses = self.responses.get(key)
+        if not recorded_responses:
+            raise CassetteMissError(f"No recorded response for request {key}.")
+        with self._lock:
+            position = min(self._positions[key], len(recorded_responses) - 1)
+            self._positions[key] += 1
+
+        return ChatCompletion.model_validate(recorded_responses[position])
+
+    async def acreate(self, timeout: Optional[float] = None, **request) -> ChatCompletion:
+        """Return the recorded chat completion for the request."""
+        return self.create(timeout=timeout, **request)
+
+    def stream(self, timeout: Optional[float] = None, **request) -> Iterator[str]:
+        """Return the content of the recorded chat completion for the request line by line."""
+        content = self.create(timeout=timeout, **request).choices[0].message.content or ""
+
+        return iter(content.splitlines(keepends=True))
+
+
+class StubServer:
+    """
+    Local OpenAI-compatible chat completion server for benchmarks and tests.
+
+    Every request is delayed by the latency. A share of the requests, given by the error rate, is answered with an
+    error status and a Retry-After header instead. If a cassette is given, recorded requests are answered with the
+    recorded response, all other requests with the fixed content. Streamed requests are answered line by line as
+    server-sent events, with the chunk latency between two lines.
+
+    Public Methods:
+    start -- Start serving in a daemon thread.
+    stop -- Stop serving.
+    """
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 429,
+        content: str = "N/A",
+        cassette: Optional[Cassette] = None,
+        chunk_latency: float = 0.0,
+    ):
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.content = content
+        self.responses = cassette.load() if cassette is not None else {}
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def base_url(self) -> str:
+        """Return the base URL to pass to an OpenAI client."""
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def start(self) -> "StubServer":
+        """Start serving on a free local port in a daemon thread."""
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Answer chat completion requests on behalf of the stub server."""
+
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """Answer a chat completion request."""
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                status, body = stub.answer(request)
+                if status == 200 and request.get("stream"):
+                    self.__send_stream(json.loads(body))
+
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if status != 200:
+                    self.send_header("Retry-After", "0")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                """Silence the request log."""
+
+            def __send_stream(self, completion: Dict[str, Any]) -> None:
+                """Send the content of a completion line by line as chunked server-sent events."""
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                content = completion["choices"][0]["message"]["content"] or ""
+                for index, line in enumerate(content.splitlines(keepends=True)):
+                    if index and stub.chunk_latency:
+                        time.sleep(stub.chunk_latency)
+                    self.__send_event(_build_chunk(completion, {"content": line}, None))
+                self.__send_event(_build_chunk(completion, {}, "stop"))
+                self.__send_event("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def __send_event(self, data: Any) -> None:
+                """Send a single server-sent event as one chunk of the response."""
+                event = f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+                self.wfile.flush()
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+        return self
+
+    def stop(self) -> None:
+        """Stop serving."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def answer(self, request: Dict[str, Any]) -> tuple[int, bytes]:
+        """Return the status code and the JSON body of the answer to a chat completion request."""
+        with self._lock:
+            self.request_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            body = {"error": {"message": "Injected error.", "type": "stub_error", "code": self.error_status}}
+
+            return self.error_status, json.dumps(body).encode("utf-8")
+
+        recorded_responses = self.responses.get(_make_request_key(request))
+        if recorded_responses:
+            return 200, json.dumps(recorded_responses[0]).encode("utf-8")
+
+        completion = _build_completion(request, self.content).model_dump(mode="json")
+        if request.get("logprobs"):
+            logprob = {"token": self.content, "logprob": -0.01, "bytes": None}
+            completion["choices"][0]["logprobs"] = {"content": [{**logprob, "top_logprobs": [logprob]}]}
+
+        return 200, json.dumps(completion).encode("utf-8")
+
+
+class StubBackend(LiveBackend):
+    """Backend that sends requests to a StubServer running in the same process."""
+
+    uses_rate_limit = False
+
+    def __init__(self, stub_server: StubServer):
+        self.stub_server = stub_server
+        self.base_url = stub_server.base_url
+        self.api_key = "stub"
+
+
+def _build_completion(request: Dict[str, Any], content: str) -> ChatCompletion:
+    """Build a chat completion with the content, estimating its usage with the tokenizer."""
+    prompt_tokens = count_message_tokens(request.get("messages", []))
+    completion_tokens = count_tokens(content)
+
+    return ChatCompletion.model_validate(
+        {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", MODEL),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                    "logprobs": None,
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+    )
+
+
+def _build_chunk(completion: Dict[str, Any], delta: Dict[str, str], finish_reason: Optional[str]) -> Dict[str, Any]:
+    """Build a chat completion chunk of a streamed completion."""
+    return {
+        "id": completion["id"],
+        "object": "chat.completion.chunk",
+        "created": completion["created"],
+        "model": completion["model"],
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def _make_request_key(request: Dict[str, Any]) -> str:
+    """Build the key of a request from the keyword arguments of the OpenAI API."""
+    return make_key(
+        request.get("messages"),
+        request.get("max_tokens"),
+        request.get("temperature"),
+        request.get("logprobs"),
+        request.get("top_logprobs"),
+    )
+
+
+def get_backend() -> LiveBackend:
+    """Return the backend of the process, creating it on first use as configured by the environment."""
+    global _backend  # pylint: disable=global-statement
+
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend(LLM_BACKEND)
+
+    return _backend
+
+
+def set_backend(backend: Optional[LiveBackend]) -> None:
+    """Replace the backend of the process. None resets it to the backend configured by the environment."""
+    global _backend  # pylint: disable=global-statement
+
+    with _backend_lock:
+        _backend = backend
+
+
+def _create_backend(mode: str) -> LiveBackend:
+    """Create the backend for a mode."""
+    cassette = Cassette(Path(LLM_CASSETTE_PATH or settings.BASE_DIR / "llm_cassette.jsonl"))
+    if mode == "live":
+        return LiveBackend()
+    if mode == "record":
+        return RecordingBackend(cassette)
+    if mode == "replay":
+        return ReplayBackend(cassette)
+    if mode == "stub":
+        stub_server = StubServer(
+            latency=LLM_STUB_LATENCY,
+            error_rate=LLM_STUB_ERROR_RATE,
+            cassette=cassette,
+        )
+
+        return StubBackend(stub_server.start())
+
+    raise ValueError(f"Unknown LLM backend '{mode}'. Use 'live', 'record', 'replay' or 'stub'.")
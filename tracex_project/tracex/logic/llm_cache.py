@@ -0,0 +1,198 @@
+"""
+Provide a persistent, content-addressed cache for responses of the OpenAI API.
+
+Requests with a temperature of 0 are deterministic enough that sending byte-identical messages again only costs tokens.
+The cache stores the output of such requests in a SQLite database on the local disk, keyed by a hash of everything
+that influences the response. Since SQLite handles locking, the cache is shared by all threads and worker processes
+of the application. Entries expire after a time to live and the least recently used entries are evicted once the
+cache exceeds its maximum size.
+
+Functions:
+get_cache -- Return the response cache of the process, or None if caching is disabled.
+make_key -- Build the cache key for a request.
+
+Classes:
+CachedResponse -- Dataclass for a single cached response.
+ResponseCache -- SQLite-backed response cache with LRU eviction and time to live.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+from tracex.logic.constants import (
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_MAX_ENTRIES,
+    LLM_CACHE_TTL,
+    MODEL,
+)
+
+_cache: Optional["ResponseCache"] = None  # pylint: disable=invalid-name
+_cache_lock = threading.Lock()
+
+
+@dataclass
+class CachedResponse:
+    """Dataclass for a single cached response."""
+
+    content: str
+    linear_probability: Optional[float]
+    prompt_tokens: int
+    completion_tokens: int
+
+
+def make_key(
+    messages: List[Dict[str, str]],
+    max_tokens: int,
+    temperature: float,
+    return_linear_probability: bool,
+    top_logprobs: Optional[int],
+) -> str:
+    """Build the cache key for a request as the SHA-256 hash of the model and all request parameters."""
+    payload = json.dumps(
+        [MODEL, messages, temperature, max_tokens, return_linear_probability, top_logprobs],
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed response cache with LRU eviction and time to live.
+
+    Every thread uses its own connection to the database. Hits and misses are counted per process.
+
+    Public Methods:
+    get -- Return the cached response for a key, or None.
+    put -- Store a response under a key.
+    clear -- Remove all entries from the cache.
+    get_stats -- Return the hit and miss counters and the number of tokens saved.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        ttl: float = LLM_CACHE_TTL,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.__create_table()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """Return the cached response for a key, or None if there is no entry or the entry has expired."""
+        connection = self.__get_connection()
+        now = time.time()
+        row = connection.execute(
+            "SELECT content, linear_probability, prompt_tokens, completion_tokens, created "
+            "FROM responses WHERE key = ?",
+            (key,),
+        ).fetchone()
+
+        if row is not None and now - row[4] > self.ttl:
+            with connection:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            row = None
+
+        with self._stats_lock:
+            if row is None:
+                self.misses += 1
+
+                return None
+            self.hits += 1
+            self.tokens_saved += row[2] + row[3]
+
+        with connection:
+            connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+
+        return CachedResponse(*row[:4])
+
+    def put(self, key: str, response: CachedResponse) -> None:
+        """Store a response under a key and evict the least recently used entries if the cache is full."""
+        connection = self.__get_connection()
+        now = time.time()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    response.content,
+                    response.linear_probability,
+                    response.prompt_tokens,
+                    response.completion_tokens,
+                    now,
+                    now,
+                ),
+            )
+            connection.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        connection = self.__get_connection()
+        with connection:
+            connection.execute("DELETE FROM responses")
+
+    def get_stats(self) -> Dict[str, int]:
+        """Return the hit and miss counters and the number of tokens saved by this process."""
+        with self._stats_lock:
+            return {
+                "cache_hits": self.hits,
+                "cache_misses": self.misses,
+                "tokens_saved": self.tokens_saved,
+            }
+
+    def __get_connection(self) -> sqlite3.Connection:
+        """Return the database connection of the current thread."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+
+        return connection
+
+    def __create_table(self) -> None:
+        """Create the table of the cache if it does not exist yet."""
+        connection = self.__get_connection()
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, content TEXT NOT NULL, linear_probability REAL, "
+                "prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, "
+                "created REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+            )
+
+
+def get_cache() -> Optional[ResponseCache]:
+    """Return the response cache of the process, or None if caching is disabled."""
+    global _cache  # pylint: disable=global-statement
+
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(Path(settings.BASE_DIR / "llm_cache.sqlite3"))
+
+    return _cache
@@ -0,0 +1,185 @@
+"""
+Provide a process-wide registry of pooled OpenAI clients.
+
+Creating an OpenAI client per request means a new HTTP connection, and therefore a new TLS handshake, for every
+single API call. The registry builds one client per API key lazily and keeps it for the lifetime of the process, so
+that all modules and the trace comparator share the same keep-alive connection pool. The registry is thread-safe.
+The clients do not retry failed requests themselves, since retries are handled by tracex.logic.retry.
+
+Asynchronous clients are bound to the event loop they are used on. To share their connection pool between calls from
+synchronous code, all asynchronous requests run on a single background event loop per process.
+
+Functions:
+get_api_key -- Return the OpenAI API key that is currently configured.
+get_client -- Return the pooled OpenAI client for the currently configured API key.
+get_async_client -- Return the pooled asynchronous OpenAI client for the running event loop.
+run_coroutine -- Run a coroutine on the background event loop and return its result.
+submit_coroutine -- Schedule a coroutine on the background event loop and return a future of its result.
+reset_clients -- Close and remove all pooled clients from the registry.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+from tracex.logic.constants import (
+    LLM_CONNECT_TIMEOUT,
+    LLM_POOL_SIZE,
+    LLM_TIMEOUT,
+    OAIK,
+)
+
+_clients: Dict[Tuple[Optional[str], Optional[str], int], OpenAI] = {}
+_async_clients: Dict[Tuple[Optional[str], Optional[str], int, asyncio.AbstractEventLoop], AsyncOpenAI] = {}
+_clients_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None  # pylint: disable=invalid-name
+
+
+def get_api_key() -> Optional[str]:
+    """
+    Return the OpenAI API key that is currently configured.
+
+    The key from the environment at startup takes precedence. Otherwise, the key entered on the landing page, which is
+    written to the environment at runtime, is used.
+    """
+    return OAIK or os.environ.get("OPENAI_API_KEY")
+
+
+def _get_limits(pool_size: int) -> httpx.Limits:
+    """Return the connection limits for a pool of the given size."""
+    return httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+
+
+def get_client(
+    pool_size: int = LLM_POOL_SIZE, base_url: Optional[str] = None, api_key: Optional[str] = None
+) -> OpenAI:
+    """
+    Return the pooled OpenAI client for the currently configured API key.
+
+    The client is created on first use and reused afterwards. A changed API key or base URL results in a new client,
+    so that resetting the API key on the landing page takes effect immediately.
+
+    Keyword Arguments:
+    pool_size -- Maximum number of keep-alive connections of the client. Default is specified as a constant.
+    base_url -- Base URL of an OpenAI-compatible API. Default is None, which uses OPENAI_BASE_URL or the OpenAI API.
+    api_key -- API key to use instead of the configured one, e.g. for a local API. Default is None.
+    """
+    key = (api_key or get_api_key(), base_url or os.environ.get("OPENAI_BASE_URL"), pool_size)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = OpenAI(
+                api_key=key[0],
+                base_url=key[1],
+                timeout=LLM_TIMEOUT,
+                max_retries=0,
+                http_client=httpx.Client(
+                    limits=_get_limits(pool_size),
+                    timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                ),
+            )
+            _clients[key] = client
+
+    return client
+
+
+def get_async_client(
+    pool_size: int = LLM_POOL_SIZE, base_url: Optional[str] = None, api_key: Optional[str] = None
+) -> AsyncOpenAI:
+    """
+    Return the pooled asynchronous OpenAI client for the currently configured API key and the running event loop.
+
+    Must be called from within a coroutine. See get_client for the caching behaviour.
+
+    Keyword Arguments:
+    pool_size -- Maximum number of keep-alive connections of the client. Default is specified as a constant.
+    base_url -- Base URL of an OpenAI-compatible API. Default is None, which uses OPENAI_BASE_URL or the OpenAI API.
+    api_key -- API key to use instead of the configured one, e.g. for a local API. Default is None.
+    """
+    key = (
+        api_key or get_api_key(),
+        base_url or os.environ.get("OPENAI_BASE_URL"),
+        pool_size,
+        asyncio.get_running_loop(),
+    )
+    client = _async_clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _async_clients.get(key)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=key[0],
+                base_url=key[1],
+                timeout=LLM_TIMEOUT,
+                max_retries=0,
+                http_client=httpx.AsyncClient(
+                    limits=_get_limits(pool_size),
+                    timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                ),
+            )
+            _async_clients[key] = client
+
+    return client
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Return the background event loop, starting it in a daemon thread on first use."""
+    global _loop  # pylint: disable=global-statement
+
+    if _loop is None:
+        with _clients_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=loop.run_forever, name="tracex-llm-loop", daemon=True
+                ).start()
+                _loop = loop
+
+    return _loop
+
+
+def run_coroutine(coroutine: Coroutine) -> Any:
+    """
+    Run a coroutine on the background event loop and block until its result is available.
+
+    Exceptions raised by the coroutine are re-raised in the calling thread.
+    """
+    return submit_coroutine(coroutine).result()
+
+
+def submit_coroutine(coroutine: Coroutine) -> Future:
+    """Schedule a coroutine on the background event loop and return a future of its result without waiting."""
+    return asyncio.run_coroutine_threadsafe(coroutine, _get_loop())
+
+
+def reset_clients() -> None:
+    """Close and remove all pooled clients from the registry."""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        async_clients = list(_async_clients.items())
+        _async_clients.clear()
+
+    for key, client in async_clients:
+        loop = key[3]
+        if loop.is_running() and loop is not _running_loop():
+            asyncio.run_coroutine_threadsafe(client.close(), loop).result()
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    """Return the event loop running in the current thread, if any."""
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
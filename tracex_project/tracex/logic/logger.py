@@ -10,11 +10,20 @@ input tokens used and output tokens used.
 Functions:
 log_execution_time -- Decorator to log the execution time of a function.
 log_tokens_used -- Decorator to log the tokens used in an API call to the OPENAI API.
+log_tokens_saved -- Log the tokens saved by serving an API call from the response cache.
+log_token_report -- Log the token usage and the estimated and worst-case cost of an extraction run.
+get_caller -- Return the function name, file and line of a calling frame.
+use_caller -- Attribute the OpenAI API calls made within the context to a caller.
 """
 import time
 import functools
 import inspect
+from contextlib import contextmanager
+from contextvars import ContextVar
 from logging import getLogger, INFO, FileHandler, Formatter
+from typing import Any, Dict, Iterator, Optional
+
+_caller: ContextVar[Optional[Dict[str, Any]]] = ContextVar("caller", default=None)
 
 
 def log_execution_time(log_file_path):
@@ -61,30 +70,39 @@ def log_tokens_used(log_file_path):
     Decorate a function to log the OpenAI API key tokens used.
 
     Create a .log file and reference it in the decorator to log the OpenAI API key tokens of the decorated function.
+    Both regular functions and coroutine functions can be decorated.
 
     Positional Arguments:
     log_file_path -- Path to a .log file. An error occurs if the file does not exist when calling a decorated function.
     """
     logger = setup_logger("token_logger", log_file_path, "%(asctime)s - %(message)s")
 
+    def log_usage(response):
+        """Log the tokens of a response together with the caller of the function that called the API."""
+        log_entry = {
+            **(_caller.get() or get_caller(3)),
+            "tokens_used": response.usage.total_tokens,
+            "input_tokens_used": response.usage.prompt_tokens,
+            "output_tokens_used": response.usage.completion_tokens,
+        }
+        logger.info(log_entry)
+
     def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                response = await func(*args, **kwargs)
+                log_usage(response)
+
+                return response
+
+            return async_wrapper
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             response = func(*args, **kwargs)
-
-            tokens_used = response.usage.total_tokens
-            input_tokens_used = response.usage.prompt_tokens
-            output_tokens_used = response.usage.completion_tokens
-            parent_calling_frame = inspect.stack()[2]
-            log_entry = {
-                "calling_function_name": parent_calling_frame[3],
-                "calling_file": parent_calling_frame[1],
-                "calling_line": parent_calling_frame[2],
-                "tokens_used": tokens_used,
-                "input_tokens_used": input_tokens_used,
-                "output_tokens_used": output_tokens_used,
-            }
-            logger.info(log_entry)
+            log_usage(response)
 
             return response
 
@@ -93,6 +111,73 @@ def log_tokens_used(log_file_path):
     return decorator
 
 
+def log_tokens_saved(log_file_path, tokens_saved: int, cache_stats: dict):
+    """
+    Log the tokens saved by serving an API call to the OpenAI API from the response cache.
+
+    The entry is written to the same .log file as the tokens used, together with the hit and miss counters of the
+    cache, so that the savings can be read off next to the spending.
+
+    Positional Arguments:
+    log_file_path -- Path to a .log file. An error occurs if the file does not exist.
+    tokens_saved -- Number of tokens the cached response would have cost.
+    cache_stats -- Hit and miss counters of the response cache.
+    """
+    logger = setup_logger("token_logger", log_file_path, "%(asctime)s - %(message)s")
+    log_entry = {
+        **(_caller.get() or get_caller(2)),
+        "tokens_saved": tokens_saved,
+        **cache_stats,
+    }
+    logger.info(log_entry)
+
+
+def log_token_report(log_file_path, token_report: dict):
+    """
+    Log the token usage and the estimated and worst-case cost of an extraction run.
+
+    Positional Arguments:
+    log_file_path -- Path to a .log file. An error occurs if the file does not exist.
+    token_report -- Report of the token budget of the run, see tracex.logic.token_budget.TokenBudget.get_report.
+    """
+    logger = setup_logger("token_logger", log_file_path, "%(asctime)s - %(message)s")
+    logger.info({"token_report": token_report})
+
+
+def get_caller(depth: int = 1) -> Dict[str, Any]:
+    """
+    Return the function name, file and line of a calling frame.
+
+    Keyword Arguments:
+    depth -- Number of frames above the function calling get_caller. Default is 1, the caller of that function.
+    """
+    frame = inspect.currentframe().f_back
+    for _ in range(depth):
+        frame = frame.f_back
+
+    return {
+        "calling_function_name": frame.f_code.co_name,
+        "calling_file": frame.f_code.co_filename,
+        "calling_line": frame.f_lineno,
+    }
+
+
+@contextmanager
+def use_caller(caller: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Attribute the OpenAI API calls made within the context to a caller, see get_caller.
+
+    Calls on the background event loop have no meaningful calling frame, so the function that scheduled them passes
+    its caller on explicitly. The caller is stored in a context variable, so it applies to the current thread and to
+    all asyncio tasks created within the context.
+    """
+    context_token = _caller.set(caller)
+    try:
+        yield caller
+    finally:
+        _caller.reset(context_token)
+
+
 def setup_logger(logger_name, log_file_path, log_format):
     """Set up a logger at specified file path and format."""
     logger = getLogger(logger_name)
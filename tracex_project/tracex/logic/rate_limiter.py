@@ -0,0 +1,163 @@
+"""
+Provide a token-bucket rate limiter for requests to the OpenAI API.
+
+The OpenAI API limits both the requests per minute and the tokens per minute of an API key. The limiter keeps one
+bucket for each limit. Buckets refill continuously at their rate per minute, and a request may only be sent once both
+buckets hold enough capacity for it. Callers therefore only wait if the budget is actually used up.
+
+The state of the buckets lives in a SQLite database on the local disk. Every acquisition runs in an exclusive
+transaction, so the budget is shared by all threads and all worker processes of the application. Its path is the
+setting LLM_RATE_LIMIT_PATH, which the test runner points at a temporary directory.
+
+Functions:
+get_rate_limiter -- Return the rate limiter of the process, or None if rate limiting is disabled.
+
+Classes:
+RateLimiter -- Token-bucket rate limiter for requests and tokens per minute.
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+from django.conf import settings
+
+from tracex.logic.constants import LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE
+
+_rate_limiter: Optional["RateLimiter"] = None  # pylint: disable=invalid-name
+_rate_limiter_lock = threading.Lock()
+
+
+class RateLimiter:
+    """
+    Token-bucket rate limiter for requests and tokens per minute.
+
+    A limit of 0 disables the corresponding bucket.
+
+    Public Methods:
+    acquire -- Block until a request with the given number of tokens may be sent.
+    aacquire -- Wait asynchronously until a request with the given number of tokens may be sent.
+    settle -- Return tokens that were reserved but not used by a request.
+    asettle -- Return tokens that were reserved but not used by a request, without blocking the event loop.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+    ):
+        self.path = path
+        self.capacities = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self._local = threading.local()
+        self.__create_table()
+
+    def acquire(self, tokens: int) -> None:
+        """Block the calling thread until a request with the given number of tokens may be sent."""
+        wait = self.__try_acquire(tokens)
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.__try_acquire(tokens)
+
+    async def aacquire(self, tokens: int) -> None:
+        """
+        Wait without blocking the event loop until a request with the given number of tokens may be sent.
+
+        The transactions wait for the lock of the database, which other processes may hold, so they run in a thread.
+        """
+        wait = await asyncio.to_thread(self.__try_acquire, tokens)
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = await asyncio.to_thread(self.__try_acquire, tokens)
+
+    def settle(self, reserved_tokens: int, used_tokens: int) -> None:
+        """Return the difference between the reserved and the actually used tokens to the tokens bucket."""
+        if not self.capacities["tokens"] or reserved_tokens <= used_tokens:
+            return
+        with self.__transaction() as connection:
+            connection.execute(
+                "UPDATE buckets SET level = MIN(level + ?, ?) WHERE name = 'tokens'",
+                (reserved_tokens - used_tokens, self.capacities["tokens"]),
+            )
+
+    async def asettle(self, reserved_tokens: int, used_tokens: int) -> None:
+        """Return the unused tokens like settle, running the transaction in a thread instead of the event loop."""
+        await asyncio.to_thread(self.settle, reserved_tokens, used_tokens)
+
+    def __try_acquire(self, tokens: int) -> float:
+        """
+        Take one request and the given number of tokens from the buckets if both hold enough capacity.
+
+        Returns 0 if the request may be sent, otherwise the number of seconds until enough capacity is refilled.
+        """
+        demands = {"requests": 1, "tokens": tokens}
+        with self.__transaction() as connection:
+            now = time.time()
+            levels = {}
+            wait = 0.0
+            for name, capacity in self.capacities.items():
+                if not capacity:
+                    continue
+                level, updated = connection.execute(
+                    "SELECT level, updated FROM buckets WHERE name = ?", (name,)
+                ).fetchone() or (capacity, now)
+                level = min(capacity, level + (now - updated) * capacity / 60)
+                # A request larger than the bucket could never be sent, so it only waits for a full bucket.
+                demand = min(demands[name], capacity)
+                if level < demand:
+                    wait = max(wait, (demand - level) * 60 / capacity)
+                levels[name] = (level, demand)
+
+            for name, (level, demand) in levels.items():
+                connection.execute(
+                    "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)",
+                    (name, level if wait else level - demand, now),
+                )
+
+        return wait
+
+    @contextmanager
+    def __transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run the enclosed statements in a transaction that holds the write lock of the database."""
+        connection = self.__get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def __get_connection(self) -> sqlite3.Connection:
+        """Return the database connection of the current thread."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+
+        return connection
+
+    def __create_table(self) -> None:
+        """Create the table of the buckets if it does not exist yet."""
+        self.__get_connection().execute(
+            "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """Return the rate limiter of the process, or None if both limits are disabled."""
+    global _rate_limiter  # pylint: disable=global-statement
+
+    if not LLM_REQUESTS_PER_MINUTE and not LLM_TOKENS_PER_MINUTE:
+        return None
+    path = Path(settings.LLM_RATE_LIMIT_PATH)
+    if _rate_limiter is None or _rate_limiter.path != path:
+        with _rate_limiter_lock:
+            if _rate_limiter is None or _rate_limiter.path != path:
+                _rate_limiter = RateLimiter(path)
+
+    return _rate_limiter
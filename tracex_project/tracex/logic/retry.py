@@ -0,0 +1,148 @@
+"""
+Provide retries with exponential backoff for requests to the OpenAI API.
+
+Rate limit errors (429), conflicts (409) and server errors (5xx) are transient, so a failed request is retried after a
+delay instead of aborting the whole extraction. If the API sends a Retry-After header, the delay is taken from there.
+Otherwise, the delay grows exponentially with every attempt and is randomized ("full jitter") so that concurrent
+callers do not retry in lockstep. Timeouts and connection errors have a separate, usually smaller, number of attempts,
+because a request that timed out once is likely to time out again.
+
+Functions:
+call_with_retry -- Call a function and retry it according to a retry policy.
+acall_with_retry -- Await a coroutine function and retry it according to a retry policy.
+
+Classes:
+RetryPolicy -- Dataclass for the configuration of retries.
+"""
+import asyncio
+import email.utils
+import random
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import openai
+
+from tracex.logic.constants import LLM_MAX_ATTEMPTS, LLM_MAX_TIMEOUT_ATTEMPTS
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = (408, 409, 429)
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Dataclass for the configuration of retries.
+
+    max_attempts -- Maximum number of attempts for rate limit, conflict and server errors.
+    max_timeout_attempts -- Maximum number of attempts for timeouts and connection errors.
+    initial_delay -- Upper bound of the delay in seconds before the first retry.
+    max_delay -- Upper bound of the delay in seconds before any retry, also applied to Retry-After headers.
+
+    Public Methods:
+    get_delay -- Return the delay before the next attempt, or None if the error must not be retried.
+    """
+
+    max_attempts: int = LLM_MAX_ATTEMPTS
+    max_timeout_attempts: int = LLM_MAX_TIMEOUT_ATTEMPTS
+    initial_delay: float = 1.0
+    max_delay: float = 60.0
+
+    def get_delay(self, attempt: int, error: Exception) -> Optional[float]:
+        """
+        Return the delay in seconds before the next attempt, or None if the error must not be retried.
+
+        Positional Arguments:
+        attempt -- Number of the attempt that failed, starting with 1.
+        error -- Exception raised by the failed attempt.
+        """
+        if isinstance(error, openai.APIConnectionError):
+            max_attempts = self.max_timeout_attempts
+        elif isinstance(error, openai.APIStatusError) and (
+            error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+        ):
+            max_attempts = self.max_attempts
+        else:
+            return None
+        if attempt >= max_attempts:
+            return None
+
+        retry_after = _get_retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+
+        return random.uniform(0, min(self.max_delay, self.initial_delay * 2 ** (attempt - 1)))
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def call_with_retry(func: Callable[[], T], retry_policy: Optional[RetryPolicy] = None) -> T:
+    """
+    Call a function and retry it according to a retry policy.
+
+    Positional Arguments:
+    func -- Function without arguments that sends the request.
+
+    Keyword Arguments:
+    retry_policy -- Retry policy to follow. Default is None, which uses the default retry policy.
+
+    Returns the result of the first successful call. Raises the error of the last attempt if all attempts fail.
+    """
+    retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+    attempt = 1
+    while True:
+        try:
+            return func()
+        except openai.APIError as error:
+            delay = retry_policy.get_delay(attempt, error)
+            if delay is None:
+                raise
+        time.sleep(delay)
+        attempt += 1
+
+
+async def acall_with_retry(
+    func: Callable[[], Awaitable[T]], retry_policy: Optional[RetryPolicy] = None
+) -> T:
+    """Await a coroutine function and retry it according to a retry policy. See call_with_retry for details."""
+    retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+    attempt = 1
+    while True:
+        try:
+            return await func()
+        except openai.APIError as error:
+            delay = retry_policy.get_delay(attempt, error)
+            if delay is None:
+                raise
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+def _get_retry_after(error: Exception) -> Optional[float]:
+    """Return the delay in seconds requested by the Retry-After headers of an error response, if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+
+    retry_after_ms = response.headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+
+    retry_after = response.headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, retry_date.timestamp() - time.time())
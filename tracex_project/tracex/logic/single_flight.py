@@ -0,0 +1,175 @@
+"""
+Provide single-flight coalescing of identical requests to the OpenAI API that are in flight at the same time.
+
+A response cache can only serve a request once an identical request has finished. When several runs process the same
+patient journey, or one run classifies repeated activity labels concurrently, identical requests are sent before the
+first one returns. With single flight, the first caller of a request key becomes the leader and sends the request,
+while all concurrent callers with the same key wait for the output of the leader. If the leader fails, the error is
+raised to all waiting callers as well, while a cancelled or interrupted leader hands the request over to one of the
+waiting callers, which sends it instead. Keys are released as soon as the leader finishes, so nothing is cached here.
+
+Waiting works across threads and event loops, since every flight is backed by a concurrent.futures.Future.
+
+Functions:
+get_single_flight -- Return the single-flight group of the process.
+
+Classes:
+Flight -- A single in-flight request as seen by one caller.
+SingleFlight -- Group of in-flight requests keyed by their request key.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+_single_flight: Optional["SingleFlight"] = None  # pylint: disable=invalid-name
+_single_flight_lock = threading.Lock()
+# Output published to the waiting callers when the leader was cancelled, so that one of them claims the key again.
+_LEADER_CANCELLED = object()
+
+
+class Flight:
+    """
+    A single in-flight request as seen by one caller.
+
+    The leader sends the request and publishes its output with set_result. All other callers follow the leader and
+    wait for that output. If the leader is cancelled, one of the followers becomes the leader and sends the request.
+
+    Public Methods:
+    set_result -- Publish the output of the leader to all waiting callers and return it.
+    follow -- Block until the leader finished, returning False if this caller became the leader instead.
+    afollow -- Wait without blocking the event loop until the leader finished, see follow.
+    result -- Return the output of the leader, or raise its error, once follow returned True.
+    """
+
+    def __init__(self, is_leader: bool, future: Future, rejoin: Optional[Callable[[], Tuple[bool, Future]]] = None):
+        self.is_leader = is_leader
+        self.future = future
+        self.rejoin = rejoin
+
+    def set_result(self, output: Any) -> Any:
+        """Publish the output of the leader to all waiting callers and return it."""
+        self.future.set_result(output)
+
+        return output
+
+    def follow(self) -> bool:
+        """
+        Block until the leader finished and return True, or raise the error of the leader.
+
+        If the leader was cancelled, the key is claimed again. Returns False if this caller became the leader, which
+        must then send the request and call set_result.
+        """
+        while self.future.result() is _LEADER_CANCELLED:
+            self.is_leader, self.future = self.rejoin()
+            if self.is_leader:
+                return False
+
+        return True
+
+    async def afollow(self) -> bool:
+        """Wait until the leader finished, see follow. Cancelling the caller does not cancel the other callers."""
+        while await asyncio.shield(asyncio.wrap_future(self.future)) is _LEADER_CANCELLED:
+            self.is_leader, self.future = self.rejoin()
+            if self.is_leader:
+                return False
+
+        return True
+
+    def result(self) -> Any:
+        """Return the output of the leader, or raise the error of the leader."""
+        return self.future.result()
+
+
+class SingleFlight:
+    """
+    Group of in-flight requests keyed by their request key.
+
+    Public Methods:
+    claim -- Join the flight of a request key, becoming its leader if there is none yet.
+    get_stats -- Return the number of requests that were coalesced with an in-flight request.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._flights: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def claim(self, key: Optional[str]) -> Iterator[Flight]:
+        """
+        Join the flight of a request key, becoming its leader if no identical request is in flight.
+
+        The leader must call set_result before leaving the context. If the leader leaves the context with an error,
+        the error is raised to all waiting callers. If the leader is cancelled or interrupted, the waiting callers
+        claim the key again instead, since the cancellation says nothing about the request. A key of None never
+        coalesces, so the caller is always the leader.
+
+        Positional Arguments:
+        key -- Key of the request, see tracex.logic.llm_cache.make_key.
+        """
+        if key is None:
+            yield Flight(True, Future())
+
+            return
+
+        is_leader, future = self.__join(key)
+        if not is_leader:
+            with self._lock:
+                self.coalesced += 1
+        flight = Flight(is_leader, future, lambda: self.__join(key))
+
+        outcome = None
+        try:
+            yield flight
+        except Exception as error:
+            outcome = error
+            raise
+        except BaseException:
+            outcome = _LEADER_CANCELLED
+            raise
+        finally:
+            if flight.is_leader:
+                self.__land(key, flight.future, outcome)
+
+    def __join(self, key: str) -> Tuple[bool, Future]:
+        """Return whether the caller leads the flight of a key, creating the flight if there is none, and its future."""
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                return False, future
+            future = Future()
+            self._flights[key] = future
+
+            return True, future
+
+    def __land(self, key: str, future: Future, outcome: Any) -> None:
+        """Release the key of a flight and wake its waiting callers, if the leader did not publish a result."""
+        with self._lock:
+            del self._flights[key]
+        if future.done():
+            return
+        if outcome is _LEADER_CANCELLED:
+            future.set_result(_LEADER_CANCELLED)
+        elif outcome is not None:
+            future.set_exception(outcome)
+        else:
+            future.set_exception(RuntimeError(f"The leader of request {key} returned without a result."))
+
+    def get_stats(self) -> Dict[str, int]:
+        """Return the number of requests of this process that were coalesced with an in-flight request."""
+        with self._lock:
+            return {"coalesced_requests": self.coalesced}
+
+
+def get_single_flight() -> SingleFlight:
+    """Return the single-flight group of the process."""
+    global _single_flight  # pylint: disable=global-statement
+
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+
+    return _single_flight
@@ -0,0 +1,282 @@
+"""
+Provide a preflight check of the prompt size and a token budget for extraction runs.
+
+Before a request is sent, its prompt tokens are counted with the offline tokenizer. A request that does not fit into
+the context window of the model together with its maximum number of completion tokens is either truncated or
+rejected, depending on the overflow setting, instead of failing at the API.
+
+A token budget limits the tokens of one extraction run. The orchestrator activates a budget for the duration of a run,
+and every request sent during the run reserves its worst-case number of tokens from the budget before it is sent. The
+reservation is settled with the actual usage once the response arrives. Requests that would exceed the budget are
+rejected, and the orchestrator checks the budget before starting each module. The budget reports the used tokens, the
+worst-case tokens of the requests sent so far and the estimated cost in US dollars, in total and per module.
+
+Functions:
+preflight -- Count the prompt tokens of a request and make sure the request fits into the context window.
+estimate_cost -- Estimate the cost of a number of prompt and completion tokens in US dollars.
+get_token_budget -- Return the token budget that is active in the current context, or None.
+use_token_budget -- Context manager that activates a token budget for the enclosed requests.
+
+Classes:
+PromptTooLongError -- Error raised when a prompt exceeds the context window and must not be truncated.
+TokenBudgetExceededError -- Error raised when a request or module would exceed the token budget of a run.
+TokenBudget -- Thread-safe token budget of a single extraction run.
+StageTokenBudget -- View of a token budget that attributes all requests to one stage.
+"""
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from tracex.logic.constants import (
+    LLM_COMPLETION_TOKEN_PRICE,
+    LLM_CONTEXT_WINDOW,
+    LLM_PROMPT_OVERFLOW,
+    LLM_PROMPT_TOKEN_PRICE,
+    LLM_RUN_TOKEN_BUDGET,
+)
+from tracex.logic.tokenizer import count_message_tokens, truncate_messages
+
+_token_budget: ContextVar[Optional["TokenBudget"]] = ContextVar("token_budget", default=None)
+
+
+class PromptTooLongError(ValueError):
+    """Error raised when a prompt exceeds the context window and must not be truncated."""
+
+
+class TokenBudgetExceededError(Exception):
+    """Error raised when a request or module would exceed the token budget of a run."""
+
+
+def preflight(
+    messages: List[Dict[str, str]],
+    max_tokens: int,
+    overflow: str = LLM_PROMPT_OVERFLOW,
+) -> Tuple[List[Dict[str, str]], int]:
+    """
+    Count the prompt tokens of a request and make sure the request fits into the context window.
+
+    Positional Arguments:
+    messages -- List of chat messages in the format expected by query_gpt.
+    max_tokens -- Maximum number of completion tokens of the request.
+
+    Keyword Arguments:
+    overflow -- Either "truncate" to shorten the longest message or "reject" to raise a PromptTooLongError if the
+                request does not fit. Default is specified as a constant.
+
+    Returns the messages to send, which are truncated if necessary, and their number of prompt tokens.
+    """
+    prompt_tokens = count_message_tokens(messages)
+    max_prompt_tokens = LLM_CONTEXT_WINDOW - max_tokens
+    if prompt_tokens <= max_prompt_tokens:
+        return messages, prompt_tokens
+
+    if overflow != "truncate":
+        raise PromptTooLongError(
+            f"The prompt has {prompt_tokens} tokens, but only {max_prompt_tokens} tokens fit into the context window "
+            f"together with {max_tokens} completion tokens."
+        )
+    try:
+        messages = truncate_messages(messages, max_prompt_tokens)
+    except ValueError as error:
+        raise PromptTooLongError(str(error)) from error
+
+    return messages, count_message_tokens(messages)
+
+
+def estimate_cost(prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimate the cost of a number of prompt and completion tokens in US dollars."""
+    return (
+        prompt_tokens * LLM_PROMPT_TOKEN_PRICE + completion_tokens * LLM_COMPLETION_TOKEN_PRICE
+    ) / 1_000_000
+
+
+class TokenBudget:
+    """
+    Thread-safe token budget of a single extraction run.
+
+    A limit of 0 makes the budget unlimited, so that it only reports the usage.
+
+    Public Methods:
+    start_stage -- Check that the budget is not used up and attribute the following requests to a stage.
+    for_stage -- Return a view of the budget that attributes its requests to a stage.
+    reserve -- Reserve the worst-case number of tokens of a request.
+    settle -- Replace a reservation with the actual usage of the request.
+    get_report -- Return the used and worst-case tokens and the estimated cost of the run.
+    """
+
+    def __init__(self, limit: int = LLM_RUN_TOKEN_BUDGET):
+        self.limit = limit
+        self.reserved_tokens = 0
+        self.stage = None
+        self.stages: Dict[Optional[str], Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def used_tokens(self) -> int:
+        """Return the number of tokens used by all settled requests."""
+        return sum(stage["prompt_tokens"] + stage["completion_tokens"] for stage in self.stages.values())
+
+    @property
+    def remaining_tokens(self) -> Optional[int]:
+        """Return the number of tokens that are neither used nor reserved, or None if the budget is unlimited."""
+        if not self.limit:
+            return None
+
+        return max(0, self.limit - self.used_tokens - self.reserved_tokens)
+
+    def start_stage(self, name: str) -> None:
+        """Check that the budget is not used up and attribute the following requests to the stage with the name."""
+        with self._lock:
+            if self.limit and self.used_tokens >= self.limit:
+                raise TokenBudgetExceededError(
+                    f"The token budget of {self.limit} tokens is used up before '{name}'."
+                )
+            self.stage = name
+
+    def for_stage(self, name: str) -> "StageTokenBudget":
+        """
+        Return a view of the budget that attributes its requests to the stage with the name, regardless of the current
+        stage. Used for stages that run at the same time as other stages.
+        """
+        return StageTokenBudget(self, name)
+
+    def reserve(self, prompt_tokens: int, max_tokens: int, stage: Optional[str] = None) -> int:
+        """
+        Reserve the worst-case number of tokens of a request, or raise an error if they exceed the budget.
+
+        Positional Arguments:
+        prompt_tokens -- Number of prompt tokens of the request.
+        max_tokens -- Maximum number of completion tokens of the request.
+
+        Keyword Arguments:
+        stage -- Name of the stage of the request. Default is None, which uses the current stage.
+
+        Returns the number of reserved tokens, which must be passed to settle.
+        """
+        tokens = prompt_tokens + max_tokens
+        with self._lock:
+            if self.limit and self.used_tokens + self.reserved_tokens + tokens > self.limit:
+                raise TokenBudgetExceededError(
+                    f"A request of up to {tokens} tokens exceeds the token budget of {self.limit} tokens, "
+                    f"of which {self.used_tokens} are used and {self.reserved_tokens} are reserved."
+                )
+            self.reserved_tokens += tokens
+            stage = self.__get_stage(stage)
+            stage["worst_case_prompt_tokens"] += prompt_tokens
+            stage["worst_case_completion_tokens"] += max_tokens
+
+        return tokens
+
+    def settle(self, reserved_tokens: int, usage: Any = None, stage: Optional[str] = None) -> None:
+        """
+        Replace a reservation with the actual usage of the request.
+
+        Positional Arguments:
+        reserved_tokens -- Number of tokens that were reserved for the request.
+
+        Keyword Arguments:
+        usage -- Usage of the chat completion. Default is None, which releases the reservation of a failed request.
+        stage -- Name of the stage of the request. Default is None, which uses the current stage.
+        """
+        with self._lock:
+            self.reserved_tokens -= reserved_tokens
+            stage = self.__get_stage(stage)
+            if usage is None:
+                stage["failed_requests"] += 1
+                return
+            stage["requests"] += 1
+            stage["prompt_tokens"] += usage.prompt_tokens
+            stage["completion_tokens"] += usage.completion_tokens
+
+    def get_report(self) -> Dict[str, Any]:
+        """
+        Return the used and worst-case tokens and the estimated cost of the run, in total and per stage.
+
+        The worst-case tokens are the prompt and maximum completion tokens of all sent requests, which is what the run
+        may cost at most for the requests it made. They only cover requests that were already sent, so they are no
+        forecast of the whole run: modules and requests that have not started yet are not included.
+        """
+        with self._lock:
+            stages = {name: dict(stage) for name, stage in self.stages.items()}
+        for stage in stages.values():
+            stage["estimated_cost"] = estimate_cost(stage["prompt_tokens"], stage["completion_tokens"])
+            stage["worst_case_cost"] = estimate_cost(
+                stage["worst_case_prompt_tokens"], stage["worst_case_completion_tokens"]
+            )
+        prompt_tokens = sum(stage["prompt_tokens"] for stage in stages.values())
+        completion_tokens = sum(stage["completion_tokens"] for stage in stages.values())
+        worst_case_prompt_tokens = sum(stage["worst_case_prompt_tokens"] for stage in stages.values())
+        worst_case_completion_tokens = sum(stage["worst_case_completion_tokens"] for stage in stages.values())
+
+        return {
+            "token_budget": self.limit or None,
+            "requests": sum(stage["requests"] for stage in stages.values()),
+            "failed_requests": sum(stage["failed_requests"] for stage in stages.values()),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "used_tokens": prompt_tokens + completion_tokens,
+            "worst_case_tokens": worst_case_prompt_tokens + worst_case_completion_tokens,
+            "estimated_cost": estimate_cost(prompt_tokens, completion_tokens),
+            "worst_case_cost": estimate_cost(worst_case_prompt_tokens, worst_case_completion_tokens),
+            "stages": stages,
+        }
+
+    def __get_stage(self, name: Optional[str] = None) -> Dict[str, int]:
+        """Return the counters of the stage, by default the current one. Must be called while holding the lock."""
+        return self.stages.setdefault(
+            self.stage if name is None else name,
+            {
+                "requests": 0,
+                "failed_requests": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "worst_case_prompt_tokens": 0,
+                "worst_case_completion_tokens": 0,
+            },
+        )
+
+
+class StageTokenBudget:
+    """
+    View of a token budget that attributes all requests to one stage.
+
+    The view is activated with use_token_budget instead of the budget itself, so that the requests of stages running at
+    the same time are reported separately while counting against the same budget.
+
+    Public Methods:
+    reserve -- Reserve the worst-case number of tokens of a request for the stage.
+    settle -- Replace a reservation of the stage with the actual usage of the request.
+    """
+
+    def __init__(self, token_budget: TokenBudget, stage: str):
+        self.token_budget = token_budget
+        self.stage = stage
+
+    def reserve(self, prompt_tokens: int, max_tokens: int) -> int:
+        """Reserve the worst-case number of tokens of a request for the stage, see TokenBudget.reserve."""
+        return self.token_budget.reserve(prompt_tokens, max_tokens, stage=self.stage)
+
+    def settle(self, reserved_tokens: int, usage: Any = None) -> None:
+        """Replace a reservation of the stage with the actual usage of the request, see TokenBudget.settle."""
+        self.token_budget.settle(reserved_tokens, usage, stage=self.stage)
+
+
+def get_token_budget() -> Optional[TokenBudget]:
+    """Return the token budget that is active in the current context, or None if no budget is active."""
+    return _token_budget.get()
+
+
+@contextmanager
+def use_token_budget(token_budget: Optional[TokenBudget]) -> Iterator[Optional[TokenBudget]]:
+    """
+    Activate a token budget for all requests sent within the context.
+
+    The budget is stored in a context variable, so it applies to the current thread and to all asyncio tasks created
+    within the context.
+    """
+    context_token = _token_budget.set(token_budget)
+    try:
+        yield token_budget
+    finally:
+        _token_budget.reset(context_token)
@@ -0,0 +1,119 @@
+"""
+Provide token counting for requests to the OpenAI API that works without network access.
+
+If tiktoken is installed and its encoding for the model is available locally, prompts are counted exactly. Otherwise,
+the bundled tokenizer is used. It splits text with the pre-tokenization pattern of the cl100k_base encoding used by
+gpt-3.5-turbo and counts every piece by its length. Since the counts are used to keep requests within the context
+window and the budget, the approximation fails closed: its count is raised by a safety margin, so that rare words and
+names split into more tokens than estimated do not lead to an undercount.
+
+Functions:
+count_tokens -- Count the tokens of a text.
+count_message_tokens -- Count the prompt tokens of a list of chat messages.
+truncate_messages -- Truncate the longest message so that the messages fit into a number of prompt tokens.
+"""
+import functools
+import math
+from typing import Callable, Dict, List, Optional
+
+import regex as re
+
+from tracex.logic.constants import MODEL
+
+# Pre-tokenization pattern of the cl100k_base encoding.
+PRE_TOKENIZATION_PATTERN = re.compile(
+    r"""(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]+[\r\n]*"""
+    r"""|\s*[\r\n]+|\s+(?!\S)|\s+"""
+)
+APPROXIMATION_MARGIN = 1.1
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+TRUNCATION_MARKER = " [...]"
+
+
+@functools.lru_cache(maxsize=None)
+def _get_exact_encoder() -> Optional[Callable[[str], List[int]]]:
+    """Return the encode function of tiktoken for the model, or None if tiktoken or its encoding is unavailable."""
+    try:
+        import tiktoken  # pylint: disable=import-outside-toplevel
+
+        return tiktoken.encoding_for_model(MODEL).encode
+    except Exception:  # pylint: disable=broad-except
+        # tiktoken is optional and downloads encodings on first use, which fails without network access.
+        return None
+
+
+def _count_piece(piece: str) -> int:
+    """Estimate the tokens of a single pre-tokenized piece."""
+    letters = piece.lstrip()
+    if not letters or not letters[-1].isalpha():
+        return max(1, math.ceil(len(piece) / 2)) if piece.strip() else 1
+
+    # Common words up to 8 letters are single tokens, longer and rarer words are split into pieces.
+    return 1 + (len(letters) - 1) // 8
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens of a text, exactly if tiktoken is available and approximately with a safety margin otherwise."""
+    if not text:
+        return 0
+    encode = _get_exact_encoder()
+    if encode is not None:
+        return len(encode(text))
+
+    approximate_tokens = sum(_count_piece(piece) for piece in PRE_TOKENIZATION_PATTERN.findall(text))
+
+    return math.ceil(approximate_tokens * APPROXIMATION_MARGIN)
+
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """
+    Count the prompt tokens of a list of chat messages.
+
+    Every message adds a few tokens for its role and delimiters, and every reply is primed with a few more tokens.
+    """
+    tokens = TOKENS_PER_REPLY
+    for message in messages:
+        tokens += TOKENS_PER_MESSAGE
+        for value in message.values():
+            tokens += count_tokens(value or "")
+
+    return tokens
+
+
+def truncate_messages(messages: List[Dict[str, str]], max_prompt_tokens: int) -> List[Dict[str, str]]:
+    """
+    Truncate the end of the longest message so that the messages fit into a number of prompt tokens.
+
+    The instructions of a prompt are short compared to the Patient Journey it contains, so only the longest message is
+    shortened. The messages passed in are not modified.
+
+    Positional Arguments:
+    messages -- List of chat messages in the format expected by query_gpt.
+    max_prompt_tokens -- Maximum number of prompt tokens of the truncated messages.
+
+    Returns a copy of the messages. Raises a ValueError if the messages do not fit even without the longest message.
+    """
+    excess_tokens = count_message_tokens(messages) - max_prompt_tokens
+    if excess_tokens <= 0:
+        return messages
+
+    index = max(range(len(messages)), key=lambda i: len(messages[i].get("content") or ""))
+    content = messages[index].get("content") or ""
+    available_tokens = count_tokens(content) - excess_tokens - count_tokens(TRUNCATION_MARKER)
+    if available_tokens <= 0:
+        raise ValueError(f"The messages do not fit into {max_prompt_tokens} prompt tokens.")
+
+    # Binary search for the longest prefix of the content that fits into the available tokens.
+    low, high = 0, len(content)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(content[:middle]) <= available_tokens:
+            low = middle
+        else:
+            high = middle - 1
+
+    truncated_messages = [dict(message) for message in messages]
+    truncated_messages[index]["content"] = content[:low] + TRUNCATION_MARKER
+
+    return truncated_messages
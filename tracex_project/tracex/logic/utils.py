@@ -3,18 +3,27 @@ Provide various utility functions for the project.
 
 Functions:
 query_gpt -- Send a request to the OpenAI API and return the response.
+aquery_gpt -- Send a request to the OpenAI API asynchronously and return the response.
+gather_gpt -- Send several requests to the OpenAI API concurrently and return the responses in order.
+submit_gpt -- Schedule a coroutine sending requests to the OpenAI API without waiting for it.
+get_results -- Wait for scheduled coroutines and return their results, cancelling the others if one fails.
+stream_gpt -- Send a streamed request to the OpenAI API and yield the response as it arrives.
 get_snippet_bounds -- Extract bounds for a snippet for a given activity index.
+get_snippet -- Extract the snippet of a Patient Journey around a given sentence.
 
 Classes:
 Conversion -- Groups all functions related to conversions of DataFrames.
 DataFrameUtilities -- Groups all functions related to DataFrame operations.
 """
+import asyncio
 import os
 import json
 from pathlib import Path
 import base64
 import tempfile
-from typing import Dict, List, Optional
+from concurrent.futures import Future
+from types import SimpleNamespace
+from typing import Any, Coroutine, Dict, Iterator, List, Optional
 
 import regex as re
 import pandas as pd
@@ -24,14 +33,21 @@ import requests
 
 from django.conf import settings
 from django.db.models import Q
-from openai import OpenAI
 
-from tracex.logic.logger import log_tokens_used
+from tracex.logic.llm_cache import CachedResponse, ResponseCache, get_cache, make_key
+from tracex.logic.llm_backend import get_backend
+from tracex.logic.llm_client import run_coroutine, submit_coroutine
+from tracex.logic.logger import get_caller, log_tokens_saved, log_tokens_used, use_caller
+from tracex.logic.rate_limiter import get_rate_limiter
+from tracex.logic.retry import acall_with_retry, call_with_retry
+from tracex.logic.single_flight import get_single_flight
+from tracex.logic.token_budget import get_token_budget, preflight, use_token_budget
+from tracex.logic.tokenizer import count_tokens
 from tracex.logic.constants import (
+    LLM_CONCURRENCY,
     MAX_TOKENS,
     TEMPERATURE_SUMMARIZING,
     MODEL,
-    OAIK,
     SNOMED_CT_API_URL,
     SNOMED_CT_PARAMS,
     SNOMED_CT_HEADERS,
@@ -39,6 +55,8 @@ from tracex.logic.constants import (
 
 from extraction.models import Trace
 
+TOKENS_USED_LOG_PATH = Path(settings.BASE_DIR / "tracex/logs/tokens_used.log")
+
 
 def query_gpt(
         messages,
@@ -46,11 +64,22 @@ def query_gpt(
         temperature=TEMPERATURE_SUMMARIZING,
         return_linear_probability=False,
         top_logprobs=None,
+        *,
+        timeout=None,
+        use_cache=True,
+        retry_policy=None,
 ):
     """
     Make a request to the OpenAI API.
 
-    Makes a request to the OpenAI API with a custom interface to the chat completion endpoint.
+    Makes a request to the OpenAI API with a custom interface to the chat completion endpoint. Prompts that do not fit
+    into the context window are truncated or rejected before sending, and requests count against the token budget of
+    the current extraction run, if one is active. If the response cache is enabled, requests with a temperature of 0
+    are served from the cache whenever an identical request was made before, and identical requests with a
+    temperature of 0 that are in flight at the same time are sent only once. Requests to the API wait for the shared
+    rate limiter if the requests or tokens per minute are used up. Transient errors, like rate limit errors, server
+    errors and timeouts, are retried according to the retry policy. The request is answered by the configured backend,
+    which is the OpenAI API unless recording, replay or a stub is configured.
 
     Positional Arguments:
     messages -- List of messages to send to the GPT engine. Messages must be in the following format:
@@ -65,28 +94,353 @@ def query_gpt(
                     to return at each token position, each with an associated log probability.
                     The return_linear_probability flag must be set to true if this parameter is used.
                     Default is None.
+    timeout -- Timeout in seconds for this request. Default is None, which uses the timeout of the pooled client.
+    use_cache -- Boolean flag to allow serving the request from the response cache. Default is True.
+    retry_policy -- Retry policy for failed requests. Default is None, which uses the default retry policy.
 
     Returns the chat completions response from the OpenAI API. Additionally, if return_linear_probability is True and
     top_logprobs is specified, returns the linear probability of the output.
     """
+    messages, prompt_tokens = preflight(messages, max_tokens)
+    cache, cache_key = _get_cache_and_key(
+        messages,
+        max_tokens,
+        temperature,
+        use_cache=use_cache,
+        return_linear_probability=return_linear_probability,
+        top_logprobs=top_logprobs,
+    )
 
-    @log_tokens_used(Path(settings.BASE_DIR / "tracex/logs/tokens_used.log"))
+    @log_tokens_used(TOKENS_USED_LOG_PATH)
     def make_api_call():
-        """Make API Call to the chat completion endpoint."""
-        client = OpenAI(api_key=OAIK)
-        _response = client.chat.completions.create(
+        """Make API Call to the chat completion endpoint, waiting for the rate limiter before every attempt."""
+        backend = get_backend()
+        rate_limiter = get_rate_limiter() if backend.uses_rate_limit else None
+        token_budget = get_token_budget()
+        reserved_tokens = prompt_tokens + max_tokens
+
+        def send_request():
+            if rate_limiter is not None:
+                rate_limiter.acquire(reserved_tokens)
+            used_tokens = 0
+            try:
+                _response = backend.create(
+                    timeout=timeout,
+                    model=MODEL,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    logprobs=return_linear_probability,
+                    top_logprobs=top_logprobs,
+                )
+                used_tokens = _response.usage.total_tokens
+            finally:
+                # A failed attempt uses no tokens, so its whole reservation is returned before the retry.
+                if rate_limiter is not None:
+                    rate_limiter.settle(reserved_tokens, used_tokens)
+
+            return _response
+
+        reserved_budget = token_budget.reserve(prompt_tokens, max_tokens) if token_budget is not None else 0
+        response = None
+        try:
+            response = call_with_retry(send_request, retry_policy)
+        finally:
+            if token_budget is not None:
+                token_budget.settle(reserved_budget, None if response is None else response.usage)
+
+        return response
+
+    with get_single_flight().claim(cache_key) as flight:
+        if not flight.is_leader and flight.follow():
+            return flight.result()
+        if cache is not None:
+            cached_response = cache.get(cache_key)
+            if cached_response is not None:
+                log_tokens_saved(
+                    TOKENS_USED_LOG_PATH,
+                    cached_response.prompt_tokens + cached_response.completion_tokens,
+                    cache.get_stats(),
+                )
+
+                return flight.set_result(_get_cached_output(cached_response, return_linear_probability))
+
+        response = make_api_call()
+        output = _get_output(response, return_linear_probability)
+        if cache is not None:
+            _put_output(cache, cache_key, response, output, return_linear_probability)
+
+        return flight.set_result(output)
+
+
+async def aquery_gpt(
+        messages,
+        max_tokens=MAX_TOKENS,
+        temperature=TEMPERATURE_SUMMARIZING,
+        return_linear_probability=False,
+        top_logprobs=None,
+        *,
+        timeout=None,
+        use_cache=True,
+        retry_policy=None,
+):
+    """
+    Make a request to the OpenAI API asynchronously.
+
+    This is the coroutine counterpart of query_gpt and accepts the same arguments. The pooled asynchronous client of
+    the running event loop is used. Use gather_gpt to send several requests from synchronous code. The response cache
+    and the rate limiter wait for locks of their SQLite databases, so they are accessed in threads, which keeps other
+    requests on the shared event loop going while a lock is held.
+    """
+    messages, prompt_tokens = preflight(messages, max_tokens)
+    cache, cache_key = _get_cache_and_key(
+        messages,
+        max_tokens,
+        temperature,
+        use_cache=use_cache,
+        return_linear_probability=return_linear_probability,
+        top_logprobs=top_logprobs,
+    )
+
+    @log_tokens_used(TOKENS_USED_LOG_PATH)
+    async def make_api_call():
+        """Make API Call to the chat completion endpoint, waiting for the rate limiter before every attempt."""
+        backend = get_backend()
+        rate_limiter = get_rate_limiter() if backend.uses_rate_limit else None
+        token_budget = get_token_budget()
+        reserved_tokens = prompt_tokens + max_tokens
+
+        async def send_request():
+            if rate_limiter is not None:
+                await rate_limiter.aacquire(reserved_tokens)
+            used_tokens = 0
+            try:
+                _response = await backend.acreate(
+                    timeout=timeout,
+                    model=MODEL,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    logprobs=return_linear_probability,
+                    top_logprobs=top_logprobs,
+                )
+                used_tokens = _response.usage.total_tokens
+            finally:
+                # A failed attempt uses no tokens, so its whole reservation is returned before the retry.
+                if rate_limiter is not None:
+                    await rate_limiter.asettle(reserved_tokens, used_tokens)
+
+            return _response
+
+        reserved_budget = token_budget.reserve(prompt_tokens, max_tokens) if token_budget is not None else 0
+        response = None
+        try:
+            response = await acall_with_retry(send_request, retry_policy)
+        finally:
+            if token_budget is not None:
+                token_budget.settle(reserved_budget, None if response is None else response.usage)
+
+        return response
+
+    with get_single_flight().claim(cache_key) as flight:
+        if not flight.is_leader and await flight.afollow():
+            return flight.result()
+        if cache is not None:
+            cached_response = await asyncio.to_thread(cache.get, cache_key)
+            if cached_response is not None:
+                log_tokens_saved(
+                    TOKENS_USED_LOG_PATH,
+                    cached_response.prompt_tokens + cached_response.completion_tokens,
+                    cache.get_stats(),
+                )
+
+                return flight.set_result(_get_cached_output(cached_response, return_linear_probability))
+
+        response = await make_api_call()
+        output = _get_output(response, return_linear_probability)
+        if cache is not None:
+            await asyncio.to_thread(_put_output, cache, cache_key, response, output, return_linear_probability)
+
+        return flight.set_result(output)
+
+
+def gather_gpt(messages_list: List[List[Dict[str, str]]], concurrency: int = LLM_CONCURRENCY, **kwargs) -> List[Any]:
+    """
+    Make several requests to the OpenAI API concurrently.
+
+    The requests run on the background event loop, at most concurrency of them at the same time. The wall-clock time
+    therefore depends on the slowest requests instead of the number of requests.
+
+    Positional Arguments:
+    messages_list -- List of message lists, each in the format expected by query_gpt.
+
+    Keyword Arguments:
+    concurrency -- Maximum number of requests in flight at the same time. Default is specified as a constant.
+    kwargs -- Keyword arguments passed to every request, see query_gpt.
+
+    Returns a list with one output per message list, in the order of messages_list. If any request fails, the other
+    requests are cancelled and the first exception is raised.
+    """
+
+    token_budget = get_token_budget()
+    caller = get_caller()
+
+    async def gather():
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def bounded_query(messages):
+            async with semaphore:
+                return await aquery_gpt(messages, **kwargs)
+
+        # The requests run on the background event loop, so the token budget and the caller are passed on explicitly.
+        with use_token_budget(token_budget), use_caller(caller):
+            tasks = [asyncio.ensure_future(bounded_query(messages)) for messages in messages_list]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            # The outputs are discarded once a request failed, so the other requests must not keep using tokens.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    if not messages_list:
+        return []
+
+    return run_coroutine(gather())
+
+
+def submit_gpt(coroutine: Coroutine, semaphore: Optional[asyncio.Semaphore] = None) -> Future:
+    """
+    Schedule a coroutine that makes requests to the OpenAI API on the background event loop without waiting for it.
+
+    This allows issuing requests as soon as their input is known, e.g. while a streamed response is still arriving.
+    The coroutine runs within the token budget of the caller, and its requests are logged as made by the caller.
+    Database queries must not happen inside the coroutine, since it runs in an asynchronous context.
+
+    Positional Arguments:
+    coroutine -- Coroutine to run, usually awaiting one or more calls of aquery_gpt.
+
+    Keyword Arguments:
+    semaphore -- Semaphore shared by the coroutines submitted by one execution, e.g. created with
+                 asyncio.Semaphore(LLM_CONCURRENCY), that limits how many of them run at the same time. Default is
+                 None, which does not limit them.
+
+    Returns a future with the result of the coroutine.
+    """
+    token_budget = get_token_budget()
+    caller = get_caller()
+
+    async def bounded_run():
+        if semaphore is None:
+            with use_token_budget(token_budget), use_caller(caller):
+                return await coroutine
+        async with semaphore:
+            with use_token_budget(token_budget), use_caller(caller):
+                return await coroutine
+
+    return submit_coroutine(bounded_run())
+
+
+def get_results(futures: List[Future]) -> List[Any]:
+    """
+    Wait for futures of submit_gpt and return their results in order.
+
+    If a future fails, the futures that did not finish yet are cancelled before the exception is raised, so that their
+    requests do not keep running and using tokens for a result that is discarded.
+    """
+    try:
+        return [future.result() for future in futures]
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+
+def stream_gpt(
+        messages,
+        max_tokens=MAX_TOKENS,
+        temperature=TEMPERATURE_SUMMARIZING,
+        *,
+        timeout=None,
+        use_cache=True,
+        retry_policy=None,
+) -> Iterator[str]:
+    """
+    Make a streamed request to the OpenAI API and yield the fragments of the response as they arrive.
+
+    Accepts the same arguments as query_gpt, except for the probabilities, and goes through the same preflight, cache,
+    rate limiter, token budget and retries. Only opening the stream is retried. Since streamed responses do not report
+    their usage, the completion tokens are counted with the tokenizer. A response served from the cache is yielded as
+    a single fragment.
+
+    Positional Arguments:
+    messages -- List of messages to send to the GPT engine, see query_gpt.
+    """
+    messages, prompt_tokens = preflight(messages, max_tokens)
+    cache, cache_key = _get_cache_and_key(messages, max_tokens, temperature, use_cache=use_cache)
+    if cache is not None:
+        cached_response = cache.get(cache_key)
+        if cached_response is not None:
+            log_tokens_saved(
+                TOKENS_USED_LOG_PATH,
+                cached_response.prompt_tokens + cached_response.completion_tokens,
+                cache.get_stats(),
+            )
+            yield cached_response.content
+
+            return
+
+    backend = get_backend()
+    rate_limiter = get_rate_limiter() if backend.uses_rate_limit else None
+    token_budget = get_token_budget()
+    reserved_tokens = prompt_tokens + max_tokens
+
+    def open_stream():
+        if rate_limiter is not None:
+            rate_limiter.acquire(reserved_tokens)
+
+        return backend.stream(
+            timeout=timeout,
             model=MODEL,
             messages=messages,
             max_tokens=max_tokens,
             temperature=temperature,
-            logprobs=return_linear_probability,
-            top_logprobs=top_logprobs,
         )
 
-        return _response
-
-    response = make_api_call()
+    @log_tokens_used(TOKENS_USED_LOG_PATH)
+    def count_usage(content: str):
+        """Count the usage of the streamed response, which is logged by the decorator."""
+        completion_tokens = count_tokens(content)
+
+        return SimpleNamespace(
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+            )
+        )
 
+    reserved_budget = token_budget.reserve(prompt_tokens, max_tokens) if token_budget is not None else 0
+    response = None
+    fragments = []
+    try:
+        for fragment in call_with_retry(open_stream, retry_policy):
+            fragments.append(fragment)
+            yield fragment
+        response = count_usage("".join(fragments))
+    finally:
+        if rate_limiter is not None:
+            rate_limiter.settle(reserved_tokens, 0 if response is None else response.usage.total_tokens)
+        if token_budget is not None:
+            token_budget.settle(reserved_budget, None if response is None else response.usage)
+
+    if cache is not None:
+        _put_output(cache, cache_key, response, "".join(fragments), False)
+
+
+def _get_output(response, return_linear_probability: bool):
+    """Return the content of a chat completion and, if requested, the linear probability of its first token."""
     if return_linear_probability:
         top_logprobs = response.choices[0].logprobs.content[0].top_logprobs
         content = response.choices[0].message.content
@@ -102,6 +456,52 @@ def query_gpt(
     return output
 
 
+def _get_cache_and_key(
+        messages,
+        max_tokens: int,
+        temperature: float,
+        *,
+        use_cache: bool,
+        return_linear_probability: bool = False,
+        top_logprobs: Optional[int] = None,
+) -> tuple[Optional[ResponseCache], Optional[str]]:
+    """
+    Return the response cache and the key of a request.
+
+    Only requests with a temperature of 0 have a key, since only they may be cached or coalesced with identical
+    requests in flight. The cache is None if caching is disabled or not allowed for the request.
+    """
+    if temperature != 0:
+        return None, None
+    cache_key = make_key(messages, max_tokens, temperature, return_linear_probability, top_logprobs)
+
+    return get_cache() if use_cache else None, cache_key
+
+
+def _get_cached_output(cached_response: CachedResponse, return_linear_probability: bool):
+    """Return a cached response in the same format as _get_output."""
+    if return_linear_probability:
+        return cached_response.content, np.float64(cached_response.linear_probability)
+
+    return cached_response.content
+
+
+def _put_output(cache: ResponseCache, cache_key: str, response, output, return_linear_probability: bool) -> None:
+    """Store the output of a response in the response cache."""
+    content, linear_probability = output if return_linear_probability else (output, None)
+    if content is None:
+        return
+    cache.put(
+        cache_key,
+        CachedResponse(
+            content=content,
+            linear_probability=None if linear_probability is None else float(linear_probability),
+            prompt_tokens=response.usage.prompt_tokens,
+            completion_tokens=response.usage.completion_tokens,
+        ),
+    )
+
+
 def get_snippet_bounds(index: int, length: int) -> tuple[int, int]:
     """
     Calculate bounds for a sliding window to better extract time information.
@@ -126,6 +526,20 @@ def get_snippet_bounds(index: int, length: int) -> tuple[int, int]:
 
     return lower_bound, upper_bound
 
+
+def get_snippet(patient_journey_sentences: List[str], sentence_id: int) -> str:
+    """
+    Extract the snippet of a Patient Journey around a given sentence, see get_snippet_bounds.
+
+    Positional Arguments:
+    patient_journey_sentences -- Patient Journey as a list of sentences.
+    sentence_id -- Index of the sentence the snippet is centered on.
+    """
+    lower, upper = get_snippet_bounds(index=int(sentence_id), length=len(patient_journey_sentences))
+
+    return ". ".join(patient_journey_sentences[lower:upper])
+
+
 def get_snomed_ct_info(term):
     """Get the first matched name and code of a SNOMED CT term."""
     SNOMED_CT_PARAMS["term"] = term
@@ -131,3 +131,10 @@ STATICFILES_DIRS = [
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Rate limiting of the OpenAI API requests, shared by all processes using the same file
+
+LLM_RATE_LIMIT_PATH = BASE_DIR / "llm_rate_limit.sqlite3"
+
+TEST_RUNNER = "tracex.test_runner.TracexTestRunner"
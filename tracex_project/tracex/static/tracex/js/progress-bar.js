@@ -18,6 +18,12 @@ function updateProgressBar() {
             ${current_module ? `<div class="progress-container"><p>${current_module} is currently running</p></div>` : '<div class="progress-container"></div>'}
         `;
 
+            // Continue with the next page once a background extraction job is finished
+            if (data.redirect) {
+                window.location.href = data.redirect;
+                return;
+            }
+
             // If the task is not complete, continue checking for progress // hier muss data.progress rein
             if (data.progress === 100) {
                 // Hide the progress bar and show the result button
@@ -36,8 +42,15 @@ function updateProgressBar() {
     });
 }
 
-execute_button.addEventListener('click', () => {
+function showProgressBar() {
     progress_box.classList.remove('not_visible');
     progress_box.innerHTML = '<div class="spinner-border text-primary" role="status"><span class="visually-hidden"></span></div>';
     updateProgressBar();
-})
+}
+
+execute_button.addEventListener('click', showProgressBar)
+
+// Resume displaying the progress of a background extraction job after the page was reloaded
+if (progress_box.dataset.jobRunning === "true") {
+    showProgressBar();
+}
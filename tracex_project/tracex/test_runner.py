@@ -0,0 +1,32 @@
+"""
+Provide the test runner of the project.
+
+Classes:
+TracexTestRunner -- Test runner that keeps the state files of the OpenAI API requests apart from the application.
+"""
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TracexTestRunner(DiscoverRunner):
+    """
+    Test runner that keeps the state files of the OpenAI API requests apart from the application.
+
+    The rate limiter stores its buckets in a file shared by all processes using it, so tests running next to the
+    development server would use up its budget. During the tests, the file is kept in a temporary directory instead.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        # pylint: disable=attribute-defined-outside-init
+        self.temporary_directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.original_rate_limit_path = settings.LLM_RATE_LIMIT_PATH
+        settings.LLM_RATE_LIMIT_PATH = Path(self.temporary_directory.name) / "llm_rate_limit.sqlite3"
+
+    def teardown_test_environment(self, **kwargs):
+        settings.LLM_RATE_LIMIT_PATH = self.original_rate_limit_path
+        self.temporary_directory.cleanup()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,758 @@
+"""Test cases for the LLM call path."""
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+import httpx
+import openai
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+from extraction.models import PatientJourney
+from tracex.logic import llm_backend, llm_client
+from tracex.logic import logger, utils
+from tracex.logic.llm_backend import Cassette, CassetteMissError, StubServer
+from tracex.logic.llm_cache import CachedResponse, ResponseCache, make_key
+from tracex.logic.rate_limiter import RateLimiter, get_rate_limiter
+from tracex.logic.retry import RetryPolicy, call_with_retry
+from tracex.logic.single_flight import SingleFlight
+from tracex.logic.token_budget import (
+    PromptTooLongError,
+    TokenBudget,
+    TokenBudgetExceededError,
+    preflight,
+    use_token_budget,
+)
+from tracex.logic.tokenizer import count_message_tokens, count_tokens
+
+
+def make_completion(content: str, logprob: float = -0.1):
+    """Build an object with the attributes of a chat completion that are read by query_gpt."""
+    return SimpleNamespace(
+        choices=[
+            SimpleNamespace(
+                message=SimpleNamespace(content=content),
+                logprobs=SimpleNamespace(
+                    content=[SimpleNamespace(top_logprobs=[SimpleNamespace(logprob=logprob)])]
+                ),
+            )
+        ],
+        usage=SimpleNamespace(prompt_tokens=10, completion_tokens=2, total_tokens=12),
+    )
+
+
+class LlmClientTests(TestCase):
+    """Test cases for the pooled OpenAI client registry."""
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """Set up method that gets called everytime before tests are executed."""
+        self.previous_key = os.environ.get("OPENAI_API_KEY")
+        os.environ["OPENAI_API_KEY"] = "test-key"
+        llm_client.reset_clients()
+
+    def tearDown(self):  # pylint: disable=invalid-name
+        """Tear down method that gets called after every test is executed."""
+        llm_client.reset_clients()
+        if self.previous_key is None:
+            del os.environ["OPENAI_API_KEY"]
+        else:
+            os.environ["OPENAI_API_KEY"] = self.previous_key
+
+    def test_get_client_reuses_instance(self):
+        """Test if subsequent calls return the same pooled client."""
+        self.assertIs(llm_client.get_client(), llm_client.get_client())
+
+    def test_get_client_thread_safe(self):
+        """Test if concurrent first calls from several threads create only one client."""
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            clients = list(executor.map(lambda _: llm_client.get_client(), range(32)))
+
+        self.assertEqual(len({id(client) for client in clients}), 1)
+
+    def test_get_client_changes_with_api_key(self):
+        """Test if a new API key results in a new client."""
+        if llm_client.OAIK:
+            self.skipTest("API key is fixed by the environment at startup.")
+        first_client = llm_client.get_client()
+        os.environ["OPENAI_API_KEY"] = "other-key"
+
+        self.assertIsNot(first_client, llm_client.get_client())
+
+    def test_reset_clients(self):
+        """Test if reset_clients empties the registry."""
+        first_client = llm_client.get_client()
+        llm_client.reset_clients()
+
+        self.assertIsNot(first_client, llm_client.get_client())
+
+
+class GatherGptTests(TestCase):
+    """Test cases for sending several requests concurrently."""
+
+    def test_gather_gpt_keeps_order(self):
+        """Test if the outputs are returned in the order of the messages, even if later requests finish first."""
+
+        async def fake_query(messages, **_kwargs):
+            number = int(messages[0]["content"])
+            await asyncio.sleep(0.01 * (5 - number))
+            return number
+
+        with mock.patch("tracex.logic.utils.aquery_gpt", fake_query):
+            outputs = utils.gather_gpt([[{"role": "user", "content": str(i)}] for i in range(5)])
+
+        self.assertEqual(outputs, [0, 1, 2, 3, 4])
+
+    def test_gather_gpt_bounds_concurrency(self):
+        """Test if no more requests than the concurrency limit are in flight at the same time."""
+        in_flight = []
+        peak = []
+
+        async def fake_query(_messages, **_kwargs):
+            in_flight.append(None)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.pop()
+            return "N/A"
+
+        with mock.patch("tracex.logic.utils.aquery_gpt", fake_query):
+            utils.gather_gpt([[{"role": "user", "content": "x"}]] * 10, concurrency=3)
+
+        self.assertEqual(max(peak), 3)
+
+    def test_gather_gpt_propagates_errors(self):
+        """Test if an exception of a single request is raised in the caller."""
+
+        async def fake_query(_messages, **_kwargs):
+            raise ValueError("failed")
+
+        with mock.patch("tracex.logic.utils.aquery_gpt", fake_query):
+            with self.assertRaises(ValueError):
+                utils.gather_gpt([[{"role": "user", "content": "x"}]])
+
+    def test_gather_gpt_cancels_other_requests_on_error(self):
+        """Test if the requests still in flight are cancelled once a request fails."""
+        cancelled = []
+
+        async def fake_query(messages, **_kwargs):
+            if messages[0]["content"] == "fail":
+                await asyncio.sleep(0.01)
+                raise ValueError("failed")
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.append(messages[0]["content"])
+                raise
+
+        messages_list = [[{"role": "user", "content": content}] for content in ("first", "fail", "second")]
+        with mock.patch("tracex.logic.utils.aquery_gpt", fake_query):
+            with self.assertRaises(ValueError):
+                utils.gather_gpt(messages_list)
+
+        self.assertEqual(sorted(cancelled), ["first", "second"])
+
+    def test_gather_gpt_logs_caller(self):
+        """Test if the tokens of the requests are logged for the function that called gather_gpt."""
+
+        @logger.log_tokens_used(utils.TOKENS_USED_LOG_PATH)
+        async def fake_query(_messages, **_kwargs):
+            return SimpleNamespace(usage=SimpleNamespace(total_tokens=3, prompt_tokens=2, completion_tokens=1))
+
+        with mock.patch("tracex.logic.utils.aquery_gpt", fake_query), \
+                mock.patch.object(getLogger("token_logger"), "info") as log_info:
+            utils.gather_gpt([[{"role": "user", "content": "x"}]])
+
+        self.assertEqual(log_info.call_args.args[0]["calling_function_name"], "test_gather_gpt_logs_caller")
+
+    def test_gather_gpt_empty(self):
+        """Test if an empty list of messages returns an empty list without any request."""
+        self.assertEqual(utils.gather_gpt([]), [])
+
+
+class ResponseCacheTests(TestCase):
+    """Test cases for the persistent response cache."""
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """Set up method that gets called everytime before tests are executed."""
+        self.temp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.cache = ResponseCache(Path(self.temp_dir.name) / "cache.sqlite3", max_entries=2, ttl=60)
+        self.response = CachedResponse("Doctor Visit", None, 10, 2)
+
+    def tearDown(self):  # pylint: disable=invalid-name
+        """Tear down method that gets called after every test is executed."""
+        self.temp_dir.cleanup()
+
+    def test_make_key_depends_on_parameters(self):
+        """Test if the key is stable for identical requests and differs for different parameters."""
+        messages = [{"role": "user", "content": "fell ill"}]
+
+        self.assertEqual(make_key(messages, 100, 0, False, None), make_key(messages, 100, 0, False, None))
+        self.assertNotEqual(make_key(messages, 100, 0, False, None), make_key(messages, 100, 0, True, 1))
+        self.assertNotEqual(make_key(messages, 100, 0, False, None), make_key(messages, 200, 0, False, None))
+
+    def test_get_and_put(self):
+        """Test if a stored response is returned and hits and misses are counted."""
+        self.assertIsNone(self.cache.get("key"))
+        self.cache.put("key", self.response)
+
+        self.assertEqual(self.cache.get("key"), self.response)
+        self.assertEqual(self.cache.get_stats(), {"cache_hits": 1, "cache_misses": 1, "tokens_saved": 12})
+
+    def test_ttl_expiry(self):
+        """Test if an expired entry is not returned."""
+        self.cache.ttl = 0
+        self.cache.put("key", self.response)
+
+        with mock.patch("tracex.logic.llm_cache.time.time", return_value=10 ** 12):
+            self.assertIsNone(self.cache.get("key"))
+
+    def test_lru_eviction(self):
+        """Test if the least recently used entry is evicted when the cache is full."""
+        now = time.time()
+        with mock.patch("tracex.logic.llm_cache.time.time", side_effect=[now, now + 1, now + 2, now + 3]):
+            self.cache.put("first", self.response)
+            self.cache.put("second", self.response)
+            self.cache.get("first")
+            self.cache.put("third", self.response)
+
+        self.assertIsNotNone(self.cache.get("first"))
+        self.assertIsNone(self.cache.get("second"))
+        self.assertIsNotNone(self.cache.get("third"))
+
+    def test_query_gpt_uses_cache(self):
+        """Test if a repeated deterministic request is served from the cache, including the linear probability."""
+        backend = mock.MagicMock(uses_rate_limit=False)
+        backend.create.return_value = make_completion("True", logprob=-0.05)
+        messages = [{"role": "user", "content": "First: fever\nSecond: fever"}]
+
+        with mock.patch("tracex.logic.utils.get_cache", return_value=self.cache), \
+                mock.patch("tracex.logic.utils.get_backend", return_value=backend), \
+                mock.patch("tracex.logic.utils.log_tokens_used", return_value=lambda func: func), \
+                mock.patch("tracex.logic.utils.log_tokens_saved"):
+            first = utils.query_gpt(messages, return_linear_probability=True, top_logprobs=1)
+            second = utils.query_gpt(messages, return_linear_probability=True, top_logprobs=1)
+            utils.query_gpt(messages, temperature=1)
+            utils.query_gpt(messages, temperature=1)
+
+        self.assertEqual(first, second)
+        self.assertEqual(second[1], 0.95)
+        self.assertEqual(backend.create.call_count, 3)
+
+
+class RateLimiterTests(TestCase):
+    """Test cases for the token-bucket rate limiter."""
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """Set up method that gets called everytime before tests are executed."""
+        self.temp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.path = Path(self.temp_dir.name) / "rate_limit.sqlite3"
+
+    def tearDown(self):  # pylint: disable=invalid-name
+        """Tear down method that gets called after every test is executed."""
+        self.temp_dir.cleanup()
+
+    def test_acquire_without_waiting_while_budget_is_free(self):
+        """Test if requests within the budget are not delayed."""
+        rate_limiter = RateLimiter(self.path, requests_per_minute=10, tokens_per_minute=1000)
+
+        with mock.patch("tracex.logic.rate_limiter.time.sleep") as sleep:
+            for _ in range(10):
+                rate_limiter.acquire(100)
+
+        sleep.assert_not_called()
+
+    def test_acquire_waits_when_requests_are_used_up(self):
+        """Test if a request beyond the requests per minute waits for the bucket to refill."""
+        rate_limiter = RateLimiter(self.path, requests_per_minute=60, tokens_per_minute=0)
+        for _ in range(60):
+            rate_limiter.acquire(1)
+
+        with mock.patch("tracex.logic.rate_limiter.time.sleep", side_effect=time.sleep) as sleep:
+            rate_limiter.acquire(1)
+
+        self.assertGreater(sleep.call_args[0][0], 0)
+        self.assertLessEqual(sleep.call_args[0][0], 1)
+
+    def test_settle_returns_unused_tokens(self):
+        """Test if tokens that were reserved but not used are available again."""
+        rate_limiter = RateLimiter(self.path, requests_per_minute=0, tokens_per_minute=1000)
+        rate_limiter.acquire(1000)
+        rate_limiter.settle(1000, 100)
+
+        with mock.patch("tracex.logic.rate_limiter.time.sleep") as sleep:
+            rate_limiter.acquire(800)
+
+        sleep.assert_not_called()
+
+    def test_aacquire_does_not_block_event_loop_while_database_is_locked(self):
+        """Test if waiting for the lock of the database, held by another process, lets other coroutines run."""
+        rate_limiter = RateLimiter(self.path, requests_per_minute=10, tokens_per_minute=0)
+        other_process = sqlite3.connect(self.path, isolation_level=None)
+        other_process.execute("BEGIN IMMEDIATE")
+        ticks = []
+
+        async def tick():
+            for _ in range(5):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+            other_process.execute("COMMIT")
+
+        async def acquire_and_tick():
+            await asyncio.gather(rate_limiter.aacquire(1), tick())
+
+        started = time.monotonic()
+        asyncio.run(acquire_and_tick())
+        other_process.close()
+
+        self.assertEqual(len(ticks), 5)
+        self.assertLess(ticks[-1] - started, 1)
+
+    def test_budget_is_shared_between_instances(self):
+        """Test if two limiters on the same database, as in two worker processes, share one budget."""
+        first_limiter = RateLimiter(self.path, requests_per_minute=0, tokens_per_minute=600)
+        second_limiter = RateLimiter(self.path, requests_per_minute=0, tokens_per_minute=600)
+        first_limiter.acquire(600)
+
+        with mock.patch("tracex.logic.rate_limiter.time.sleep", side_effect=time.sleep) as sleep:
+            second_limiter.acquire(5)
+
+        sleep.assert_called()
+
+    def test_failed_attempts_return_their_reservation(self):
+        """Test if attempts failing with a rate limit error give back all reserved tokens before the retry."""
+        rate_limiter = mock.Mock(wraps=RateLimiter(self.path, requests_per_minute=0, tokens_per_minute=1000))
+        backend = mock.MagicMock(uses_rate_limit=True)
+        backend.create.side_effect = [
+            make_status_error(openai.RateLimitError, 429),
+            make_status_error(openai.RateLimitError, 429),
+            make_completion("True"),
+        ]
+
+        with mock.patch("tracex.logic.utils.get_backend", return_value=backend), \
+                mock.patch("tracex.logic.utils.get_rate_limiter", return_value=rate_limiter), \
+                mock.patch("tracex.logic.utils.log_tokens_used", return_value=lambda func: func), \
+                mock.patch("tracex.logic.retry.time.sleep"):
+            utils.query_gpt([{"role": "user", "content": "fever"}], max_tokens=100)
+
+        reserved_tokens = rate_limiter.acquire.call_args[0][0]
+        self.assertEqual(
+            rate_limiter.settle.call_args_list,
+            [mock.call(reserved_tokens, 0), mock.call(reserved_tokens, 0), mock.call(reserved_tokens, 12)],
+        )
+
+    def test_rate_limiter_uses_path_of_settings(self):
+        """Test if the rate limiter follows the path of the settings, which the tests keep out of the project."""
+        self.assertNotEqual(Path(settings.LLM_RATE_LIMIT_PATH).parent, Path(settings.BASE_DIR))
+
+        with override_settings(LLM_RATE_LIMIT_PATH=self.path):
+            self.assertEqual(get_rate_limiter().path, self.path)
+
+
+def make_status_error(error_class, status_code: int, headers=None):
+    """Build an OpenAI API error with a response of the given status code and headers."""
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status_code, headers=headers or {}, request=request)
+
+    return error_class("error", response=response, body=None)
+
+
+class RetryTests(TestCase):
+    """Test cases for retrying failed requests."""
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """Set up method that gets called everytime before tests are executed."""
+        self.policy = RetryPolicy(max_attempts=3, max_timeout_attempts=2, initial_delay=1, max_delay=10)
+
+    def test_retry_after_header_is_respected(self):
+        """Test if the delay is taken from the Retry-After header."""
+        error = make_status_error(openai.RateLimitError, 429, {"retry-after": "7"})
+
+        self.assertEqual(self.policy.get_delay(1, error), 7)
+
+    def test_retry_after_is_capped(self):
+        """Test if a Retry-After header beyond the maximum delay is capped."""
+        error = make_status_error(openai.RateLimitError, 429, {"retry-after": "600"})
+
+        self.assertEqual(self.policy.get_delay(1, error), 10)
+
+    def test_exponential_backoff_with_jitter(self):
+        """Test if the upper bound of the delay doubles with every attempt."""
+        error = make_status_error(openai.InternalServerError, 503)
+
+        with mock.patch("tracex.logic.retry.random.uniform", side_effect=lambda low, high: high):
+            delays = [self.policy.get_delay(attempt, error) for attempt in (1, 2)]
+
+        self.assertEqual(delays, [1, 2])
+
+    def test_client_errors_are_not_retried(self):
+        """Test if errors caused by the request itself are raised immediately."""
+        error = make_status_error(openai.BadRequestError, 400)
+
+        self.assertIsNone(self.policy.get_delay(1, error))
+
+    def test_call_with_retry_recovers_from_rate_limit(self):
+        """Test if a request succeeds after transient rate limit errors."""
+        func = mock.Mock(
+            side_effect=[
+                make_status_error(openai.RateLimitError, 429),
+                make_status_error(openai.RateLimitError, 429),
+                "response",
+            ]
+        )
+
+        with mock.patch("tracex.logic.retry.time.sleep") as sleep:
+            result = call_with_retry(func, self.policy)
+
+        self.assertEqual(result, "response")
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_timeouts_have_separate_attempts(self):
+        """Test if timeouts are only retried up to the number of timeout attempts."""
+        request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+        func = mock.Mock(side_effect=openai.APITimeoutError(request=request))
+
+        with mock.patch("tracex.logic.retry.time.sleep"):
+            with self.assertRaises(openai.APITimeoutError):
+                call_with_retry(func, self.policy)
+
+        self.assertEqual(func.call_count, 2)
+
+
+class LlmBackendTests(TestCase):
+    """Test cases for the record, replay and stub backends."""
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """Set up method that gets called everytime before tests are executed."""
+        self.temp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.cassette = Cassette(Path(self.temp_dir.name) / "cassette.jsonl")
+        self.stub_server = StubServer(content="Doctor Visit").start()
+        self.messages = [{"role": "user", "content": "went to the doctor"}]
+        self.patches = [
+            mock.patch("tracex.logic.utils.get_rate_limiter", return_value=None),
+            mock.patch("tracex.logic.utils.log_tokens_used", return_value=lambda func: func),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):  # pylint: disable=invalid-name
+        """Tear down method that gets called after every test is executed."""
+        for patch in self.patches:
+            patch.stop()
+        llm_backend.set_backend(None)
+        llm_client.reset_clients()
+        self.stub_server.stop()
+        self.temp_dir.cleanup()
+
+    def __record(self, **kwargs):
+        """Send a request to the stub server while recording it to the cassette."""
+        recording_backend = llm_backend.RecordingBackend(self.cassette)
+        recording_backend.base_url = self.stub_server.base_url
+        recording_backend.api_key = "stub"
+        llm_backend.set_backend(recording_backend)
+
+        return utils.query_gpt(self.messages, **kwargs)
+
+    def test_replay_returns_recorded_response(self):
+        """Test if a replayed request returns the recorded content and linear probability without any request."""
+        recorded = self.__record(return_linear_probability=True, top_logprobs=1)
+        self.stub_server.stop()
+
+        llm_backend.set_backend(llm_backend.ReplayBackend(self.cassette))
+        replayed = utils.query_gpt(self.messages, return_linear_probability=True, top_logprobs=1)
+
+        self.assertEqual(recorded, ("Doctor Visit", 0.99))
+        self.assertEqual(replayed, recorded)
+
+    def test_replay_of_unrecorded_request_fails(self):
+        """Test if a request that is missing from the cassette raises an error."""
+        self.__record()
+
+        llm_backend.set_backend(llm_backend.ReplayBackend(self.cassette))
+
+        with self.assertRaises(CassetteMissError):
+            utils.query_gpt(self.messages, max_tokens=10)
+
+    def test_gather_gpt_with_stub_backend(self):
+        """Test if concurrent requests are answered by the stub server."""
+        llm_backend.set_backend(llm_backend.StubBackend(self.stub_server))
+        messages_list = [[{"role": "user", "content": f"went to the doctor {index}"}] for index in range(5)]
+
+        outputs = utils.gather_gpt(messages_list)
+
+        self.assertEqual(outputs, ["Doctor Visit"] * 5)
+        self.assertEqual(self.stub_server.request_count, 5)
+
+    def test_stub_error_injection_is_retried(self):
+        """Test if injected rate limit errors are retried until the attempts are used up."""
+        self.stub_server.error_rate = 1.0
+        llm_backend.set_backend(llm_backend.StubBackend(self.stub_server))
+
+        with self.assertRaises(openai.RateLimitError):
+            utils.query_gpt(self.messages, retry_policy=RetryPolicy(max_attempts=3))
+
+        self.assertEqual(self.stub_server.request_count, 3)
+
+
+class SingleFlightTests(TestCase):
+    """Test cases for coalescing identical requests in flight."""
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """Set up method that gets called everytime before tests are executed."""
+        self.backend = mock.MagicMock(uses_rate_limit=False)
+        self.messages = [{"role": "user", "content": "went to the doctor"}]
+        self.patches = [
+            mock.patch("tracex.logic.utils.get_backend", return_value=self.backend),
+            mock.patch("tracex.logic.utils.get_single_flight", return_value=SingleFlight()),
+            mock.patch("tracex.logic.utils.get_cache", return_value=None),
+            mock.patch("tracex.logic.utils.log_tokens_used", return_value=lambda func: func),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):  # pylint: disable=invalid-name
+        """Tear down method that gets called after every test is executed."""
+        for patch in self.patches:
+            patch.stop()
+
+    def __slow_create(self, error=None):
+        """Return a side effect that answers a request after a delay, or raises an error after the delay."""
+
+        def create(**_kwargs):
+            time.sleep(0.2)
+            if error is not None:
+                raise error
+
+            return make_completion("Doctor Visit")
+
+        return create
+
+    def test_identical_requests_are_sent_once(self):
+        """Test if concurrent identical requests from several threads share one API call."""
+        self.backend.create.side_effect = self.__slow_create()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            outputs = list(executor.map(lambda _: utils.query_gpt(self.messages), range(4)))
+
+        self.assertEqual(outputs, ["Doctor Visit"] * 4)
+        self.assertEqual(self.backend.create.call_count, 1)
+
+    def test_identical_async_requests_are_sent_once(self):
+        """Test if identical requests of one batch share one API call."""
+
+        async def acreate(**kwargs):
+            await asyncio.sleep(0.2)
+
+            return make_completion(kwargs["messages"][0]["content"])
+
+        self.backend.acreate.side_effect = acreate
+
+        outputs = utils.gather_gpt([self.messages] * 3 + [[{"role": "user", "content": "fever"}]])
+
+        self.assertEqual(outputs, ["went to the doctor"] * 3 + ["fever"])
+        self.assertEqual(self.backend.acreate.call_count, 2)
+
+    def test_error_propagates_to_all_waiters(self):
+        """Test if the error of the leader is raised to all callers waiting for the same request."""
+        self.backend.create.side_effect = self.__slow_create(ValueError("context length exceeded"))
+
+        def query(_):
+            with self.assertRaises(ValueError):
+                utils.query_gpt(self.messages)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(query, range(4)))
+
+        self.assertEqual(self.backend.create.call_count, 1)
+
+    def test_follower_gets_result_when_leader_is_cancelled(self):
+        """Test if a caller waiting for a cancelled leader sends the request itself instead of being cancelled."""
+        leader_sent = asyncio.Event()
+
+        async def acreate(**_kwargs):
+            if not leader_sent.is_set():
+                leader_sent.set()
+                await asyncio.sleep(60)
+
+            return make_completion("Doctor Visit")
+
+        self.backend.acreate.side_effect = acreate
+
+        async def cancel_leader():
+            leader = asyncio.ensure_future(utils.aquery_gpt(self.messages))
+            await leader_sent.wait()
+            follower = asyncio.ensure_future(utils.aquery_gpt(self.messages))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+
+            return await follower, await asyncio.gather(leader, return_exceptions=True)
+
+        output, (leader_outcome,) = asyncio.run(cancel_leader())
+
+        self.assertEqual(output, "Doctor Visit")
+        self.assertIsInstance(leader_outcome, asyncio.CancelledError)
+        self.assertEqual(self.backend.acreate.call_count, 2)
+
+    def test_non_deterministic_requests_are_not_coalesced(self):
+        """Test if requests with a temperature above 0 are always sent."""
+        self.backend.create.side_effect = self.__slow_create()
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            list(executor.map(lambda _: utils.query_gpt(self.messages, temperature=1), range(3)))
+
+        self.assertEqual(self.backend.create.call_count, 3)
+
+
+def get_exact_encoder():
+    """Return the encode function of the cl100k_base encoding of tiktoken, or None if it is not available."""
+    try:
+        import tiktoken  # pylint: disable=import-outside-toplevel
+
+        return tiktoken.get_encoding("cl100k_base").encode
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+
+class TokenizerTests(TestCase):
+    """Test cases for the accuracy of the bundled tokenizer."""
+
+    fixtures = ["tracex_project/tracex/fixtures/dataframe_fixtures.json"]
+
+    def test_bundled_tokenizer_does_not_undercount_patient_journeys(self):
+        """Test if the bundled tokenizer counts at least the exact tokens of the Patient Journeys, but not far more."""
+        encode = get_exact_encoder()
+        if encode is None:
+            self.skipTest("tiktoken or its cl100k_base encoding is not available.")
+        patient_journeys = PatientJourney.manager.values_list("name", "patient_journey")
+        self.assertTrue(patient_journeys)
+
+        with mock.patch("tracex.logic.tokenizer._get_exact_encoder", return_value=None):
+            for name, patient_journey in patient_journeys:
+                with self.subTest(patient_journey=name):
+                    exact_tokens = len(encode(patient_journey))
+                    self.assertGreaterEqual(count_tokens(patient_journey), exact_tokens)
+                    self.assertLessEqual(count_tokens(patient_journey), exact_tokens * 1.5)
+
+
+class TokenBudgetTests(TestCase):
+    """Test cases for the prompt preflight and the token budget of a run."""
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """Set up method that gets called everytime before tests are executed."""
+        self.backend = mock.MagicMock(uses_rate_limit=False)
+        self.backend.create.return_value = make_completion("Doctor Visit")
+        self.messages = [
+            {"role": "system", "content": "Classify the event type."},
+            {"role": "user", "content": "went to the doctor"},
+        ]
+        self.patches = [
+            mock.patch("tracex.logic.utils.get_backend", return_value=self.backend),
+            mock.patch("tracex.logic.utils.get_cache", return_value=None),
+            mock.patch("tracex.logic.utils.log_tokens_used", return_value=lambda func: func),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):  # pylint: disable=invalid-name
+        """Tear down method that gets called after every test is executed."""
+        for patch in self.patches:
+            patch.stop()
+
+    def test_count_tokens_without_network(self):
+        """Test if the bundled tokenizer counts words, numbers and punctuation."""
+        self.assertEqual(count_tokens(""), 0)
+        self.assertEqual(count_tokens("Hello world"), 3)
+        self.assertGreater(count_tokens("Admitted to the hospital on 12/03/2021."), 6)
+        self.assertGreater(count_message_tokens(self.messages), count_tokens("went to the doctor"))
+
+    def test_preflight_truncates_long_prompt(self):
+        """Test if a prompt exceeding the context window is truncated to fit if truncation is allowed."""
+        messages = self.messages + [{"role": "user", "content": "I had a fever. " * 500}]
+
+        with mock.patch("tracex.logic.token_budget.LLM_CONTEXT_WINDOW", 300):
+            truncated_messages, prompt_tokens = preflight(messages, 100, overflow="truncate")
+
+        self.assertLessEqual(prompt_tokens, 200)
+        self.assertTrue(truncated_messages[2]["content"].endswith("[...]"))
+        self.assertEqual(truncated_messages[:2], self.messages)
+        self.assertEqual(messages[2]["content"], "I had a fever. " * 500)
+
+    def test_preflight_rejects_long_prompt(self):
+        """Test if a prompt exceeding the context window is rejected by default."""
+        messages = [{"role": "user", "content": "I had a fever. " * 500}]
+
+        with mock.patch("tracex.logic.token_budget.LLM_CONTEXT_WINDOW", 300):
+            with self.assertRaises(PromptTooLongError):
+                preflight(messages, 100)
+
+    def test_query_gpt_charges_token_budget(self):
+        """Test if requests are reserved with their worst case and settled with their actual usage."""
+        token_budget = TokenBudget(limit=10000)
+        token_budget.start_stage("Event Type Classifier")
+
+        with use_token_budget(token_budget):
+            utils.query_gpt(self.messages, max_tokens=50)
+        report = token_budget.get_report()
+
+        self.assertEqual(report["used_tokens"], 12)
+        self.assertEqual(report["worst_case_tokens"], count_message_tokens(self.messages) + 50)
+        self.assertEqual(report["stages"]["Event Type Classifier"]["requests"], 1)
+        self.assertEqual(token_budget.reserved_tokens, 0)
+        self.assertGreater(report["estimated_cost"], 0)
+
+    def test_request_exceeding_budget_is_not_sent(self):
+        """Test if a request that could exceed the budget is rejected before it is sent."""
+        token_budget = TokenBudget(limit=100)
+
+        with use_token_budget(token_budget):
+            with self.assertRaises(TokenBudgetExceededError):
+                utils.query_gpt(self.messages)
+
+        self.backend.create.assert_not_called()
+
+    def test_gather_gpt_uses_budget_of_caller(self):
+        """Test if requests sent on the background event loop count against the budget of the caller."""
+
+        async def acreate(**_kwargs):
+            return make_completion("Doctor Visit")
+
+        self.backend.acreate.side_effect = acreate
+        token_budget = TokenBudget()
+        messages_list = [[{"role": "user", "content": f"activity {index}"}] for index in range(3)]
+
+        with use_token_budget(token_budget):
+            utils.gather_gpt(messages_list, max_tokens=10)
+
+        self.assertEqual(token_budget.get_report()["requests"], 3)
+
+    def test_stage_view_reports_requests_of_its_stage(self):
+        """Test if requests sent with a view of the budget are reported in the stage of the view."""
+
+        async def acreate(**_kwargs):
+            return make_completion("Doctor Visit")
+
+        self.backend.acreate.side_effect = acreate
+        token_budget = TokenBudget()
+        token_budget.start_stage("Location Extractor")
+
+        with use_token_budget(token_budget.for_stage("Event Type Classifier")):
+            utils.gather_gpt([self.messages, self.messages], max_tokens=10)
+        report = token_budget.get_report()
+
+        self.assertEqual(report["stages"]["Event Type Classifier"]["requests"], 2)
+        self.assertNotIn("Location Extractor", report["stages"])
+        self.assertEqual(token_budget.reserved_tokens, 0)
+
+    def test_start_stage_fails_when_budget_is_used_up(self):
+        """Test if the next module is not started once the budget is used up."""
+        token_budget = TokenBudget(limit=20)
+        reserved_tokens = token_budget.reserve(10, 10)
+        token_budget.settle(reserved_tokens, SimpleNamespace(prompt_tokens=15, completion_tokens=5))
+
+        with self.assertRaises(TokenBudgetExceededError):
+            token_budget.start_stage("Metrics Analyzer")